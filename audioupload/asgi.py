@@ -3,6 +3,13 @@ ASGI config for audioupload project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Run it with an ASGI server, e.g. ``uvicorn audioupload.asgi:application``.
+Loading this module turns on SURVEY_ASYNC_STREAMING, so /api/stream-audio/
+(the stream_url every clip is served with) goes to the async stream view:
+the synchronous one would have its body buffered and hold a thread per
+download. Submissions have async endpoints under /api/async/
+(noise-responses, evaluations).
+
 For more information on this file, see
 https://docs.djangoproject.com/en/6.0/howto/deployment/asgi/
 """
@@ -11,6 +18,12 @@ import os
 
 from django.core.asgi import get_asgi_application
 
+from survey.journal import start_flusher
+
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'audioupload.settings')
+os.environ.setdefault('SURVEY_ASYNC_STREAMING', '1')
 
 application = get_asgi_application()
+
+# As in wsgi.py: replay a journal left by an earlier process right away.
+start_flusher()
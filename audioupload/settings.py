@@ -46,6 +46,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',  # Must be first
+    'survey.middleware.MetricsMiddleware',  # times everything below it
+    'survey.routers.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -85,6 +87,22 @@ DATABASES = {
     )
 }
 
+# Read replicas (survey/routers.py): comma-separated database URLs become the
+# aliases replica, replica2, ... Catalog, stats, export and admin reads of GET
+# requests go to a random replica; writes, and a client's reads for
+# SURVEY_REPLICA_LAG seconds after it wrote, stay on the primary. Without a
+# replica URL every read uses the primary.
+SURVEY_READ_REPLICAS = []
+for _index, _url in enumerate(filter(None, os.getenv('SURVEY_REPLICA_DATABASE_URLS', '').split(','))):
+    _alias = 'replica' if _index == 0 else f'replica{_index + 1}'
+    DATABASES[_alias] = {**dj_database_url.parse(_url.strip(), conn_max_age=600), 'TEST': {'MIRROR': 'default'}}
+    SURVEY_READ_REPLICAS.append(_alias)
+DATABASE_ROUTERS = ['survey.routers.ReplicaRouter']
+SURVEY_REPLICA_APPS = ['survey']
+SURVEY_REPLICA_LAG = 5  # seconds
+# Adds a `replica` mirror of the test database when none is configured.
+TEST_RUNNER = 'survey.test_runner.ReplicaMirrorRunner'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
@@ -160,5 +178,145 @@ REST_FRAMEWORK = {
 
 
 
-MEDIA_ROOT = BASE_DIR / 'media'
+MEDIA_ROOT = Path(os.getenv('MEDIA_ROOT', BASE_DIR / 'media'))
 MEDIA_URL = '/media/'
+
+
+# Survey export
+# Rows are queued in the ExportOutbox table on save and delivered by
+# `python manage.py run_export_worker`. Point SURVEY_EXPORT_SINK at
+# survey.export.CSVFileSink to write to a local file instead of Google Sheets.
+SURVEY_EXPORT_SINK = os.getenv('SURVEY_EXPORT_SINK', 'survey.export.GoogleSheetsSink')
+SURVEY_EXPORT_FILE = BASE_DIR / 'csv' / 'export_outbox.csv'
+SURVEY_EXPORT_BATCH_SIZE = 100
+SURVEY_EXPORT_POLL_INTERVAL = 5  # seconds
+SURVEY_EXPORT_RETRY_BASE = 10  # seconds, doubled on every failed attempt
+SURVEY_EXPORT_RETRY_MAX = 3600
+SURVEY_EXPORT_CLAIM_LEASE = 300  # seconds a worker holds a batch it is sending
+# Rows per append_rows call in `python manage.py sync_sheet`.
+SURVEY_SHEETS_SYNC_BATCH_SIZE = 1000
+# The question list used to build export rows is cached and invalidated on
+# save/delete. With the default per-process cache other workers only pick up
+# a change after this timeout; configure a shared CACHES backend to avoid that.
+SURVEY_QUESTION_CACHE_TIMEOUT = 300  # seconds
+
+# Largest list accepted by the bulk create endpoints.
+SURVEY_BULK_MAX_ITEMS = 500
+
+
+# Audio delivery for /api/stream-audio/<id>/: "stream", "sendfile",
+# "x-accel-redirect" or "x-sendfile" (see survey.views.AudioStreamView).
+# For x-accel-redirect, nginx needs an internal location mapped to MEDIA_ROOT:
+#   location /protected-media/ { internal; alias /path/to/media/; }
+SURVEY_AUDIO_DELIVERY = os.getenv('SURVEY_AUDIO_DELIVERY', 'stream')
+# Serve /api/stream-audio/ with the async view; audioupload/asgi.py turns it on.
+SURVEY_ASYNC_STREAMING = os.getenv('SURVEY_ASYNC_STREAMING', '') == '1'
+SURVEY_AUDIO_ACCEL_PREFIX = '/protected-media/'
+SURVEY_AUDIO_CACHE_CONTROL = 'public, max-age=3600'
+# For the content-hash versioned URLs (/api/stream-audio/<id>/<version>/)
+SURVEY_AUDIO_IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+SURVEY_AUDIO_STAT_TTL = 2  # seconds a clip's size/mtime are trusted before re-checking
+SURVEY_AUDIO_MAX_RANGES = 16  # more ranges than this in one request get the whole file
+
+# Waveform peaks computed at ingest, served from /api/audios/<id>/peaks/
+SURVEY_PEAKS_PER_SECOND = 50
+
+# Lighter derivatives of each clip, rendered at ingest or by manage.py
+# build_audio_variants (survey/variants.py) and stored under MEDIA_ROOT/variants/.
+# Request with ?variant=<name>; clients sending "Save-Data: on" or a slow ECT
+# hint get SURVEY_AUDIO_SAVE_DATA_VARIANT. A variant that is not rendered yet
+# falls back to the original.
+SURVEY_AUDIO_VARIANTS = {
+    'low': {'channels': 1, 'sample_rate': 22050},
+    'preview': {'channels': 1, 'sample_rate': 22050, 'seconds': 10},
+}
+SURVEY_AUDIO_SAVE_DATA_VARIANT = 'low'
+
+# Per-process LRU of memory-mapped clips used by the "stream" delivery path;
+# 0 disables it. Counters are at /api/stream-audio/cache-stats/.
+SURVEY_AUDIO_MMAP_CACHE_BYTES = 256 * 1024 * 1024
+
+# /api/bootstrap/ and the audio / noise-question lists are served from a
+# cached, pre-serialized payload that is rebuilt when the catalog changes.
+# The catalog version is kept in MEDIA_ROOT/.catalog-version, so all workers
+# see a change at once as long as they share MEDIA_ROOT.
+SURVEY_CATALOG_CACHE_TIMEOUT = 300  # seconds
+SURVEY_CATALOG_MAX_AGE = 60  # Cache-Control max-age sent to clients
+
+# Confidence level of the intervals served by /api/stats/audios/
+SURVEY_STATS_CONFIDENCE = 0.95
+
+# Full range of the PAQ sliders, used to scale the ISO 12913-3 coordinates to -1..1
+SURVEY_PAQ_SCALE_RANGE = 100
+# Bins per axis of the density grid served by /api/stats/audios/<id>/soundscape/
+SURVEY_SOUNDSCAPE_GRID_BINS = 10
+
+# Rows fetched per round trip by the wide-format research export
+SURVEY_RESEARCH_EXPORT_CHUNK_SIZE = 2000
+
+# Resumable chunked uploads at /api/uploads/ (survey/uploads.py). Bodies are
+# copied to disk in blocks of this size; unfinished uploads idle for longer
+# than SURVEY_UPLOAD_EXPIRY are removed by `manage.py purge_uploads`.
+SURVEY_UPLOAD_MAX_BYTES = 4 * 1024 ** 3
+SURVEY_UPLOAD_BLOCK_SIZE = 256 * 1024
+SURVEY_UPLOAD_EXPIRY = 24 * 3600  # seconds
+SURVEY_UPLOAD_WRITE_LEASE = 600  # seconds one PUT may hold the upload's offset
+
+# Write-behind mode for bursts of submissions (survey/journal.py): noise
+# responses and evaluations are validated, appended to a local SQLite
+# journal and answered with 202; a flusher thread in each web process
+# commits them in batches. Set SURVEY_WRITE_BEHIND_FLUSHER=False when
+# `manage.py flush_journal` runs as its own process instead.
+SURVEY_WRITE_BEHIND = os.getenv('SURVEY_WRITE_BEHIND', '').lower() in ('1', 'true', 'yes')
+SURVEY_WRITE_BEHIND_JOURNAL = Path(os.getenv('SURVEY_WRITE_BEHIND_JOURNAL', BASE_DIR / 'journal.sqlite3'))
+SURVEY_WRITE_BEHIND_FLUSHER = True
+SURVEY_WRITE_BEHIND_BATCH_SIZE = 500
+SURVEY_WRITE_BEHIND_INTERVAL = 0.25  # seconds between flushes when idle
+SURVEY_WRITE_BEHIND_LEASE = 60  # seconds before a claimed batch may be retried by another flusher
+
+# Request metrics (survey/middleware.py), scraped from /metrics
+SURVEY_METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # seconds
+SURVEY_METRICS_TOKEN = os.getenv('SURVEY_METRICS_TOKEN', '')  # without it, /metrics is staff only
+SURVEY_METRICS_QUEUE_TTL = 5  # seconds an outbox depth reading is reused
+SURVEY_SERVER_TIMING = True
+
+# Structured logging (survey/log.py). Request threads only enqueue records; a
+# listener thread writes JSON lines to stdout. SURVEY_LOG_LEVELS sets levels per
+# module, e.g. "survey.views=WARNING,survey.export=DEBUG".
+SURVEY_LOG_LEVEL = os.getenv('SURVEY_LOG_LEVEL', 'INFO')
+SURVEY_LOG_SAMPLE_RATE = float(os.getenv('SURVEY_LOG_SAMPLE_RATE', '0.1'))  # below WARNING in hot views
+SURVEY_LOG_REDACT_FIELDS = ['user_id', 'age', 'gender', 'password', 'token', 'authorization']
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {'()': 'survey.log.JsonFormatter'},
+    },
+    'filters': {
+        'redact': {'()': 'survey.log.RedactFilter', 'fields': SURVEY_LOG_REDACT_FIELDS},
+        'sample': {'()': 'survey.log.SamplingFilter', 'rate': SURVEY_LOG_SAMPLE_RATE},
+    },
+    'handlers': {
+        'queue': {
+            '()': 'survey.log.BackgroundHandler',
+            'formatter': 'json',
+            'filters': ['redact'],
+        },
+    },
+    'root': {'handlers': ['queue'], 'level': 'WARNING'},
+    'loggers': {
+        'survey': {'handlers': ['queue'], 'level': SURVEY_LOG_LEVEL, 'propagate': False},
+        'survey.views': {'level': SURVEY_LOG_LEVEL, 'filters': ['sample']},
+        # Replace Django's own console handlers, which write synchronously.
+        'django': {'handlers': ['queue'], 'level': 'INFO', 'propagate': False},
+        'django.server': {'handlers': ['queue'], 'level': 'INFO', 'propagate': False},
+        'django.request': {'level': 'ERROR'},  # 4xx are in the metrics, not one line each
+        **{
+            name.strip(): {'level': level.strip().upper()}
+            for name, _, level in (
+                item.partition('=') for item in os.getenv('SURVEY_LOG_LEVELS', '').split(',') if '=' in item
+            )
+        },
+    },
+}
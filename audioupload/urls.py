@@ -18,10 +18,12 @@ from django.contrib import admin
 from django.urls import path,include
 from django.conf import settings
 from django.conf.urls.static import static
+from survey.views import MetricsView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path("api/", include("survey.urls")),
+    path("metrics", MetricsView.as_view(), name="metrics"),  # Prometheus scrape target
 ]
 
 
@@ -11,6 +11,12 @@ import os
 
 from django.core.wsgi import get_wsgi_application
 
+from survey.journal import start_flusher
+
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'audioupload.settings')
 
 application = get_wsgi_application()
+
+# This process serves requests: start the write-behind flusher now, so a
+# journal left by an earlier process is replayed before any request comes in.
+start_flusher()
@@ -0,0 +1,135 @@
+"""
+Compares the AudioStreamView delivery modes (SURVEY_AUDIO_DELIVERY).
+
+The Django WSGI application is driven in-process by a minimal server loop
+that behaves like gunicorn: responses handed to wsgi.file_wrapper are sent
+with os.sendfile, everything else is iterated chunk by chunk. Bytes go to
+/dev/null so the numbers show the cost inside the worker only:
+
+  busy ms   wall time the worker spends on one request (worker occupancy)
+  cpu ms    CPU time of that request in the worker
+  MB/s      audio bytes delivered per second of worker busy time
+
+For x-accel-redirect only headers leave the worker; the proxy sends the bytes.
+
+    python benchmarks/bench_audio_delivery.py --requests 200 --seconds 30
+"""
+import os
+import time
+import argparse
+
+from common import setup_django, test_database, temp_media_root, write_wav, percentiles, write_results
+
+MODES = ['stream', 'sendfile', 'x-accel-redirect']
+
+
+class SendfileWrapper:
+    """
+    Stand-in for gunicorn's wsgi.file_wrapper.
+    """
+
+    def __init__(self, filelike, block_size=8192):
+        self.filelike = filelike
+
+    def close(self):
+        self.filelike.close()
+
+
+def serve(app, environ, out_fd):
+    """
+    Runs one request through `app` and writes the body to `out_fd`.
+    Returns the number of body bytes sent.
+    """
+    def start_response(status, headers, exc_info=None):
+        return lambda data: None
+
+    result = app(environ, start_response)
+    sent = 0
+    try:
+        if isinstance(result, SendfileWrapper):
+            f = result.filelike
+            offset = f.tell()
+            size = os.fstat(f.fileno()).st_size - offset
+            while sent < size:
+                sent += os.sendfile(out_fd, f.fileno(), offset + sent, size - sent)
+        else:
+            for chunk in result:
+                os.write(out_fd, chunk)
+                sent += len(chunk)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return sent
+
+
+def run_mode(app, environ_for, mode, requests, range_header):
+    from django.conf import settings
+
+    settings.SURVEY_AUDIO_DELIVERY = mode
+    busy, cpu, total_bytes = [], [], 0
+    with open(os.devnull, 'wb') as devnull:
+        for _ in range(requests):
+            environ = environ_for(range_header)
+            start_wall, start_cpu = time.perf_counter(), time.process_time()
+            total_bytes += serve(app, environ, devnull.fileno())
+            busy.append(time.perf_counter() - start_wall)
+            cpu.append(time.process_time() - start_cpu)
+
+    busy_total = sum(busy)
+    return {
+        'mode': mode,
+        'range': range_header or None,
+        'busy': percentiles(busy),
+        'cpu_ms_mean': sum(cpu) / len(cpu) * 1000,
+        'bytes': total_bytes,
+        'mb_per_busy_second': total_bytes / busy_total / 1e6 if busy_total else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--seconds', type=float, default=30.0, help="Length of the generated clip.")
+    parser.add_argument('--output', help="Write JSON results to this file.")
+    args = parser.parse_args()
+
+    setup_django(DEBUG=False)
+    from django.core.wsgi import get_wsgi_application
+    from django.test import RequestFactory
+    from survey.models import Audio
+    from survey.audio import stream_path
+
+    results = []
+    with test_database(), temp_media_root() as media:
+        write_wav(media / 'audios' / 'bench.wav', seconds=args.seconds)
+        audio = Audio.objects.create(title='Bench', file='audios/bench.wav')
+        size = os.path.getsize(audio.file.path)
+        print(f"Clip: {size / 1e6:.1f} MB, {args.requests} requests per mode\n")
+
+        app = get_wsgi_application()
+        factory = RequestFactory()
+
+        def environ_for(range_header):
+            environ = factory.get(stream_path(audio)).environ
+            environ['wsgi.file_wrapper'] = SendfileWrapper
+            if range_header:
+                environ['HTTP_RANGE'] = range_header
+            return environ
+
+        print(f"{'mode':<18}{'range':<16}{'busy p50':>10}{'busy p95':>10}{'cpu ms':>10}{'MB/s':>10}")
+        for range_header in ('', 'bytes=0-'):
+            for mode in MODES:
+                result = run_mode(app, environ_for, mode, args.requests, range_header)
+                results.append(result)
+                print(
+                    f"{mode:<18}{range_header or 'full':<16}"
+                    f"{result['busy']['p50_ms']:>10.2f}{result['busy']['p95_ms']:>10.2f}"
+                    f"{result['cpu_ms_mean']:>10.2f}"
+                    f"{(result['mb_per_busy_second'] or 0):>10.0f}"
+                )
+
+    write_results(args.output, {'clip_bytes': size, 'requests': args.requests, 'results': results})
+
+
+if __name__ == '__main__':
+    main()
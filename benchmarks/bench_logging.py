@@ -0,0 +1,140 @@
+"""
+Per-call and per-request cost of logging when the log destination is slow.
+
+A slow destination (a blocked stdout pipe, a busy log shipper) is simulated
+with a stream whose write() sleeps --write-latency-ms. Compared:
+
+  print        print() to that stream (what the views used to do)
+  sync         logging.StreamHandler writing to it from the request thread
+  background   survey.log.BackgroundHandler: enqueue only, written by a thread
+  off          no handler (baseline)
+
+The request benchmark posts single noise responses through the test client
+with survey.views at DEBUG and no sampling, the worst case for the views.
+
+    python benchmarks/bench_logging.py --calls 2000 --requests 300 --write-latency-ms 2
+"""
+import io
+import time
+import logging
+import argparse
+import contextlib
+
+from common import setup_django, test_database, percentiles, write_results
+
+
+class SlowStream(io.TextIOBase):
+    def __init__(self, latency):
+        self.latency = latency
+        self.lines = 0
+
+    def write(self, text):
+        if self.latency:
+            time.sleep(self.latency)
+        self.lines += 1
+        return len(text)
+
+
+def make_handler(mode, stream):
+    from survey.log import BackgroundHandler, JsonFormatter, RedactFilter
+
+    if mode == 'sync':
+        handler = logging.StreamHandler(stream)
+    elif mode == 'background':
+        handler = BackgroundHandler(stream, maxsize=100000)
+    else:
+        return None
+    handler.setFormatter(JsonFormatter())
+    handler.addFilter(RedactFilter(['user_id', 'age', 'gender']))
+    return handler
+
+
+@contextlib.contextmanager
+def logging_mode(mode, stream):
+    logger = logging.getLogger('survey.views')
+    old_handlers, old_level, old_propagate, old_filters = logger.handlers[:], logger.level, logger.propagate, logger.filters[:]
+    handler = make_handler(mode, stream)
+    logger.handlers = [handler] if handler else []
+    logger.filters = []
+    logger.setLevel(logging.DEBUG if mode != 'off' else logging.CRITICAL)
+    logger.propagate = False
+    try:
+        yield logger
+    finally:
+        if handler:
+            handler.close()
+        logger.handlers, logger.filters = old_handlers, old_filters
+        logger.setLevel(old_level)
+        logger.propagate = old_propagate
+
+
+def bench_calls(mode, calls, latency):
+    stream = SlowStream(latency)
+    payload = {'user': 1, 'question': 3, 'rating': 4, 'user_id': 'P-0042'}
+    samples = []
+    with logging_mode(mode, stream) as logger:
+        for _ in range(calls):
+            start = time.perf_counter()
+            if mode == 'print':
+                print("Incoming POST data:", payload, file=stream)
+            else:
+                logger.debug("Noise response received", extra={'payload': payload})
+            samples.append(time.perf_counter() - start)
+    return percentiles(samples)
+
+
+def bench_requests(mode, requests, latency):
+    from django.test import Client
+    from survey.models import UserProfile, NoiseQuestion, NoiseResponse
+
+    stream = SlowStream(latency)
+    client = Client()
+    questions = list(NoiseQuestion.objects.all())
+    samples = []
+    with logging_mode(mode if mode != 'print' else 'sync', stream):
+        for n in range(requests):
+            user = UserProfile.objects.create(user_id=f'{mode[:2]}{n}', age=30)
+            start = time.perf_counter()
+            response = client.post(
+                '/api/noise-responses/',
+                {'user': user.pk, 'question': questions[n % len(questions)].pk, 'rating': 3},
+                content_type='application/json',
+            )
+            samples.append(time.perf_counter() - start)
+            assert response.status_code == 201, response.content
+    NoiseResponse.objects.all().delete()
+    UserProfile.objects.all().delete()
+    return percentiles(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=2000)
+    parser.add_argument('--requests', type=int, default=300)
+    parser.add_argument('--write-latency-ms', type=float, default=2.0)
+    parser.add_argument('--output', help="Write JSON results to this file.")
+    args = parser.parse_args()
+
+    setup_django(DEBUG=False)
+    latency = args.write_latency_ms / 1000
+    results = {'args': vars(args), 'calls': {}, 'requests': {}}
+
+    for mode in ('off', 'print', 'sync', 'background'):
+        result = results['calls'][mode] = bench_calls(mode, args.calls, latency)
+        print(f"call     {mode:<10} p50={result['p50_ms'] * 1000:.1f}us p99={result['p99_ms'] * 1000:.1f}us")
+
+    with test_database():
+        from survey.models import NoiseQuestion
+
+        for n in range(1, 22):
+            NoiseQuestion.objects.create(number=n, text=f'Question {n}')
+        for mode in ('off', 'sync', 'background'):
+            result = results['requests'][mode] = bench_requests(mode, args.requests, latency)
+            print(f"request  {mode:<10} p50={result['p50_ms']:.2f}ms p95={result['p95_ms']:.2f}ms "
+                  f"p99={result['p99_ms']:.2f}ms")
+
+    write_results(args.output, results)
+
+
+if __name__ == '__main__':
+    main()
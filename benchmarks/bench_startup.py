@@ -0,0 +1,105 @@
+"""
+Worker startup cost: import time and resident memory of a fresh process
+that loads the WSGI application and the URLconf, as a gunicorn worker
+does before its first request.
+
+  wsgi     the application as configured
+  eager    the same plus the Google Sheets stack (gspread, oauth2client,
+           dotenv) imported up front, as survey/signals.py used to
+
+Every sample is a new interpreter. Reported per mode: startup time inside
+the process, wall time including interpreter start, and peak RSS.
+
+    python benchmarks/bench_startup.py --runs 10 --max-startup-ms 1500 --max-rss-mb 150
+
+Exits with status 1 if `wsgi` imports any of the lazily loaded modules or
+exceeds one of the given limits, so it can guard against regressions in CI.
+"""
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+from common import BASE_DIR, write_results
+
+
+LAZY_MODULES = ('gspread', 'oauth2client', 'dotenv')
+
+CHILD = """
+import os, sys, json, time, resource
+start = time.perf_counter()
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'audioupload.settings')
+if {eager!r}:
+    import gspread, oauth2client.service_account, dotenv
+from django.core.wsgi import get_wsgi_application
+get_wsgi_application()
+from django.urls import get_resolver
+get_resolver().url_patterns
+print(json.dumps({{
+    'startup_seconds': time.perf_counter() - start,
+    'rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    'modules': len(sys.modules),
+    'lazy_loaded': sorted({{name.split('.')[0] for name in sys.modules}} & set({lazy!r})),
+}}))
+"""
+
+
+def sample(mode):
+    code = CHILD.format(eager=mode == 'eager', lazy=LAZY_MODULES)
+    start = time.perf_counter()
+    out = subprocess.run(
+        [sys.executable, '-c', code], cwd=BASE_DIR, check=True, capture_output=True, text=True,
+    )
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+    result['wall_seconds'] = time.perf_counter() - start
+    return result
+
+
+def summarize(samples):
+    def median(key):
+        return statistics.median(s[key] for s in samples)
+
+    return {
+        'runs': len(samples),
+        'startup_ms': median('startup_seconds') * 1000,
+        'wall_ms': median('wall_seconds') * 1000,
+        'rss_mb': median('rss_kb') / 1024,
+        'modules': median('modules'),
+        'lazy_loaded': sorted({name for s in samples for name in s['lazy_loaded']}),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--max-startup-ms', type=float, help="Fail if the median wsgi startup is slower.")
+    parser.add_argument('--max-rss-mb', type=float, help="Fail if the median wsgi RSS is larger.")
+    parser.add_argument('--output', help="Write JSON results to this file.")
+    args = parser.parse_args()
+
+    results = {'args': vars(args), 'modes': {}}
+    for mode in ('wsgi', 'eager'):
+        result = results['modes'][mode] = summarize([sample(mode) for _ in range(args.runs)])
+        print(f"{mode:<6} startup={result['startup_ms']:.0f}ms wall={result['wall_ms']:.0f}ms "
+              f"rss={result['rss_mb']:.1f}MB modules={result['modules']:.0f}")
+
+    wsgi = results['modes']['wsgi']
+    failures = []
+    if wsgi['lazy_loaded']:
+        failures.append(f"imported at startup: {', '.join(wsgi['lazy_loaded'])}")
+    if args.max_startup_ms and wsgi['startup_ms'] > args.max_startup_ms:
+        failures.append(f"startup {wsgi['startup_ms']:.0f}ms > {args.max_startup_ms:.0f}ms")
+    if args.max_rss_mb and wsgi['rss_mb'] > args.max_rss_mb:
+        failures.append(f"RSS {wsgi['rss_mb']:.1f}MB > {args.max_rss_mb:.1f}MB")
+    results['failures'] = failures
+
+    write_results(args.output, results)
+    for failure in failures:
+        print(f"REGRESSION: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
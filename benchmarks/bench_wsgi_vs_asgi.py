@@ -0,0 +1,184 @@
+"""
+Load test of concurrent slow audio downloads: gunicorn (WSGI) vs uvicorn (ASGI).
+
+Both servers run against a throwaway SQLite database and MEDIA_ROOT. Every
+client downloads the same clip at --client-kbps (a slow phone), all
+--concurrency clients at once, for --rounds rounds. WSGI clients use
+/api/stream-audio/<id>/<version>/, ASGI clients the async view at
+/api/async/stream-audio/<id>/<version>/.
+
+    pip install gunicorn uvicorn
+    python benchmarks/bench_wsgi_vs_asgi.py --concurrency 200 --client-kbps 256
+
+Reported per server: time to first byte percentiles, completed / failed
+downloads, wall time and aggregate throughput.
+"""
+import os
+import sys
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import importlib.util
+from pathlib import Path
+
+from common import BASE_DIR, write_wav, percentiles, write_results
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with {process.returncode}")
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("Server did not start")
+
+
+def prepare_environment(workdir, seconds):
+    env = dict(os.environ)
+    env['DATABASE_URL'] = f"sqlite:///{workdir / 'bench.sqlite3'}"
+    env['MEDIA_ROOT'] = str(workdir / 'media')
+    env['DJANGO_SETTINGS_MODULE'] = 'audioupload.settings'
+    write_wav(workdir / 'media' / 'audios' / 'bench.wav', seconds=seconds)
+
+    manage = [sys.executable, str(BASE_DIR / 'manage.py')]
+    subprocess.run(manage + ['migrate', '--verbosity', '0'], env=env, cwd=BASE_DIR, check=True)
+    out = subprocess.run(
+        manage + ['shell', '-c', "from survey.models import Audio; from survey.audio import stream_path; "
+                                 "print(stream_path(Audio.objects.create(title='Bench', file='audios/bench.wav'), ''))"],
+        env=env, cwd=BASE_DIR, check=True, capture_output=True, text=True,
+    )
+    return env, out.stdout.strip().splitlines()[-1]
+
+
+async def download(port, path, bytes_per_second):
+    start = time.perf_counter()
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n".encode())
+    await writer.drain()
+    head = await reader.readuntil(b"\r\n\r\n")
+    ttfb = time.perf_counter() - start
+    status = int(head.split(b" ", 2)[1])
+    received = 0
+    while True:
+        chunk = await reader.read(65536)
+        if not chunk:
+            break
+        received += len(chunk)
+        if bytes_per_second:
+            await asyncio.sleep(len(chunk) / bytes_per_second)
+    writer.close()
+    return status, ttfb, time.perf_counter() - start, received
+
+
+async def run_load(port, path, concurrency, rounds, bytes_per_second, timeout):
+    ttfb, durations, failures, total_bytes = [], [], 0, 0
+
+    async def one():
+        nonlocal failures, total_bytes
+        try:
+            status, first, duration, received = await asyncio.wait_for(
+                download(port, path, bytes_per_second), timeout
+            )
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            failures += 1
+            return
+        if status >= 400:
+            failures += 1
+            return
+        ttfb.append(first)
+        durations.append(duration)
+        total_bytes += received
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        await asyncio.gather(*(one() for _ in range(concurrency)))
+    wall = time.perf_counter() - start
+    return {
+        'ttfb': percentiles(ttfb),
+        'download': percentiles(durations),
+        'completed': len(durations),
+        'failed': failures,
+        'wall_s': wall,
+        'mb_per_s': total_bytes / wall / 1e6,
+    }
+
+
+SERVERS = {
+    'gunicorn': {
+        'module': 'gunicorn',
+        'path': '/api/stream-audio/{clip}',
+        'command': lambda port, workers: [
+            sys.executable, '-m', 'gunicorn', 'audioupload.wsgi:application',
+            '--bind', f'127.0.0.1:{port}', '--workers', str(workers), '--log-level', 'warning',
+        ],
+    },
+    'uvicorn': {
+        'module': 'uvicorn',
+        'path': '/api/async/stream-audio/{clip}',
+        'command': lambda port, workers: [
+            sys.executable, '-m', 'uvicorn', 'audioupload.asgi:application',
+            '--host', '127.0.0.1', '--port', str(port), '--workers', str(workers), '--log-level', 'warning',
+        ],
+    },
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--rounds', type=int, default=1)
+    parser.add_argument('--client-kbps', type=float, default=512, help="Per-client read rate; 0 = unthrottled.")
+    parser.add_argument('--seconds', type=float, default=10.0, help="Length of the generated clip.")
+    parser.add_argument('--gunicorn-workers', type=int, default=4)
+    parser.add_argument('--uvicorn-workers', type=int, default=1)
+    parser.add_argument('--timeout', type=float, default=300.0, help="Per-download timeout in seconds.")
+    parser.add_argument('--output', help="Write JSON results to this file.")
+    args = parser.parse_args()
+
+    results = {'args': vars(args), 'servers': {}}
+    bytes_per_second = args.client_kbps * 1024 / 8
+
+    with tempfile.TemporaryDirectory(prefix='bench-asgi-') as tmp:
+        env, clip_path = prepare_environment(Path(tmp), args.seconds)
+        for name, server in SERVERS.items():
+            if importlib.util.find_spec(server['module']) is None:
+                print(f"{name}: not installed, skipped")
+                continue
+            workers = args.gunicorn_workers if name == 'gunicorn' else args.uvicorn_workers
+            port = free_port()
+            process = subprocess.Popen(server['command'](port, workers), env=env, cwd=BASE_DIR)
+            try:
+                wait_for_port(port, process)
+                result = asyncio.run(run_load(
+                    port, server['path'].format(clip=clip_path), args.concurrency,
+                    args.rounds, bytes_per_second, args.timeout,
+                ))
+            finally:
+                process.terminate()
+                process.wait(timeout=30)
+            result['workers'] = workers
+            results['servers'][name] = result
+            print(
+                f"{name:<9} workers={workers:<3} ok={result['completed']:<5} failed={result['failed']:<4} "
+                f"ttfb p50={result['ttfb'].get('p50_ms', 0):.0f}ms p95={result['ttfb'].get('p95_ms', 0):.0f}ms "
+                f"wall={result['wall_s']:.1f}s {result['mb_per_s']:.1f} MB/s"
+            )
+
+    write_results(args.output, results)
+
+
+if __name__ == '__main__':
+    main()
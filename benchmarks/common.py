@@ -0,0 +1,122 @@
+"""
+Helpers shared by the benchmark scripts in this directory.
+
+Every script is run from the project root, e.g.
+
+    python benchmarks/bench_audio_delivery.py
+
+and works against a throwaway test database and MEDIA_ROOT, so it never
+touches db.sqlite3 or the real media files.
+"""
+import os
+import sys
+import json
+import wave
+import shutil
+import tempfile
+import statistics
+from contextlib import contextmanager
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+
+def setup_django(**overrides):
+    """
+    Configures Django for a benchmark. `overrides` replace settings before setup().
+    """
+    sys.path.insert(0, str(BASE_DIR))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'audioupload.settings')
+
+    import django
+    from django.conf import settings
+
+    for name, value in overrides.items():
+        setattr(settings, name, value)
+    django.setup()
+
+
+@contextmanager
+def test_database():
+    """
+    Creates and migrates a test database for the duration of the block.
+    """
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+@contextmanager
+def temp_media_root():
+    """
+    Points MEDIA_ROOT at a temporary directory for the duration of the block.
+    """
+    from django.conf import settings
+
+    old_root = settings.MEDIA_ROOT
+    path = tempfile.mkdtemp(prefix='bench-media-')
+    settings.MEDIA_ROOT = path
+    try:
+        yield Path(path)
+    finally:
+        settings.MEDIA_ROOT = old_root
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def write_wav(path, seconds=10.0, rate=44100, channels=2):
+    """
+    Writes a 16-bit PCM WAV of a quiet tone, roughly the size of a survey clip.
+    """
+    import numpy as np
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    t = np.arange(int(seconds * rate)) / rate
+    tone = (0.2 * np.sin(2 * np.pi * 440 * t) * 32767).astype('<i2')
+    frames = np.repeat(tone[:, None], channels, axis=1)
+    with wave.open(str(path), 'wb') as f:
+        f.setnchannels(channels)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(frames.tobytes())
+    return path
+
+
+def percentiles(samples):
+    """
+    p50/p95/p99/mean/max in milliseconds for a list of durations in seconds.
+    """
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def pick(q):
+        return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))] * 1000
+
+    return {
+        'count': len(ordered),
+        'mean_ms': statistics.fmean(ordered) * 1000,
+        'p50_ms': pick(0.50),
+        'p95_ms': pick(0.95),
+        'p99_ms': pick(0.99),
+        'max_ms': ordered[-1] * 1000,
+    }
+
+
+def write_results(path, results):
+    """
+    Saves results as JSON so runs can be compared later.
+    """
+    if not path:
+        return
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, sort_keys=True, default=str)
+    print(f"Results written to {path}")
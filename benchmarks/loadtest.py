@@ -0,0 +1,445 @@
+"""
+End-to-end load test: concurrent participants replaying a full survey session.
+
+Every simulated participant:
+
+  1. creates a UserProfile             POST /api/users/
+  2. fetches the catalog               GET  /api/bootstrap/
+  3. answers the noise questionnaire   POST /api/noise-responses/  (one list)
+  4. plays every clip with Range       GET  /api/stream-audio/<id>/<version>/ (sequential ranges)
+     requests of --range-bytes
+  5. submits the evaluations           POST /api/evaluations/      (one list)
+
+Targets:
+
+  --target client   in-process Django test client on a throwaway database
+                    (reports query counts per endpoint)
+  --target serve    starts gunicorn (or --server uvicorn) on a throwaway
+                    database and MEDIA_ROOT, plus an export worker; under
+                    uvicorn the stream_url clips are played from is served
+                    by the async stream view (SURVEY_ASYNC_STREAMING)
+  --target url      an already running deployment at --url; it must already
+                    have clips and questions
+
+Google Sheets is never contacted: exports go to StubSheetsSink, which only
+counts rows and sleeps --sheets-latency-ms per batch.
+
+    python benchmarks/loadtest.py --target client --participants 50 --concurrency 10
+    python benchmarks/loadtest.py --target serve --participants 500 --concurrency 100 --output run.json
+
+Reported per endpoint: p50/p95/p99 latency, requests/s, errors, bytes served
+and (client target) SQL queries per request. Results are saved as JSON with
+--output so runs can be compared.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+import statistics
+from pathlib import Path
+from collections import defaultdict
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+
+from common import BASE_DIR, setup_django, test_database, temp_media_root, write_wav, percentiles, write_results
+
+BENCH_DIR = Path(__file__).resolve().parent
+
+
+class StubSheetsSink:
+    """
+    Stand-in for GoogleSheetsSink: counts rows and simulates the API round trip.
+    """
+    latency = float(os.getenv('LOADTEST_SHEETS_LATENCY_MS', '0')) / 1000
+    rows = 0
+    batches = 0
+
+    def write_rows(self, header_row, rows):
+        if self.latency:
+            time.sleep(self.latency)
+        type(self).rows += len(rows)
+        type(self).batches += 1
+
+
+def seed_catalog(media_root, clips, questions, seconds):
+    """
+    Creates `clips` WAV clips and `questions` noise questions in the current database.
+    """
+    from survey.models import Audio, NoiseQuestion
+
+    for n in range(1, clips + 1):
+        write_wav(Path(media_root) / 'audios' / f'loadtest{n}.wav', seconds=seconds)
+        Audio.objects.create(title=f'Clip {n}', file=f'audios/loadtest{n}.wav')
+    for n in range(1, questions + 1):
+        NoiseQuestion.objects.create(number=n, text=f'Question {n}')
+
+
+class Recorder:
+    """
+    Thread-safe per-endpoint samples.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latency = defaultdict(list)
+        self.queries = defaultdict(list)
+        self.bytes = defaultdict(int)
+        self.errors = defaultdict(int)
+
+    def add(self, endpoint, seconds, status, size, queries=None):
+        with self.lock:
+            self.latency[endpoint].append(seconds)
+            self.bytes[endpoint] += size
+            if status >= 400:
+                self.errors[endpoint] += 1
+            if queries is not None:
+                self.queries[endpoint].append(queries)
+
+    def report(self, wall):
+        endpoints = {}
+        for endpoint, samples in sorted(self.latency.items()):
+            entry = {
+                'latency': percentiles(samples),
+                'requests': len(samples),
+                'requests_per_s': len(samples) / wall if wall else 0,
+                'errors': self.errors[endpoint],
+                'bytes': self.bytes[endpoint],
+                'mb_per_s': self.bytes[endpoint] / wall / 1e6 if wall else 0,
+            }
+            if self.queries[endpoint]:
+                entry['queries'] = {
+                    'mean': statistics.fmean(self.queries[endpoint]),
+                    'max': max(self.queries[endpoint]),
+                }
+            endpoints[endpoint] = entry
+        return endpoints
+
+
+class ClientTransport:
+    """
+    Django test client; one per thread. Counts queries with CaptureQueriesContext.
+    """
+
+    def __init__(self):
+        from django.test import Client
+
+        # Server errors become 500 samples instead of exceptions in the worker thread.
+        self.client = Client(raise_request_exception=False)
+
+    def request(self, method, path, body=None, headers=None):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        extra = {f"HTTP_{name.upper().replace('-', '_')}": value for name, value in (headers or {}).items()}
+        with CaptureQueriesContext(connection) as queries:
+            if method == 'GET':
+                response = self.client.get(path, **extra)
+            else:
+                response = self.client.post(path, json.dumps(body), content_type='application/json', **extra)
+            content = b''.join(response.streaming_content) if response.streaming else response.content
+        return response.status_code, dict(response.items()), content, len(queries)
+
+    def close(self):
+        from django.db import connection
+
+        connection.close()
+
+
+class HTTPTransport:
+    """
+    Keep-alive HTTP/1.1 connection to a live server; one per thread.
+    """
+
+    def __init__(self, base_url):
+        parts = urlsplit(base_url)
+        connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.connection = connection_class(parts.hostname, parts.port, timeout=60)
+        self.host = parts.netloc
+
+    def request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode()
+            headers['Content-Type'] = 'application/json'
+        try:
+            self.connection.request(method, path, body=data, headers=headers)
+            response = self.connection.getresponse()
+            content = response.read()
+        except (http.client.HTTPException, OSError):
+            self.connection.close()
+            raise
+        return response.status, {k: v for k, v in response.getheaders()}, content, None
+
+    def close(self):
+        self.connection.close()
+
+
+def timed(recorder, transport, endpoint, method, path, body=None, headers=None):
+    start = time.perf_counter()
+    try:
+        status, response_headers, content, queries = transport.request(method, path, body, headers)
+    except (http.client.HTTPException, OSError):
+        recorder.add(endpoint, time.perf_counter() - start, 599, 0)
+        return 599, {}, b''
+    recorder.add(endpoint, time.perf_counter() - start, status, len(content), queries)
+    return status, response_headers, content
+
+
+def stream_clip(recorder, transport, path, range_bytes):
+    """
+    Fetches a clip the way an audio element does: consecutive Range requests.
+    """
+    start, total = 0, None
+    while total is None or start < total:
+        status, headers, content = timed(
+            recorder, transport, 'GET /api/stream-audio/<id>/<version>/', 'GET', path,
+            headers={'Range': f'bytes={start}-{start + range_bytes - 1}'},
+        )
+        if status != 206 or not content:
+            return
+        content_range = {k.lower(): v for k, v in headers.items()}.get('content-range', '')
+        total = int(content_range.rsplit('/', 1)[-1]) if '/' in content_range else start + len(content)
+        start += len(content)
+
+
+def run_session(recorder, transport, args, rng):
+    status, _, content = timed(
+        recorder, transport, 'POST /api/users/', 'POST', '/api/users/',
+        {'user_id': uuid.uuid4().hex[:20], 'age': rng.randint(18, 80), 'gender': rng.choice(['male', 'female', 'other'])},
+    )
+    if status != 201:
+        return False
+    user = json.loads(content)['id']
+
+    status, _, content = timed(recorder, transport, 'GET /api/bootstrap/', 'GET', '/api/bootstrap/')
+    if status != 200:
+        return False
+    catalog = json.loads(content)
+
+    answers = [{'user': user, 'question': q['id'], 'rating': rng.randint(1, 6)} for q in catalog['noise_questions']]
+    if answers:
+        timed(recorder, transport, 'POST /api/noise-responses/', 'POST', '/api/noise-responses/', answers)
+
+    evaluations = []
+    for audio in catalog['audios']:
+        if not args.no_stream:
+            stream_clip(recorder, transport, urlsplit(audio['stream_url']).path, args.range_bytes)
+        evaluation = {'user': user, 'audio': audio['id']}
+        for field in ('annoyance', 'eventfulness', 'pleasantness', 'chaotic',
+                      'vibrant', 'uneventful', 'calm', 'monotonous'):
+            evaluation[field] = rng.randint(0, 100)
+        for field in ('traffic_noise', 'other_noise', 'human_sounds', 'natural_sounds'):
+            evaluation[field] = rng.randint(0, 4)
+        evaluations.append(evaluation)
+    if evaluations:
+        status, _, _ = timed(recorder, transport, 'POST /api/evaluations/', 'POST', '/api/evaluations/', evaluations)
+    return status < 400
+
+
+def run_load(transport_factory, args):
+    recorder = Recorder()
+    local = threading.local()
+    transports = []
+    lock = threading.Lock()
+    completed = failed = 0
+
+    def participant(n):
+        nonlocal completed, failed
+        if not hasattr(local, 'transport'):
+            local.transport = transport_factory()
+            with lock:
+                transports.append(local.transport)
+        ok = run_session(recorder, local.transport, args, random.Random(args.seed + n))
+        with lock:
+            if ok:
+                completed += 1
+            else:
+                failed += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(participant, range(args.participants)))
+    wall = time.perf_counter() - start
+
+    def close_all():
+        for transport in transports:
+            transport.close()
+
+    return {
+        'sessions_completed': completed,
+        'sessions_failed': failed,
+        'wall_s': wall,
+        'sessions_per_s': completed / wall if wall else 0,
+        'endpoints': recorder.report(wall),
+    }, close_all
+
+
+def run_client(args):
+    setup_django(DEBUG=False)
+    from django.db import connection
+
+    if connection.vendor == 'sqlite':
+        # A file, not the shared in-memory database, so threads can write
+        # concurrently; IMMEDIATE transactions wait for the lock instead of failing.
+        connection.settings_dict['TEST']['NAME'] = os.path.join(tempfile.mkdtemp(prefix='loadtest-db-'), 'test.sqlite3')
+        connection.settings_dict['OPTIONS'].update({'transaction_mode': 'IMMEDIATE', 'timeout': 30})
+
+    with test_database(), temp_media_root() as media_root:
+        seed_catalog(media_root, args.clips, args.questions, args.seconds)
+        result, close_all = run_load(ClientTransport, args)
+        close_all()
+
+        from survey.export import drain_outbox
+
+        start = time.perf_counter()
+        while drain_outbox(StubSheetsSink()):
+            pass
+        result['export'] = {
+            'rows': StubSheetsSink.rows,
+            'batches': StubSheetsSink.batches,
+            'drain_s': time.perf_counter() - start,
+        }
+        connection.close()
+    return result
+
+
+def wait_for_port(port, process, timeout=30):
+    import socket
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with {process.returncode}")
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("Server did not start")
+
+
+def free_port():
+    import socket
+
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+SERVER_COMMANDS = {
+    'gunicorn': lambda port, workers: [
+        sys.executable, '-m', 'gunicorn', 'audioupload.wsgi:application',
+        '--bind', f'127.0.0.1:{port}', '--workers', str(workers), '--log-level', 'warning',
+    ],
+    'uvicorn': lambda port, workers: [
+        sys.executable, '-m', 'uvicorn', 'audioupload.asgi:application',
+        '--host', '127.0.0.1', '--port', str(port), '--workers', str(workers), '--log-level', 'warning',
+    ],
+}
+
+
+def run_serve(args):
+    with tempfile.TemporaryDirectory(prefix='loadtest-') as tmp:
+        env = dict(os.environ)
+        # SQLite serializes writers across worker processes; pass --database-url
+        # (an empty PostgreSQL database) for numbers that match production.
+        env['DATABASE_URL'] = args.database_url or f"sqlite:///{Path(tmp) / 'loadtest.sqlite3'}"
+        env['MEDIA_ROOT'] = str(Path(tmp) / 'media')
+        env['DJANGO_SETTINGS_MODULE'] = 'audioupload.settings'
+        env['SURVEY_EXPORT_SINK'] = 'loadtest.StubSheetsSink'
+        env['LOADTEST_SHEETS_LATENCY_MS'] = str(args.sheets_latency_ms)
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, [str(BENCH_DIR), env.get('PYTHONPATH')]))
+
+        subprocess.run(
+            [sys.executable, str(BASE_DIR / 'manage.py'), 'migrate', '--verbosity', '0'],
+            env=env, cwd=BASE_DIR, check=True,
+        )
+        subprocess.run(
+            [sys.executable, str(Path(__file__).resolve()), '--seed-only',
+             '--clips', str(args.clips), '--questions', str(args.questions), '--seconds', str(args.seconds)],
+            env=env, cwd=BASE_DIR, check=True,
+        )
+
+        # Under uvicorn, /api/stream-audio/ must be the async view: the sync one is buffered whole.
+        async_streaming = args.server == 'uvicorn'
+        server_env = {**env, 'SURVEY_ASYNC_STREAMING': '1' if async_streaming else '0'}
+        port = free_port()
+        server = subprocess.Popen(SERVER_COMMANDS[args.server](port, args.workers), env=server_env, cwd=BASE_DIR)
+        worker = subprocess.Popen(
+            [sys.executable, str(BASE_DIR / 'manage.py'), 'run_export_worker', '--interval', '1'],
+            env=env, cwd=BASE_DIR, stdout=subprocess.DEVNULL,
+        )
+        try:
+            wait_for_port(port, server)
+            result, close_all = run_load(lambda: HTTPTransport(f'http://127.0.0.1:{port}'), args)
+            close_all()
+        finally:
+            for process in (server, worker):
+                process.terminate()
+                process.wait(timeout=30)
+        result['server'] = {'name': args.server, 'workers': args.workers, 'async_streaming': async_streaming}
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--target', choices=['client', 'serve', 'url'], default='client')
+    parser.add_argument('--url', default='http://127.0.0.1:8000', help="Base URL for --target url.")
+    parser.add_argument('--server', choices=sorted(SERVER_COMMANDS), default='gunicorn')
+    parser.add_argument('--workers', type=int, default=4, help="Server workers for --target serve.")
+    parser.add_argument('--database-url', help="Database for --target serve; default is a throwaway SQLite file.")
+    parser.add_argument('--participants', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--clips', type=int, default=5)
+    parser.add_argument('--questions', type=int, default=21)
+    parser.add_argument('--seconds', type=float, default=10.0, help="Length of each generated clip.")
+    parser.add_argument('--range-bytes', type=int, default=256 * 1024, help="Size of each Range request.")
+    parser.add_argument('--no-stream', action='store_true', help="Skip audio downloads.")
+    parser.add_argument('--sheets-latency-ms', type=float, default=0, help="Simulated Sheets round trip per batch.")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--seed-only', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--output', help="Write JSON results to this file.")
+    args = parser.parse_args()
+
+    if args.seed_only:
+        # Runs inside --target serve, against the server's database and MEDIA_ROOT.
+        setup_django()
+        from django.conf import settings
+
+        seed_catalog(settings.MEDIA_ROOT, args.clips, args.questions, args.seconds)
+        return
+
+    StubSheetsSink.latency = args.sheets_latency_ms / 1000
+    if args.target == 'client':
+        result = run_client(args)
+    elif args.target == 'serve':
+        result = run_serve(args)
+    else:
+        result, close_all = run_load(lambda: HTTPTransport(args.url), args)
+        close_all()
+
+    print(f"{result['sessions_completed']} sessions ok, {result['sessions_failed']} failed, "
+          f"{result['wall_s']:.1f}s, {result['sessions_per_s']:.1f} sessions/s")
+    for endpoint, entry in result['endpoints'].items():
+        latency = entry['latency']
+        queries = f" q={entry['queries']['mean']:.1f}" if 'queries' in entry else ''
+        print(f"  {endpoint:<32} n={entry['requests']:<6} err={entry['errors']:<4} "
+              f"p50={latency['p50_ms']:.1f}ms p95={latency['p95_ms']:.1f}ms p99={latency['p99_ms']:.1f}ms "
+              f"{entry['requests_per_s']:.1f} req/s {entry['bytes'] / 1e6:.1f} MB{queries}")
+    if 'export' in result:
+        export = result['export']
+        print(f"  export: {export['rows']} rows in {export['batches']} batches, drained in {export['drain_s']:.2f}s")
+
+    write_results(args.output, {'args': vars(args), **result})
+
+
+if __name__ == '__main__':
+    main()
@@ -5,6 +5,9 @@ from .models import (
     NoiseResponse,
     Audio,
     AudioEvaluation,
+    AudioRatingAggregate,
+    ExportOutbox,
+    AudioUpload,
 )
 
 admin.site.register(UserProfile)
@@ -12,3 +15,6 @@ admin.site.register(NoiseQuestion)
 admin.site.register(NoiseResponse)
 admin.site.register(Audio)
 admin.site.register(AudioEvaluation)
+admin.site.register(AudioRatingAggregate)
+admin.site.register(ExportOutbox)
+admin.site.register(AudioUpload)
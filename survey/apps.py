@@ -5,4 +5,11 @@ class SurveyConfig(AppConfig):
     name = 'survey'
 
     def ready(self):
-        import survey.signals
\ No newline at end of file
+        import survey.signals
+
+        from django.core.signals import request_started
+        from .journal import start_flusher
+
+        # The wsgi/asgi modules start the write-behind flusher; requests
+        # restart it if the thread died.
+        request_started.connect(start_flusher, dispatch_uid='survey-journal-flusher')
\ No newline at end of file
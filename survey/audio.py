@@ -0,0 +1,269 @@
+"""
+WAV parsing and the metadata / waveform peaks stored on each Audio at ingest.
+
+Clips are content-addressed: ingest moves each file to
+audios/<sha256[:2]>/<sha256>.<ext>, and a clip whose bytes are already
+stored reuses that file. The stream URL carries the hash (audio_version),
+so a given URL always returns the same bytes and can be cached forever.
+
+Peaks sidecar format: a flat array of int8 pairs (min, max), one pair per
+bucket of 1 / SURVEY_PEAKS_PER_SECOND seconds, taken across all channels
+and scaled so that full scale is -128..127.
+"""
+import os
+import struct
+import hashlib
+from collections import namedtuple
+
+import numpy as np
+from django.conf import settings
+from django.core.files.base import ContentFile
+
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+WavInfo = namedtuple('WavInfo', [
+    'format', 'channels', 'sample_rate', 'bits_per_sample', 'block_align',
+    'data_offset', 'data_size', 'frames', 'duration',
+])
+
+
+class WavError(ValueError):
+    pass
+
+
+def _read_exact(f, size):
+    data = f.read(size)
+    if len(data) < size:
+        raise EOFError("WAV header is truncated")
+    return data
+
+
+def parse_wav_header(f, file_size=None):
+    """
+    Reads RIFF chunks from the start of `f` until the data chunk and returns a
+    WavInfo. Only the header bytes are read, never the samples.
+
+    Raises WavError for files that are not PCM/float WAV and EOFError when `f`
+    ends before the data chunk starts (e.g. an upload still in progress).
+    """
+    riff, _, wave = struct.unpack('<4sI4s', _read_exact(f, 12))
+    if riff != b'RIFF' or wave != b'WAVE':
+        raise WavError("Not a RIFF/WAVE file")
+
+    fmt = None
+    offset = 12
+    while True:
+        chunk_id, chunk_size = struct.unpack('<4sI', _read_exact(f, 8))
+        offset += 8
+        if chunk_id == b'fmt ':
+            body = _read_exact(f, chunk_size)
+            audio_format, channels, sample_rate, _, block_align, bits = struct.unpack('<HHIIHH', body[:16])
+            if audio_format == WAVE_FORMAT_EXTENSIBLE and len(body) >= 26:
+                audio_format = struct.unpack('<H', body[24:26])[0]
+            fmt = (audio_format, channels, sample_rate, bits, block_align)
+        elif chunk_id == b'data':
+            if fmt is None:
+                raise WavError("data chunk before fmt chunk")
+            break
+        else:
+            _read_exact(f, chunk_size)
+        offset += chunk_size + (chunk_size & 1)
+        if chunk_size & 1:
+            _read_exact(f, 1)  # chunks are word aligned
+
+    audio_format, channels, sample_rate, bits, block_align = fmt
+    if audio_format not in (WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT):
+        raise WavError(f"Unsupported WAV format 0x{audio_format:04x}")
+    if not channels or not sample_rate or not block_align:
+        raise WavError("Invalid fmt chunk")
+
+    data_size = chunk_size
+    if file_size is not None:
+        # Streaming writers leave the size as 0 or 0xFFFFFFFF.
+        if data_size == 0 or data_size > file_size - offset:
+            data_size = file_size - offset
+    frames = data_size // block_align
+    return WavInfo(
+        format=audio_format,
+        channels=channels,
+        sample_rate=sample_rate,
+        bits_per_sample=bits,
+        block_align=block_align,
+        data_offset=offset,
+        data_size=data_size,
+        frames=frames,
+        duration=frames / sample_rate,
+    )
+
+
+def read_wav_info(path):
+    with open(path, 'rb') as f:
+        f.seek(0, 2)
+        size = f.tell()
+        f.seek(0)
+        return parse_wav_header(f, file_size=size)
+
+
+def load_samples(path, info):
+    """
+    Samples as a (frames, channels) float32 array scaled to -1.0..1.0.
+    """
+    width = info.bits_per_sample // 8
+    count = info.frames * info.channels
+    if info.format == WAVE_FORMAT_IEEE_FLOAT:
+        if width != 4:
+            raise WavError("Only 32-bit float WAV is supported")
+        samples = np.fromfile(path, dtype='<f4', count=count, offset=info.data_offset)
+    elif width == 1:
+        raw = np.fromfile(path, dtype=np.uint8, count=count, offset=info.data_offset)
+        samples = (raw.astype(np.float32) - 128) / 128
+    elif width == 2:
+        samples = np.fromfile(path, dtype='<i2', count=count, offset=info.data_offset) / np.float32(2 ** 15)
+    elif width == 3:
+        raw = np.fromfile(path, dtype=np.uint8, count=count * 3, offset=info.data_offset).reshape(-1, 3)
+        ints = (raw[:, 0].astype(np.int32) | (raw[:, 1].astype(np.int32) << 8) | (raw[:, 2].astype(np.int32) << 16))
+        ints = np.where(ints & 0x800000, ints - 0x1000000, ints)
+        samples = ints / np.float32(2 ** 23)
+    elif width == 4:
+        samples = np.fromfile(path, dtype='<i4', count=count, offset=info.data_offset) / np.float32(2 ** 31)
+    else:
+        raise WavError(f"Unsupported sample width {info.bits_per_sample}")
+    samples = samples.astype(np.float32, copy=False)
+    return samples[:len(samples) - len(samples) % info.channels].reshape(-1, info.channels)
+
+
+def compute_peaks(samples, sample_rate, peaks_per_second=None):
+    """
+    Downsamples (frames, channels) samples to interleaved int8 (min, max) pairs.
+    """
+    peaks_per_second = peaks_per_second or settings.SURVEY_PEAKS_PER_SECOND
+    frames_per_bucket = max(1, int(round(sample_rate / peaks_per_second)))
+    mono_min = samples.min(axis=1)
+    mono_max = samples.max(axis=1)
+
+    buckets = -(-len(mono_min) // frames_per_bucket)
+    pad = buckets * frames_per_bucket - len(mono_min)
+    if pad:
+        mono_min = np.concatenate([mono_min, np.full(pad, mono_min[-1] if len(mono_min) else 0, np.float32)])
+        mono_max = np.concatenate([mono_max, np.full(pad, mono_max[-1] if len(mono_max) else 0, np.float32)])
+
+    peaks = np.empty((buckets, 2), dtype=np.float32)
+    peaks[:, 0] = mono_min.reshape(buckets, frames_per_bucket).min(axis=1)
+    peaks[:, 1] = mono_max.reshape(buckets, frames_per_bucket).max(axis=1)
+    return np.clip(np.round(peaks * 127), -128, 127).astype(np.int8).ravel()
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def peaks_name_for(audio):
+    return f"peaks/{audio.file.name}.peaks"
+
+
+def content_name(sha256, file_name):
+    extension = os.path.splitext(file_name)[1].lower() or '.wav'
+    return f"audios/{sha256[:2]}/{sha256}{extension}"
+
+
+def audio_version(audio):
+    """
+    Short content hash used in the immutable stream URL; '' before ingest.
+    """
+    return audio.sha256[:16]
+
+
+def stream_path(audio, prefix='/api/stream-audio/'):
+    version = audio_version(audio)
+    return f"{prefix}{audio.id}/{version}/" if version else f"{prefix}{audio.id}/"
+
+
+def needs_ingest(audio):
+    return bool(audio.file) and (
+        audio.duration is None
+        or not audio.sha256
+        or audio.file.name != content_name(audio.sha256, audio.file.name)
+        or audio.peaks.name != peaks_name_for(audio)
+    )
+
+
+def store_by_content(audio, sha256):
+    """
+    Moves the clip to its content-addressed name, or drops it in favour of
+    an identical file already stored there. Other Audio rows still pointing
+    at the old name follow it.
+    """
+    from .streaming import file_info_cache, mmap_cache
+
+    old_name = audio.file.name
+    new_name = content_name(sha256, old_name)
+    if old_name == new_name:
+        return new_name
+
+    storage = audio.file.storage
+    old_path = storage.path(old_name)
+    if storage.exists(new_name):
+        os.remove(old_path)  # same bytes are already stored
+    else:
+        new_path = storage.path(new_name)
+        os.makedirs(os.path.dirname(new_path), exist_ok=True)
+        os.replace(old_path, new_path)
+    file_info_cache.invalidate(old_path)
+    mmap_cache.invalidate(old_path)
+
+    type(audio).objects.filter(file=old_name).exclude(pk=audio.pk).update(file=new_name)
+    audio.file.name = new_name
+    return new_name
+
+
+def ingest_audio(audio, sha256=None):
+    """
+    Parses the WAV header, writes the peaks sidecar and stores both on `audio`
+    without sending post_save again. The file is moved to its content-addressed
+    name first. `sha256` skips hashing the file when the caller already has
+    the digest (e.g. from a chunked upload).
+    """
+    info = read_wav_info(audio.file.path)
+    sha256 = sha256 or file_sha256(audio.file.path)
+    store_by_content(audio, sha256)
+    path = audio.file.path
+    peaks = compute_peaks(load_samples(path, info), info.sample_rate)
+
+    storage = audio.peaks.storage
+    name = peaks_name_for(audio)
+    old_peaks = audio.peaks.name
+    if storage.exists(name):
+        storage.delete(name)
+    audio.peaks.name = storage.save(name, ContentFile(peaks.tobytes()))
+    if old_peaks and old_peaks != audio.peaks.name and not (
+        type(audio).objects.filter(peaks=old_peaks).exclude(pk=audio.pk).exists()
+    ):
+        storage.delete(old_peaks)
+
+    audio.duration = info.duration
+    audio.sample_rate = info.sample_rate
+    audio.channels = info.channels
+    audio.bits_per_sample = info.bits_per_sample
+    audio.data_offset = info.data_offset
+    audio.data_size = info.data_size
+    audio.sha256 = sha256
+
+    type(audio).objects.filter(pk=audio.pk).update(
+        file=audio.file.name,
+        duration=audio.duration,
+        sample_rate=audio.sample_rate,
+        channels=audio.channels,
+        bits_per_sample=audio.bits_per_sample,
+        data_offset=audio.data_offset,
+        data_size=audio.data_size,
+        peaks=audio.peaks.name,
+        sha256=audio.sha256,
+    )
+    return info
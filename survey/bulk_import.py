@@ -0,0 +1,398 @@
+"""
+Bulk loading of survey data from Django fixtures (JSON array or JSON lines)
+and from the wide CSV layout of prepare_header_row().
+
+Input is read incrementally and written with one bulk_create per model per
+chunk, each chunk in its own transaction. Foreign keys resolve from
+in-memory maps (user_id -> UserProfile, title -> Audio, number ->
+NoiseQuestion), so there are no per-row lookups. Rows are matched on
+those natural keys, never on fixture pks: a fixture's participants are
+found through the file's own userprofile objects, and its audios and
+questions by title and number (a reference to one not in the file is
+taken as the database pk). A row that cannot be stored (unknown clip or
+question, non-numeric rating, missing age or gender) is skipped and
+counted, never guessed, so one bad cell cannot stop an import halfway.
+Evaluations are not queued for the Sheets export unless asked. Rating
+aggregates are rebuilt once at the end.
+"""
+import json
+import time
+from collections import Counter
+from datetime import timezone as dt_timezone
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import UserProfile, Audio, NoiseQuestion, NoiseResponse, AudioEvaluation
+from .export import enqueue_evaluations, prepare_header_row
+from .soundscape import fill_iso_coordinates
+from .stats import rebuild_aggregates
+
+
+class ImportDataError(ValueError):
+    pass
+
+
+def iter_json_objects(f, read_size=1 << 16):
+    """
+    Yields the objects of a top-level JSON array, or of JSON lines, without
+    loading the whole file.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    in_array = None
+    eof = False
+
+    while True:
+        # Skip whitespace and separators between values.
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position < len(buffer) or eof:
+                break
+            buffer, position = buffer[position:] + f.read(read_size), 0
+            eof = position >= len(buffer)
+        if position >= len(buffer):
+            return
+
+        if in_array is None:
+            in_array = buffer[position] == '['
+            if in_array:
+                position += 1
+                continue
+        if in_array and buffer[position] == ']':
+            return
+
+        try:
+            value, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            chunk = f.read(read_size)
+            eof = not chunk
+            buffer, position = buffer[position:] + chunk, 0
+            continue
+        yield value
+        position = end
+
+
+def parse_number(value):
+    """
+    int of a rating or age cell, or None if it is not a number (e.g. "n/a").
+    """
+    try:
+        return int(float(str(value).strip()))
+    except (ValueError, OverflowError):
+        return None
+
+
+class SurveyImporter:
+    """
+    Buffers rows and writes them chunk by chunk. Call add_fixture_object() or
+    add_csv_row() for every input row, then finish().
+    """
+    genders = {value for value, _ in UserProfile.GENDER_CHOICES}
+
+    def __init__(self, chunk_size=1000, export=False, log=None):
+        self.chunk_size = chunk_size
+        self.export = export
+        self.log = log or (lambda message: None)
+        self.counts = Counter()
+        self.skipped = Counter()
+        self.started = time.perf_counter()
+
+        self.users = dict(UserProfile.objects.values_list('user_id', 'pk'))
+        audios = Audio.objects.order_by('-pk').values_list('pk', 'title')
+        self.audios = {title: pk for pk, title in audios}
+        self.audio_pks = {pk for pk, _ in audios}
+        questions = NoiseQuestion.objects.order_by('-pk').values_list('pk', 'number')
+        self.questions = {number: pk for pk, number in questions}
+        self.question_pks = {pk for pk, _ in questions}
+        self.answered = set()
+        # Fixture pk -> user_id / database pk, for references within the file.
+        self.source_users = {}
+        self.source_audios = {}
+        self.source_questions = {}
+        self._reset()
+
+    def _reset(self):
+        self.pending_users = {}
+        self.pending_responses = {}
+        self.pending_evaluations = {}
+        self.pending_rows = 0
+
+    # Fixtures ---------------------------------------------------------------
+
+    def add_fixture_object(self, obj):
+        model = obj.get('model', '').lower()
+        fields = obj.get('fields', {})
+        pk = obj.get('pk')
+
+        if model in ('survey.audio', 'survey.noisequestion'):
+            # A handful of catalog rows: saved normally so ingest and cache invalidation run.
+            self.flush()
+            if model == 'survey.audio':
+                instance = self.save_catalog_row(Audio, pk, fields, self.audios, fields.get('title'))
+                self.audios[instance.title] = instance.pk
+                self.audio_pks.add(instance.pk)
+                self.source_audios[pk] = instance.pk
+            else:
+                instance = self.save_catalog_row(NoiseQuestion, pk, fields, self.questions, fields.get('number'))
+                self.questions[instance.number] = instance.pk
+                self.question_pks.add(instance.pk)
+                self.source_questions[pk] = instance.pk
+            self.counts[type(instance).__name__] += 1
+            return
+
+        if model == 'survey.userprofile':
+            user = UserProfile(**fields)
+            self.pending_users[user.user_id] = user
+            self.source_users[pk] = user.user_id
+            self.row_added()
+            return
+        if model not in ('survey.noiseresponse', 'survey.audioevaluation'):
+            self.skipped[f'unsupported model {model or "?"}'] += 1
+            return
+
+        # Source pks of participants only mean something within the file.
+        user_key = self.source_users.get(fields.get('user'))
+        if user_key is None:
+            self.skipped[f"user {fields.get('user')!r} not in the fixture"] += 1
+            return
+        user = self.users.get(user_key) or self.pending_users[user_key]
+
+        if model == 'survey.noiseresponse':
+            question_id = self.source_questions.get(fields['question'], fields['question'])
+            if question_id not in self.question_pks:
+                self.skipped[f"unknown question {fields['question']!r}"] += 1
+                return
+            rating = parse_number(fields['rating'])
+            if rating is None:
+                self.skipped['non-numeric rating'] += 1
+                return
+            response = NoiseResponse(question_id=question_id, rating=rating)
+            self.set_user(response, user)
+            self.pending_responses[(user_key, question_id)] = response
+        else:
+            audio_id = self.source_audios.get(fields['audio'], fields['audio'])
+            if audio_id not in self.audio_pks:
+                self.skipped[f"unknown audio {fields['audio']!r}"] += 1
+                return
+            values = {field: parse_number(fields.get(field, 0)) for field in AudioEvaluation.RATING_FIELDS}
+            bad = [field for field, value in values.items() if value is None]
+            if bad:
+                self.skipped[f"non-numeric {bad[0]}"] += 1
+                return
+            evaluation = AudioEvaluation(audio_id=audio_id, **values)
+            self.set_user(evaluation, user)
+            evaluation.submitted_at = self.parse_time(fields.get('submitted_at'))
+            self.pending_evaluations[(user_key, audio_id)] = evaluation
+        self.row_added()
+
+    @staticmethod
+    def save_catalog_row(model, pk, fields, existing, natural_key):
+        """
+        Updates the row with the same title/number, or creates one. The
+        fixture's pk is kept only if it is free, so rows already in the
+        database are never overwritten by an unrelated object.
+        """
+        current = existing.get(natural_key)
+        if current is None and pk is not None and not model.objects.filter(pk=pk).exists():
+            current = pk
+        if current is None:
+            return model.objects.create(**fields)
+        instance, _ = model.objects.update_or_create(pk=current, defaults=fields)
+        return instance
+
+    # CSV ---------------------------------------------------------------------
+
+    def csv_columns(self, header):
+        """
+        Maps the CSV header to question numbers and rating fields.
+        """
+        known = prepare_header_row()
+        slider_headers = known[-len(AudioEvaluation.RATING_FIELDS) - 1:-1]
+        self.slider_columns = dict(zip(slider_headers, AudioEvaluation.RATING_FIELDS))
+        self.question_columns = {
+            name: int(name[1:]) for name in header if name[:1] == 'Q' and name[1:].isdigit()
+        }
+        missing = {'UserID', 'AudioTitle'} - set(header)
+        if missing:
+            raise ImportDataError(f"CSV is missing columns: {', '.join(sorted(missing))}")
+
+    def add_csv_row(self, row):
+        user_key = (row.get('UserID') or '').strip()
+        audio_id = self.audios.get((row.get('AudioTitle') or '').strip())
+        if not user_key:
+            self.skipped['missing UserID'] += 1
+            return
+        if audio_id is None:
+            self.skipped[f"unknown audio {row.get('AudioTitle')!r}"] += 1
+            return
+
+        user = self.users.get(user_key) or self.pending_users.get(user_key)
+        if user is None:
+            age = parse_number(row.get('Age') or '')
+            gender = (row.get('Gender') or '').strip().lower()
+            if age is None:
+                self.skipped['missing Age' if not (row.get('Age') or '').strip() else 'non-numeric Age'] += 1
+                return
+            if gender not in self.genders:
+                self.skipped['missing Gender' if not gender else f"unknown Gender {gender!r}"] += 1
+                return
+            user = UserProfile(user_id=user_key, age=age, gender=gender)
+
+        # Parse the whole row before keeping any of it.
+        answers = {}
+        if user_key not in self.answered:
+            # Every row repeats the participant's answers; take them once.
+            for column, number in self.question_columns.items():
+                value = (row.get(column) or '').strip()
+                question_id = self.questions.get(number)
+                if question_id is None or value in ('', 'NA'):
+                    continue
+                answers[question_id] = (column, parse_number(value))
+        values = {
+            field: (column, parse_number(row.get(column) or 0)) for column, field in self.slider_columns.items()
+        }
+        bad = [column for column, value in [*answers.values(), *values.values()] if value is None]
+        if bad:
+            self.skipped[f"non-numeric {bad[0]}"] += 1
+            return
+
+        if isinstance(user, UserProfile) and user.pk is None:
+            self.pending_users[user_key] = user
+        if user_key not in self.answered:
+            self.answered.add(user_key)
+            for question_id, (_, rating) in answers.items():
+                response = NoiseResponse(question_id=question_id, rating=rating)
+                self.set_user(response, user)
+                self.pending_responses[(user_key, question_id)] = response
+
+        evaluation = AudioEvaluation(audio_id=audio_id, **{field: value for field, (_, value) in values.items()})
+        self.set_user(evaluation, user)
+        evaluation.submitted_at = self.parse_time(row.get('SubmittedAt'))
+        self.pending_evaluations[(user_key, audio_id)] = evaluation
+        self.row_added()
+
+    @staticmethod
+    def set_user(obj, user):
+        if isinstance(user, UserProfile):
+            obj.user = user  # created in this chunk; the pk is filled in by bulk_create
+        else:
+            obj.user_id = user
+
+    @staticmethod
+    def parse_time(value):
+        if not value:
+            return None
+        parsed = parse_datetime(str(value).strip())
+        if parsed is not None and timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed, dt_timezone.utc)
+        return parsed
+
+    # Writing -----------------------------------------------------------------
+
+    def row_added(self):
+        self.pending_rows += 1
+        if self.pending_rows >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending_rows:
+            return
+        committed = sum(self.counts.values())
+        try:
+            with transaction.atomic():
+                self.write_users(list(self.pending_users.values()))
+                self.write_responses(list(self.pending_responses.values()))
+                self.write_evaluations(list(self.pending_evaluations.values()))
+        except IntegrityError as e:
+            # References are checked row by row, so this is a database-side surprise.
+            raise ImportDataError(
+                f"the database rejected a chunk of {self.pending_rows} rows ({e}); "
+                f"{committed} rows before it were imported"
+            ) from e
+        self._reset()
+        self.log(self.progress())
+
+    def write_users(self, users):
+        if not users:
+            return
+        UserProfile.objects.bulk_create(
+            users, update_conflicts=True, unique_fields=['user_id'], update_fields=['age', 'gender'],
+        )
+        for user in users:
+            self.users[user.user_id] = user.pk
+        self.counts['UserProfile'] += len(users)
+
+    def write_responses(self, responses):
+        if not responses:
+            return
+        for response in responses:
+            if response.user_id is None:
+                response.user_id = response.user.pk
+        NoiseResponse.objects.bulk_create(
+            responses, update_conflicts=True, unique_fields=['user', 'question'], update_fields=['rating'],
+        )
+        self.counts['NoiseResponse'] += len(responses)
+
+    def write_evaluations(self, evaluations):
+        if not evaluations:
+            return
+        for evaluation in evaluations:
+            if evaluation.user_id is None:
+                evaluation.user_id = evaluation.user.pk
+        submitted = [evaluation.submitted_at for evaluation in evaluations]
+        existing = self.existing_keys(evaluations)
+        fill_iso_coordinates(evaluations)
+        evaluations = AudioEvaluation.objects.bulk_create(
+            evaluations,
+            update_conflicts=True,
+            unique_fields=['user', 'audio'],
+            update_fields=AudioEvaluation.RATING_FIELDS + ['iso_pleasant', 'iso_eventful'],
+        )
+        # auto_now_add stamped "now" on insert; restore the historical times of
+        # inserted rows. Rows that were already there keep their stored time.
+        dated = []
+        for evaluation, value in zip(evaluations, submitted):
+            if value is not None and (evaluation.user_id, evaluation.audio_id) not in existing:
+                evaluation.submitted_at = value
+                dated.append(evaluation)
+        if dated:
+            AudioEvaluation.objects.bulk_update(dated, ['submitted_at'])
+        if self.export:
+            # prepare_data_row reads each row's user and audio; load them with the rows.
+            enqueue_evaluations(list(
+                AudioEvaluation.objects.filter(pk__in=[evaluation.pk for evaluation in evaluations])
+                .select_related('user', 'audio')
+            ))
+        self.counts['AudioEvaluation'] += len(evaluations)
+
+    @staticmethod
+    def existing_keys(evaluations):
+        keys = {(evaluation.user_id, evaluation.audio_id) for evaluation in evaluations}
+        rows = AudioEvaluation.objects.filter(
+            user_id__in={user_id for user_id, _ in keys}, audio_id__in={audio_id for _, audio_id in keys},
+        ).values_list('user_id', 'audio_id')
+        return {row for row in rows if row in keys}
+
+    def progress(self):
+        elapsed = time.perf_counter() - self.started
+        rows = sum(self.counts.values())
+        return f"{rows} rows in {elapsed:.1f}s ({rows / elapsed if elapsed else 0:.0f} rows/s)"
+
+    def finish(self):
+        self.flush()
+        if self.counts['AudioEvaluation']:
+            with transaction.atomic():
+                rebuild_aggregates()
+        elapsed = time.perf_counter() - self.started
+        return {
+            'counts': dict(self.counts),
+            'skipped': dict(self.skipped),
+            'seconds': elapsed,
+            'rows_per_second': sum(self.counts.values()) / elapsed if elapsed else 0,
+        }
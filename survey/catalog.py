@@ -0,0 +1,92 @@
+"""
+Pre-serialized, cached views of the survey catalog (audios and noise questions).
+
+Everything here is keyed by a catalog version that is replaced whenever an
+Audio or NoiseQuestion is saved or deleted, and by the request host because
+the serializers build absolute URLs. The version lives in a small file in
+MEDIA_ROOT rather than in the cache: the default cache is per process, and
+every worker (on every host) that serves the clips shares MEDIA_ROOT, so a
+change made through one worker reaches all of them on their next request.
+ETags are content hashes, so they stay valid across workers and restarts.
+For SURVEY_REPLICA_LAG seconds after a change, entries are built from the
+primary. Otherwise a lagging replica could be cached under the new version.
+"""
+import os
+import json
+import time
+import uuid
+import hashlib
+import tempfile
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.renderers import JSONRenderer
+
+from .models import Audio, NoiseQuestion
+from .serializers import AudioSerializer, NoiseQuestionSerializer
+from .routers import primary_reads
+
+
+CATALOG_VERSION_FILE = ".catalog-version"
+
+
+def catalog_version_path():
+    return os.path.join(settings.MEDIA_ROOT, CATALOG_VERSION_FILE)
+
+
+def invalidate_catalog():
+    path = catalog_version_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write then rename so a reader never sees an empty version.
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=CATALOG_VERSION_FILE)
+    with os.fdopen(fd, 'w') as f:
+        f.write(uuid.uuid4().hex)
+    os.replace(tmp_path, path)
+
+
+def catalog_version():
+    """
+    (version, time of the last change) or ("0", None) if it never changed.
+    """
+    try:
+        with open(catalog_version_path()) as f:
+            return f.read(), os.fstat(f.fileno()).st_mtime
+    except FileNotFoundError:
+        return "0", None
+
+
+def get_catalog_entry(name, request, build):
+    """
+    (data, JSON bytes, ETag) for one catalog view. `build` returns the
+    serializable data and is only called on a cache miss.
+    """
+    version, changed_at = catalog_version()
+    key = f"survey:catalog:{version}:{name}:{request.scheme}://{request.get_host()}"
+    entry = cache.get(key)
+    if entry is None:
+        if changed_at is not None and time.time() - changed_at < settings.SURVEY_REPLICA_LAG:
+            with primary_reads():
+                data = build()
+        else:
+            data = build()
+        payload = JSONRenderer().render(data)
+        etag = '"%s"' % hashlib.sha256(payload).hexdigest()[:32]
+        entry = (json.loads(payload), payload, etag)
+        cache.set(key, entry, timeout=settings.SURVEY_CATALOG_CACHE_TIMEOUT)
+    return entry
+
+
+def build_bootstrap(request):
+    context = {"request": request}
+    return {
+        "audios": AudioSerializer(Audio.objects.order_by("id"), many=True, context=context).data,
+        "noise_questions": NoiseQuestionSerializer(
+            NoiseQuestion.objects.order_by("number"), many=True, context=context
+        ).data,
+    }
+
+
+def add_catalog_headers(response, etag):
+    response["ETag"] = etag
+    response["Cache-Control"] = f"public, max-age={settings.SURVEY_CATALOG_MAX_AGE}"
+    return response
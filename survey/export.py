@@ -0,0 +1,408 @@
+import os
+import csv
+import json
+import base64
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import NoiseQuestion, NoiseResponse, ExportOutbox
+from .metrics import time_sink_call
+
+
+logger = logging.getLogger(__name__)
+
+
+class ExportError(Exception):
+    pass
+
+
+QUESTIONS_VERSION_KEY = "survey:noise-questions:version"
+
+
+def _questions_cache_key():
+    version = cache.get_or_set(QUESTIONS_VERSION_KEY, 1, timeout=None)
+    return f"survey:noise-questions:{version}"
+
+
+def invalidate_question_cache():
+    """
+    Bumps the cached question list version. Called when a NoiseQuestion changes.
+    """
+    try:
+        cache.incr(QUESTIONS_VERSION_KEY)
+    except ValueError:
+        cache.set(QUESTIONS_VERSION_KEY, 1, timeout=None)
+
+
+def get_question_numbers():
+    """
+    Ordered NoiseQuestion numbers, cached until a question is saved or deleted.
+    """
+    key = _questions_cache_key()
+    numbers = cache.get(key)
+    if numbers is None:
+        numbers = list(NoiseQuestion.objects.order_by("number").values_list("number", flat=True))
+        cache.set(key, numbers, timeout=settings.SURVEY_QUESTION_CACHE_TIMEOUT)
+    return numbers
+
+
+def get_ratings_by_user(user_ids):
+    """
+    {user pk: {question number: rating}} for many users, in a single query.
+    If a question was answered twice the earliest answer wins, as before.
+    """
+    ratings = {}
+    responses = (
+        NoiseResponse.objects
+        .filter(user_id__in=user_ids)
+        .order_by("-pk")
+        .values_list("user_id", "question__number", "rating")
+    )
+    for user_id, number, rating in responses:
+        ratings.setdefault(user_id, {})[number] = rating
+    return ratings
+
+
+def get_ratings_by_question(user_id):
+    """
+    {question number: rating} for one user.
+    """
+    return get_ratings_by_user([user_id]).get(user_id, {})
+
+
+def prepare_header_row():
+    """
+    Generates the list of column names (The first row of the Excel file).
+    """
+    headers = ["UserID", "AudioTitle", "Age", "Gender"]
+
+    for number in get_question_numbers():
+        headers.append(f"Q{number}")
+
+
+    headers.extend([
+        "Annoyance",
+        "Eventfulness",
+        "Pleasantness",
+        "Chaotic",
+        "Vibrant",
+        "Uneventful",
+        "Calm",
+        "Monotonous",
+        "TrafficNoise",
+        "OtherNoise",
+        "HumanSounds",
+        "NaturalSounds",
+        "SubmittedAt"
+    ])
+    return headers
+
+def prepare_data_row(instance, ratings=None):
+    """
+    Extracts data from the instance to match the header row.
+    `ratings` ({question number: rating}) is looked up when not given.
+    """
+    user = instance.user
+
+    row = [
+        str(user.user_id),
+        str(instance.audio.title),
+        str(user.age) if user.age else "",
+        str(user.gender) if user.gender else "",
+    ]
+
+    if ratings is None:
+        ratings = get_ratings_by_question(user.pk)
+    for number in get_question_numbers():
+        rating = ratings.get(number)
+        row.append(str(rating) if rating is not None else "NA")
+
+    submitted_str = instance.submitted_at.strftime("%Y-%m-%d %H:%M:%S") if instance.submitted_at else ""
+
+    row.extend([
+        str(instance.annoyance ),
+        str(instance.eventfulness ),
+        str(instance.pleasantness ),
+        str(instance.chaotic ),
+        str(instance.vibrant ),
+        str(instance.uneventful ),
+        str(instance.calm ),
+        str(instance.monotonous ),
+        str(instance.traffic_noise ),
+        str(instance.other_noise ),
+        str(instance.human_sounds ),
+        str(instance.natural_sounds ),
+        submitted_str
+    ])
+
+    return row
+
+
+_sheets_client = None  # (GOOGLE_CREDENTIALS_JSON, authorized gspread client)
+_sheets_client_lock = threading.Lock()
+_dotenv_loaded = False
+
+
+def google_environment():
+    """
+    (base64 credentials, sheet id) from the environment. .env is read here,
+    on first use, because only the Sheets export needs it.
+    """
+    global _dotenv_loaded
+    if not _dotenv_loaded:
+        from dotenv import load_dotenv
+
+        load_dotenv()
+        _dotenv_loaded = True
+
+    b64_creds = os.getenv('GOOGLE_CREDENTIALS_JSON')
+    sheet_id = os.getenv('GOOGLE_SHEET_ID')
+    if not b64_creds or not sheet_id:
+        raise ExportError("Missing Render Environment Variables.")
+    return b64_creds, sheet_id
+
+
+def get_sheets_client(b64_creds, scope):
+    """
+    The authorized gspread client for these credentials, created on first use
+    and kept for the life of the process. gspread and oauth2client take a
+    few hundred milliseconds and tens of MB to import, so they are imported
+    here rather than when a worker starts.
+    """
+    global _sheets_client
+    with _sheets_client_lock:
+        if _sheets_client is None or _sheets_client[0] != b64_creds:
+            # Decode Base64 to get the JSON string
+            try:
+                json_str = base64.b64decode(b64_creds).decode("utf-8")
+                creds_dict = json.loads(json_str)
+            except Exception as e:
+                raise ExportError(f"Credential Decoding Error: {e}")
+
+            import gspread
+            from oauth2client.service_account import ServiceAccountCredentials
+
+            creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
+            _sheets_client = (b64_creds, gspread.authorize(creds))
+        return _sheets_client[1]
+
+
+def arrange_rows(header_row, target_header, rows):
+    """
+    Reorders rows laid out as header_row into target_header's column order;
+    columns the rows lack are left empty.
+    """
+    if target_header == header_row:
+        return rows
+    position = {name: index for index, name in enumerate(header_row)}
+    return [
+        [row[position[name]] if name in position else "" for name in target_header]
+        for row in rows
+    ]
+
+
+class GoogleSheetsSink:
+    """
+    Appends rows to the first worksheet of GOOGLE_SHEET_ID.
+    The authorized sheet and its header row are kept for the life of the
+    worker. Pass `sheet` to use an already opened worksheet (or a fake).
+    """
+    scope = [
+        "https://spreadsheets.google.com/feeds",
+        "https://www.googleapis.com/auth/drive"
+    ]
+
+    def __init__(self, sheet=None):
+        self._sheet = sheet
+        self._header = None
+
+    def get_sheet(self):
+        if self._sheet is None:
+            b64_creds, sheet_id = google_environment()
+            client = get_sheets_client(b64_creds, self.scope)
+            self._sheet = client.open_by_key(sheet_id).sheet1
+        return self._sheet
+
+    def ensure_header(self, header_row, sheet_header=None):
+        """
+        Makes row 1 contain every column of header_row, appending any the sheet
+        lacks (e.g. a question added since), and returns the sheet's header.
+        Row 1 is read at most once per worker; pass `sheet_header` if it was
+        already read.
+        """
+        sheet = self.get_sheet()
+        if self._header is None:
+            self._header = list(sheet_header) if sheet_header is not None else sheet.row_values(1)
+        missing = [name for name in header_row if name not in self._header]
+        if missing:
+            if not self._header:
+                logger.info("Sheet is empty, adding headers")
+            self._header = self._header + missing
+            sheet.batch_update([{'range': 'A1', 'values': [self._header]}])
+        return self._header
+
+    def arrange(self, header_row, rows):
+        """
+        Reorders rows laid out as header_row into the sheet's column order.
+        """
+        return arrange_rows(header_row, self._header, rows)
+
+    def write_rows(self, header_row, rows):
+        self.ensure_header(header_row)
+        self.get_sheet().append_rows(self.arrange(header_row, rows))
+
+
+class CSVFileSink:
+    """
+    Local stand-in for the spreadsheet: appends rows to SURVEY_EXPORT_FILE,
+    in the column order of the file's first line.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or settings.SURVEY_EXPORT_FILE
+
+    def write_rows(self, header_row, rows):
+        file_header = None
+        if os.path.exists(self.path) and os.path.getsize(self.path):
+            with open(self.path, newline='', encoding='utf-8') as f:
+                file_header = next(csv.reader(f), None)
+        with open(self.path, 'a', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            if file_header is None:
+                writer.writerow(header_row)
+                file_header = header_row
+            writer.writerows(arrange_rows(header_row, file_header, rows))
+
+
+def get_export_sink():
+    return import_string(settings.SURVEY_EXPORT_SINK)()
+
+
+def enqueue_evaluation(instance):
+    """
+    Queues the spreadsheet row for a freshly created evaluation.
+    """
+    return ExportOutbox.objects.create(
+        evaluation=instance, payload=prepare_data_row(instance), header=prepare_header_row(),
+    )
+
+
+def enqueue_evaluations(evaluations):
+    """
+    Queues rows for evaluations written with bulk_create, which does not send
+    post_save. Uses one query for all the users' answers and one insert.
+    """
+    ratings = get_ratings_by_user({evaluation.user_id for evaluation in evaluations})
+    header = prepare_header_row()
+    return ExportOutbox.objects.bulk_create([
+        ExportOutbox(
+            evaluation=evaluation,
+            payload=prepare_data_row(evaluation, ratings.get(evaluation.user_id, {})),
+            header=header,
+        )
+        for evaluation in evaluations
+    ])
+
+
+def refresh_pending_exports(evaluations):
+    """
+    Rewrites the queued rows of evaluations that were updated (e.g. a retried
+    submission with changed ratings) before the worker sent them. Rows that
+    are already in the sheet keep the values they were sent with; the
+    research export always reads the current values from the database.
+    """
+    by_id = {evaluation.pk: evaluation for evaluation in evaluations}
+    pending = list(ExportOutbox.objects.filter(evaluation_id__in=by_id, delivered_at__isnull=True))
+    if not pending:
+        return 0
+    ratings = get_ratings_by_user({by_id[entry.evaluation_id].user_id for entry in pending})
+    header = prepare_header_row()
+    for entry in pending:
+        evaluation = by_id[entry.evaluation_id]
+        entry.payload = prepare_data_row(evaluation, ratings.get(evaluation.user_id, {}))
+        entry.header = header
+    ExportOutbox.objects.bulk_update(pending, ['payload', 'header'])
+    return len(pending)
+
+
+def retry_delay(attempts):
+    delay = settings.SURVEY_EXPORT_RETRY_BASE * 2 ** max(attempts - 1, 0)
+    return timedelta(seconds=min(delay, settings.SURVEY_EXPORT_RETRY_MAX))
+
+
+def claim_outbox(batch_size, now, due_only=True):
+    """
+    Takes up to batch_size due rows for this worker: they are locked while
+    being picked (rows another worker is picking are skipped) and then
+    leased by moving next_attempt_at and leased_until SURVEY_EXPORT_CLAIM_LEASE
+    seconds ahead, so concurrent workers never send the same rows. Rows of a
+    worker that dies before delivering become due again when the lease runs
+    out. With due_only=False, rows waiting out a retry delay are taken too
+    (but never leased ones); batch_size=None takes every row.
+    """
+    lease_end = now + timedelta(seconds=settings.SURVEY_EXPORT_CLAIM_LEASE)
+    pending = ExportOutbox.objects.filter(delivered_at__isnull=True)
+    if due_only:
+        pending = pending.filter(next_attempt_at__lte=now)
+    with transaction.atomic():
+        batch = list(
+            pending
+            .exclude(leased_until__gt=now)
+            .select_for_update(skip_locked=True)
+            .order_by('id')[:batch_size]
+        )
+        if batch:
+            ExportOutbox.objects.filter(pk__in=[entry.pk for entry in batch]).update(
+                next_attempt_at=lease_end, leased_until=lease_end,
+            )
+    return batch
+
+
+def drain_outbox(sink, batch_size=None):
+    """
+    Sends one batch of due rows, with one sink call per header the rows were
+    queued under (questions may have changed while they waited), so every
+    row lands under its own column names. Returns the number of rows
+    delivered; rows of a failed call are rescheduled with exponential backoff.
+    """
+    batch_size = batch_size or settings.SURVEY_EXPORT_BATCH_SIZE
+    now = timezone.now()
+    batch = claim_outbox(batch_size, now)
+    if not batch:
+        return 0
+
+    groups = {}
+    for entry in batch:
+        # Rows queued before headers were stored are taken as current.
+        header = tuple(entry.header) if entry.header else tuple(prepare_header_row())
+        groups.setdefault(header, []).append(entry)
+    return sum(send_rows(sink, list(header), entries, now) for header, entries in groups.items())
+
+
+def send_rows(sink, header, batch, now):
+    try:
+        with time_sink_call(len(batch)):
+            sink.write_rows(header, [entry.payload for entry in batch])
+    except Exception as e:
+        for entry in batch:
+            entry.attempts += 1
+            entry.next_attempt_at = now + retry_delay(entry.attempts)
+            entry.last_error = str(e)
+            entry.leased_until = None
+        ExportOutbox.objects.bulk_update(batch, ['attempts', 'next_attempt_at', 'last_error', 'leased_until'])
+        logger.error("Export of %d rows failed: %s", len(batch), e)
+        return 0
+
+    ExportOutbox.objects.filter(pk__in=[entry.pk for entry in batch]).update(
+        delivered_at=timezone.now(),
+        leased_until=None,
+        last_error='',
+    )
+    return len(batch)
@@ -0,0 +1,316 @@
+"""
+Write-behind mode for participant submissions (SURVEY_WRITE_BEHIND).
+
+The noise-response and evaluation endpoints validate as usual, append
+the validated rows to a local SQLite journal in WAL mode and answer 202.
+The main database's writer lock is not taken on the request path. A
+flusher commits journaled rows to the main database in batches of
+SURVEY_WRITE_BEHIND_BATCH_SIZE. Each batch is one transaction that goes
+through the viewsets' own perform_bulk_create. The upserts, exports and
+aggregates are therefore the same as on the synchronous path.
+Foreign keys are loaded with one query per field for the whole batch.
+
+Entries are claimed with a lease and deleted only after the main
+transaction commits. A crash at any point leaves them in the journal
+for the next flusher, which replays them on startup. Replays are
+harmless because every write is an upsert on its natural key. If a batch
+fails for any reason other than the database being unavailable, its
+entries are retried one by one in savepoints. Entries that fail on their
+own, e.g. ones that reference something deleted in the meantime, are
+kept in the journal with their error instead of being retried, and the
+rest of the batch is committed.
+
+The flusher runs as a thread in each web process, started by
+audioupload/wsgi.py and audioupload/asgi.py (runserver loads the former)
+and again by a request if it died, or on its own with
+`manage.py flush_journal`. Management commands, test runs and scripts
+that only call django.setup() do not start one.
+"""
+import json
+import time
+import sqlite3
+import logging
+import threading
+
+from django.conf import settings
+from django.db import InterfaceError, OperationalError, close_old_connections, transaction
+
+
+logger = logging.getLogger(__name__)
+
+# Errors that say nothing about the entries themselves (connection lost,
+# database locked); anything else raised while writing an entry rejects it.
+TRANSIENT_ERRORS = (OperationalError, InterfaceError)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    received_at REAL NOT NULL,
+    claimed_until REAL NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT
+)
+"""
+
+
+class Journal:
+    """
+    Append-only queue of validated submissions in a SQLite file, one
+    connection per thread.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._local = threading.local()
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=FULL')  # an acknowledged row survives a power cut
+            conn.execute(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def _write(self, sql, params=(), many=False):
+        conn = self.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            cursor = conn.executemany(sql, params) if many else conn.execute(sql, params)
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        return cursor
+
+    def append(self, kind, payloads):
+        now = time.time()
+        self._write(
+            'INSERT INTO entries (kind, payload, received_at) VALUES (?, ?, ?)',
+            [(kind, json.dumps(payload), now) for payload in payloads],
+            many=True,
+        )
+
+    def claim(self, limit, lease):
+        """
+        [(id, kind, payload)] of up to `limit` unclaimed entries, oldest
+        first, leased to the caller for `lease` seconds.
+        """
+        conn = self.connection()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = conn.execute(
+                'SELECT id, kind, payload FROM entries WHERE error IS NULL AND claimed_until < ? '
+                'ORDER BY id LIMIT ?',
+                (now, limit),
+            ).fetchall()
+            if rows:
+                conn.execute(
+                    f'UPDATE entries SET claimed_until = ?, attempts = attempts + 1 '
+                    f'WHERE id IN ({",".join("?" * len(rows))})',
+                    [now + lease, *(row[0] for row in rows)],
+                )
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        return [(pk, kind, json.loads(payload)) for pk, kind, payload in rows]
+
+    def complete(self, ids):
+        if ids:
+            self._write(f'DELETE FROM entries WHERE id IN ({",".join("?" * len(ids))})', list(ids))
+
+    def release(self, ids):
+        if ids:
+            self._write(f'UPDATE entries SET claimed_until = 0 WHERE id IN ({",".join("?" * len(ids))})', list(ids))
+
+    def fail(self, pk, error):
+        self._write('UPDATE entries SET error = ? WHERE id = ?', (str(error), pk))
+
+    def stats(self):
+        pending, oldest, failed = self.connection().execute(
+            'SELECT SUM(error IS NULL), MIN(CASE WHEN error IS NULL THEN received_at END), SUM(error IS NOT NULL) '
+            'FROM entries'
+        ).fetchone()
+        return {
+            'pending': pending or 0,
+            'oldest_age': time.time() - oldest if oldest else 0,
+            'failed': failed or 0,
+        }
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+_journals = {}
+_journals_lock = threading.Lock()
+
+
+def get_journal():
+    path = str(settings.SURVEY_WRITE_BEHIND_JOURNAL)
+    with _journals_lock:
+        journal = _journals.get(path)
+        if journal is None:
+            journal = _journals[path] = Journal(path)
+    return journal
+
+
+def enabled():
+    return settings.SURVEY_WRITE_BEHIND
+
+
+def writers():
+    """
+    {journal kind: viewset class} of the endpoints that can write behind.
+    """
+    from .views import NoiseResponseViewSet, AudioEvaluationViewSet
+
+    return {viewset.journal_kind: viewset for viewset in (NoiseResponseViewSet, AudioEvaluationViewSet)}
+
+
+def build_objects(kind, entries):
+    """
+    Model instances for [(id, payload)], with foreign keys loaded in one
+    query per field. Entries whose referenced rows no longer exist are
+    returned separately as [(id, error)].
+    """
+    model = writers()[kind].queryset.model
+    related = {
+        field: field.related_model._default_manager.in_bulk(
+            {payload[field.attname] for _, payload in entries if field.attname in payload}
+        )
+        for field in model._meta.concrete_fields
+        if field.is_relation and any(field.attname in payload for _, payload in entries)
+    }
+    objs, rejected = [], []
+    for pk, payload in entries:
+        obj = model(**payload)
+        missing = []
+        for field, rows in related.items():
+            value = payload.get(field.attname)
+            if value in rows:
+                setattr(obj, field.name, rows[value])
+            elif value is not None:
+                missing.append(f"{field.name} {value}")
+        if missing:
+            rejected.append((pk, f"{', '.join(missing)} no longer exists"))
+        else:
+            objs.append(obj)
+    return objs, rejected
+
+
+def write_entries(kind, entries):
+    """
+    Writes [(id, payload)] through the endpoint's perform_bulk_create and
+    returns the rejected [(id, error)].
+    """
+    objs, rejected = build_objects(kind, entries)
+    if objs:
+        writers()[kind]().perform_bulk_create(objs)
+    return rejected
+
+
+def flush_journal(journal=None, batch_size=None):
+    """
+    Commits one batch of journaled entries to the database in a single
+    transaction. Returns the number of entries taken off the journal.
+    """
+    journal = journal or get_journal()
+    batch_size = batch_size or settings.SURVEY_WRITE_BEHIND_BATCH_SIZE
+    entries = journal.claim(batch_size, settings.SURVEY_WRITE_BEHIND_LEASE)
+    if not entries:
+        return 0
+
+    groups = {}
+    for pk, kind, payload in entries:
+        groups.setdefault(kind, []).append((pk, payload))
+    retry = []
+    try:
+        with transaction.atomic():
+            rejected = []
+            for kind, items in groups.items():
+                rejected.extend(write_entries(kind, items))
+    except TRANSIENT_ERRORS as e:
+        # Database unavailable or locked: the whole batch is retried later.
+        logger.warning("Journal flush of %d entries failed: %s", len(entries), e)
+        journal.release([pk for pk, _, _ in entries])
+        return 0
+    except Exception as e:
+        # Something in the batch fails for good; find it without blocking the rest.
+        logger.warning("Journal batch of %d entries failed, retrying one by one: %s", len(entries), e)
+        rejected, retry = flush_one_by_one(entries)
+
+    for pk, error in rejected:
+        logger.error("Journal entry %d rejected: %s", pk, error)
+        journal.fail(pk, error)
+    journal.release(retry)
+    done = {pk for pk, _ in rejected} | set(retry)
+    journal.complete([pk for pk, _, _ in entries if pk not in done])
+    return len(entries) - len(retry)
+
+
+def flush_one_by_one(entries):
+    """
+    Writes each entry in its own savepoint of one transaction. Returns the
+    rejected [(id, error)] and the ids to retry after a transient error.
+    """
+    rejected, retry = [], []
+    with transaction.atomic():
+        for pk, kind, payload in entries:
+            try:
+                with transaction.atomic():
+                    rejected.extend(write_entries(kind, [(pk, payload)]))
+            except TRANSIENT_ERRORS:
+                retry.append(pk)
+            except Exception as e:
+                rejected.append((pk, f"{type(e).__name__}: {e}"))
+    return rejected, retry
+
+
+class Flusher(threading.Thread):
+    def __init__(self, interval=None):
+        super().__init__(name='survey-journal-flusher', daemon=True)
+        self.interval = interval if interval is not None else settings.SURVEY_WRITE_BEHIND_INTERVAL
+        self.stopped = threading.Event()
+
+    def run(self):
+        batch_size = settings.SURVEY_WRITE_BEHIND_BATCH_SIZE
+        while not self.stopped.is_set():
+            try:
+                flushed = flush_journal(batch_size=batch_size)
+            except Exception:
+                logger.exception("Journal flusher error")
+                flushed = 0
+            finally:
+                close_old_connections()
+            if flushed < batch_size:
+                self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+
+
+_flusher = None
+_flusher_lock = threading.Lock()
+
+
+def start_flusher(**kwargs):
+    """
+    Starts this process's flusher thread once; it replays whatever an
+    earlier process left in the journal before taking new entries.
+    """
+    global _flusher
+    if not enabled() or not settings.SURVEY_WRITE_BEHIND_FLUSHER:
+        return None
+    with _flusher_lock:
+        if _flusher is None or not _flusher.is_alive():
+            _flusher = Flusher()
+            _flusher.start()
+    return _flusher
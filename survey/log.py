@@ -0,0 +1,151 @@
+"""
+Non-blocking structured logging, wired up in settings.LOGGING.
+
+Request threads only put records on a bounded queue (BackgroundHandler);
+a QueueListener thread formats them as JSON lines and does the blocking
+write. When the queue is full records are dropped and counted instead
+of stalling a worker. RedactFilter runs before enqueueing, so
+participant data never reaches the queue, and SamplingFilter thins
+chatty loggers per module.
+"""
+import sys
+import json
+import queue
+import random
+import logging
+import logging.handlers
+from datetime import datetime, timezone
+
+
+# Attributes every LogRecord has; anything else came from `extra=`.
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'taskName'}
+
+REDACTED = '[redacted]'
+
+
+def record_extras(record):
+    return {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES}
+
+
+class BackgroundHandler(logging.handlers.QueueHandler):
+    """
+    Enqueues records for a QueueListener thread that writes them to `stream`
+    (sys.stdout by default). The formatter set on this handler is used by
+    the listener thread, not by the caller.
+    """
+
+    def __init__(self, stream=None, maxsize=10000):
+        super().__init__(queue.Queue(maxsize))
+        self.target = logging.StreamHandler(stream or sys.stdout)
+        self.dropped = 0
+        self.listener = logging.handlers.QueueListener(self.queue, self.target)
+        self.listener.start()
+
+    def setFormatter(self, fmt):
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # Cheapest safe snapshot: merge args now (they may be mutated later),
+        # render the traceback now (frames do not outlive the request), and
+        # leave the JSON formatting to the listener thread.
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self):
+        """
+        Blocks until everything queued so far has been written.
+        """
+        if self.listener._thread is not None:
+            self.listener.stop()
+            self.listener.start()
+
+    def close(self):
+        # logging.shutdown() calls this at exit, after a final flush.
+        if self.listener._thread is not None:
+            self.listener.stop()
+        super().close()
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line: time, level, logger, message, any `extra=`
+    fields and the traceback.
+    """
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update(record_extras(record))
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class RedactFilter(logging.Filter):
+    """
+    Replaces the values of `fields` (e.g. user_id, age) wherever they appear
+    in `extra=` payloads or in dicts and lists passed as message arguments,
+    at any depth. Text already in the message (e.g. a formatted exception)
+    is not parsed, so log payloads as arguments or extras, not in the text.
+    """
+
+    def __init__(self, fields=()):
+        super().__init__()
+        self.fields = {field.lower() for field in fields}
+
+    def redact(self, value):
+        if isinstance(value, dict) or hasattr(value, 'items'):
+            return {
+                key: REDACTED if str(key).lower() in self.fields else self.redact(item)
+                for key, item in value.items()
+            }
+        if isinstance(value, (list, tuple)):
+            return [self.redact(item) for item in value]
+        return value
+
+    def filter(self, record):
+        for key, value in record_extras(record).items():
+            if key.lower() in self.fields:
+                setattr(record, key, REDACTED)
+            elif isinstance(value, (dict, list, tuple)) or hasattr(value, 'items'):
+                setattr(record, key, self.redact(value))
+        if isinstance(record.args, dict):
+            record.args = self.redact(record.args)  # "%(name)s" style
+        elif record.args:
+            record.args = tuple(
+                self.redact(arg) if isinstance(arg, (dict, list, tuple)) or hasattr(arg, 'items') else arg
+                for arg in record.args
+            )
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Passes records at or above `always_level` and a `rate` share of the rest.
+    """
+
+    def __init__(self, rate=1.0, always_level='WARNING'):
+        super().__init__()
+        self.rate = float(rate)
+        self.always_level = logging.getLevelName(always_level) if isinstance(always_level, str) else always_level
+
+    def filter(self, record):
+        return record.levelno >= self.always_level or random.random() < self.rate
+
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from survey.models import AudioEvaluation
+from survey.soundscape import backfill_iso_coordinates
+
+
+class Command(BaseCommand):
+    help = "Computes the ISO 12913-3 coordinates of evaluations, in chunks."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000)
+        parser.add_argument('--all', action='store_true', help="Recompute evaluations that already have coordinates.")
+
+    def handle(self, *args, **options):
+        queryset = AudioEvaluation.objects.all() if options['all'] else None
+        updated = backfill_iso_coordinates(queryset, chunk_size=options['chunk_size'])
+        self.stdout.write(f"✅ Updated {updated} evaluations")
@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from survey.models import Audio
+from survey.variants import build_variant
+
+
+class Command(BaseCommand):
+    help = "Renders the missing SURVEY_AUDIO_VARIANTS of every Audio, e.g. after adding a variant."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--variant', action='append', dest='variants',
+                            help="Only build this variant (repeatable).")
+
+    def handle(self, *args, **options):
+        variants = options['variants'] or list(settings.SURVEY_AUDIO_VARIANTS)
+        for audio in Audio.objects.order_by('id'):
+            for variant in variants:
+                try:
+                    name = build_variant(audio, variant)
+                except (OSError, EOFError, ValueError) as e:
+                    self.stderr.write(f"❌ {audio.id} {variant}: {e}")
+                    continue
+                self.stdout.write(f"✅ {audio.id} {variant}: {name}")
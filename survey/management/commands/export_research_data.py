@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from survey.research_export import write_csv, write_parquet, ParquetUnavailable
+from survey.routers import replica_reads
+
+
+class Command(BaseCommand):
+    help = "Writes the wide-format research export (one row per evaluation) as CSV or Parquet."
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help="Output path; '-' writes CSV to stdout.")
+        parser.add_argument('--format', choices=['csv', 'parquet'], help="Defaults to the output file extension.")
+        parser.add_argument('--chunk-size', type=int, help="Rows fetched per round trip.")
+
+    def handle(self, *args, **options):
+        # A replica, when configured, serves the export's long scans.
+        with replica_reads():
+            self.export(**options)
+
+    def export(self, **options):
+        output = options['output']
+        file_format = options['format'] or ('parquet' if output.endswith('.parquet') else 'csv')
+        chunk_size = options['chunk_size']
+
+        if file_format == 'parquet':
+            if output == '-':
+                raise CommandError("Parquet cannot be written to stdout")
+            try:
+                count = write_parquet(output, chunk_size)
+            except ParquetUnavailable as e:
+                raise CommandError(str(e))
+        elif output == '-':
+            write_csv(self.stdout, chunk_size)
+            return
+        else:
+            with open(output, 'w', newline='', encoding='utf-8') as f:
+                count = write_csv(f, chunk_size)
+
+        self.stderr.write(f"✅ Exported {count} evaluations to {output}")
@@ -0,0 +1,42 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from survey.journal import enabled, flush_journal, get_journal
+
+
+class Command(BaseCommand):
+    help = (
+        "Commits write-behind journal entries to the database. Run once before "
+        "starting the web server to replay a journal left by a crash, or "
+        "continuously in place of the per-process flusher threads."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.SURVEY_WRITE_BEHIND_BATCH_SIZE)
+        parser.add_argument('--interval', type=float, default=settings.SURVEY_WRITE_BEHIND_INTERVAL,
+                            help="Seconds to sleep when the journal is empty.")
+        parser.add_argument('--once', action='store_true', help="Drain the journal and exit.")
+
+    def handle(self, *args, **options):
+        if not enabled():
+            raise CommandError("SURVEY_WRITE_BEHIND is off.")
+        journal = get_journal()
+        batch_size = options['batch_size']
+        while True:
+            flushed = flush_journal(journal, batch_size)
+            if flushed:
+                self.stdout.write(f"✅ Committed {flushed} journal entries")
+            if flushed == batch_size:
+                continue
+            if options['once']:
+                break
+            try:
+                time.sleep(options['interval'])
+            except KeyboardInterrupt:
+                break
+
+        stats = journal.stats()
+        if stats['failed']:
+            self.stderr.write(f"⚠️  {stats['failed']} journal entries were rejected by the database")
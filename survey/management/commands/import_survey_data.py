@@ -0,0 +1,53 @@
+import csv
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from survey.bulk_import import SurveyImporter, ImportDataError, iter_json_objects
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk-loads UserProfile, NoiseResponse and AudioEvaluation rows from a fixture "
+        "(JSON array or JSON lines) or a wide CSV export, without queueing Sheets exports."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Input file; '-' reads stdin.")
+        parser.add_argument('--format', choices=['json', 'csv'], help="Defaults to the file extension.")
+        parser.add_argument('--chunk-size', type=int, default=1000, help="Rows per transaction.")
+        parser.add_argument('--export', action='store_true',
+                            help="Also queue the imported evaluations for the Sheets export.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('csv' if path.lower().endswith('.csv') else 'json')
+        importer = SurveyImporter(
+            chunk_size=options['chunk_size'],
+            export=options['export'],
+            log=(lambda message: self.stdout.write(message)) if options['verbosity'] > 1 else None,
+        )
+
+        f = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8-sig')
+        try:
+            if file_format == 'csv':
+                reader = csv.DictReader(f)
+                importer.csv_columns(reader.fieldnames or [])
+                for row in reader:
+                    importer.add_csv_row(row)
+            else:
+                for obj in iter_json_objects(f):
+                    importer.add_fixture_object(obj)
+            result = importer.finish()
+        except (ImportDataError, ValueError, KeyError) as e:
+            raise CommandError(f"Import failed: {e}")
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+        counts = ', '.join(f"{count} {model}" for model, count in sorted(result['counts'].items())) or 'nothing'
+        self.stdout.write(
+            f"✅ Imported {counts} in {result['seconds']:.1f}s ({result['rows_per_second']:.0f} rows/s)"
+        )
+        for reason, count in sorted(result['skipped'].items()):
+            self.stderr.write(f"⚠️  Skipped {count} rows: {reason}")
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from survey.models import Audio
+from survey.audio import needs_ingest, ingest_audio
+
+
+class Command(BaseCommand):
+    help = "Parses WAV headers and builds waveform peaks for the Audio catalog."
+
+    def add_arguments(self, parser):
+        parser.add_argument('ids', nargs='*', type=int, help="Audio ids (default: all).")
+        parser.add_argument('--force', action='store_true',
+                            help="Re-ingest clips that already have metadata.")
+
+    def handle(self, *args, **options):
+        audios = Audio.objects.order_by('id')
+        if options['ids']:
+            audios = audios.filter(id__in=options['ids'])
+
+        failed = 0
+        for audio in audios:
+            if not options['force'] and not needs_ingest(audio):
+                continue
+            try:
+                info = ingest_audio(audio)
+            except (OSError, EOFError, ValueError) as e:
+                failed += 1
+                self.stderr.write(f"❌ {audio.id} {audio.file.name}: {e}")
+                continue
+            self.stdout.write(
+                f"✅ {audio.id} {audio.file.name}: {info.duration:.2f}s, "
+                f"{info.sample_rate} Hz, {info.channels} ch"
+            )
+        if failed:
+            self.stderr.write(f"{failed} clips failed")
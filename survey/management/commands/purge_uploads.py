@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from survey.uploads import purge_stale_uploads
+
+
+class Command(BaseCommand):
+    help = "Deletes unfinished chunked uploads (and their partial files) that have gone idle."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age', type=int, default=settings.SURVEY_UPLOAD_EXPIRY,
+                            help="Seconds since the last chunk after which an upload is removed.")
+
+    def handle(self, *args, **options):
+        count = purge_stale_uploads(options['max_age'])
+        self.stdout.write(f"✅ Removed {count} stale uploads")
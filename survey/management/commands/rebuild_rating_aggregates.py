@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from survey.stats import rebuild_aggregates
+
+
+class Command(BaseCommand):
+    help = "Recomputes the per-audio rating aggregates from every AudioEvaluation."
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            aggregates = rebuild_aggregates()
+        self.stdout.write(f"✅ Rebuilt aggregates for {len(aggregates)} clips")
@@ -0,0 +1,59 @@
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from survey.export import get_export_sink, drain_outbox
+from survey.metrics import registry
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        try:
+            body = registry.render().encode()
+        finally:
+            connection.close()  # the queue-depth collector runs on this thread
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = "Delivers queued survey rows to the export sink in batches. Several workers may run at once."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.SURVEY_EXPORT_BATCH_SIZE)
+        parser.add_argument('--interval', type=float, default=settings.SURVEY_EXPORT_POLL_INTERVAL,
+                            help="Seconds to sleep when the outbox is empty.")
+        parser.add_argument('--once', action='store_true',
+                            help="Drain whatever is due and exit.")
+        parser.add_argument('--metrics-port', type=int,
+                            help="Serve Prometheus metrics (sink latency, queue depth) on this port.")
+
+    def handle(self, *args, **options):
+        sink = get_export_sink()
+        batch_size = options['batch_size']
+        if options['metrics_port']:
+            server = ThreadingHTTPServer(('', options['metrics_port']), MetricsHandler)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        while True:
+            delivered = drain_outbox(sink, batch_size)
+            if delivered:
+                self.stdout.write(f"✅ Exported {delivered} rows")
+            if delivered == batch_size:
+                continue  # more may be waiting
+            if options['once']:
+                break
+            try:
+                time.sleep(options['interval'])
+            except KeyboardInterrupt:
+                break
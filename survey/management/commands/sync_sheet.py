@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from survey.export import ExportError, get_export_sink
+from survey.sheet_sync import sync_sheet
+
+
+class Command(BaseCommand):
+    help = (
+        "Reads the Google Sheet's existing rows once and appends every evaluation "
+        "it is missing, in batches."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.SURVEY_SHEETS_SYNC_BATCH_SIZE,
+                            help="Rows per append_rows call.")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only report how many rows are missing.")
+
+    def handle(self, *args, **options):
+        sink = get_export_sink()
+        if not hasattr(sink, 'get_sheet'):
+            raise CommandError(f"{settings.SURVEY_EXPORT_SINK} is not a spreadsheet sink.")
+        try:
+            result = sync_sheet(sink, batch_size=options['batch_size'], dry_run=options['dry_run'])
+        except ExportError as e:
+            raise CommandError(str(e))
+
+        if options['dry_run']:
+            self.stdout.write(f"{result['found']} rows in the sheet, {result['appended']} missing")
+        else:
+            self.stdout.write(
+                f"✅ Appended {result['appended']} missing rows ({result['found']} already in the sheet, "
+                f"{result['delivered']} queued rows marked delivered)"
+            )
@@ -0,0 +1,233 @@
+"""
+In-process request and export metrics, rendered in the Prometheus text format.
+
+Observations are a lock, a bisect and a few integer additions, so the
+collection can stay on in production. Every process keeps its own
+registry: scrape each gunicorn worker (or run one worker per metrics
+target), and the export worker serves its own with
+`run_export_worker --metrics-port`.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return '{%s}' % ','.join(pairs) if pairs else ''
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            lines.extend(self.render_sample(labels, value))
+        return lines
+
+    def render_sample(self, labels, value):
+        return [f'{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}']
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=None):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets or settings.SURVEY_METRICS_BUCKETS))
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        with self._lock:
+            items = sorted((labels, ([*counts], total, count)) for labels, (counts, total, count) in self._values.items())
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        for labels, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, float('inf')), counts):
+                cumulative += bucket_count
+                lines.append(
+                    f'{self.name}_bucket{_format_labels(self.labelnames, labels, [("le", _format_value(bound))])} '
+                    f'{cumulative}'
+                )
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, labels)} {count}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        """
+        `collector()` returns (name, type, help, [(labels dict, value), ...]) tuples at scrape time.
+        """
+        self.collectors.append(collector)
+        return collector
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for collector in self.collectors:
+            for name, metric_type, documentation, samples in collector():
+                lines.append(f'# HELP {name} {documentation}')
+                lines.append(f'# TYPE {name} {metric_type}')
+                for labels, value in samples:
+                    lines.append(f'{name}{_format_labels(labels.keys(), labels.values())} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        for metric in self.metrics:
+            metric.clear()
+
+
+registry = Registry()
+
+request_latency = registry.register(Histogram(
+    'survey_request_duration_seconds', "Time until the response object is returned, by view.",
+    ['view', 'method'],
+))
+request_queries = registry.register(Counter(
+    'survey_request_queries_total', "SQL queries run while handling requests, by view.", ['view'],
+))
+request_query_seconds = registry.register(Counter(
+    'survey_request_query_seconds_total', "Time spent in SQL while handling requests, by view.", ['view'],
+))
+response_bytes = registry.register(Counter(
+    'survey_response_bytes_total', "Response body bytes (Content-Length), by view.", ['view'],
+))
+responses = registry.register(Counter(
+    'survey_responses_total', "Responses by view and status code.", ['view', 'status'],
+))
+stream_duration = registry.register(Histogram(
+    'survey_stream_duration_seconds', "Time from request start until a streamed body was fully sent, by view.",
+    ['view'],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+))
+export_sink_latency = registry.register(Histogram(
+    'survey_export_sink_duration_seconds', "Duration of one export sink (Google Sheets) call, by outcome.",
+    ['outcome'],
+))
+export_rows = registry.register(Counter(
+    'survey_export_rows_total', "Rows handed to the export sink, by outcome.", ['outcome'],
+))
+
+
+@contextmanager
+def time_sink_call(rows):
+    """
+    Times one export sink call and counts its rows as delivered or failed.
+    """
+    start = time.perf_counter()
+    outcome = 'failed'
+    try:
+        yield
+        outcome = 'delivered'
+    finally:
+        export_sink_latency.observe(time.perf_counter() - start, outcome)
+        export_rows.inc(rows, outcome)
+
+
+# (monotonic time, aggregate) of the last outbox count: frequent scrapes,
+# or several scrapers, share one COUNT per SURVEY_METRICS_QUEUE_TTL seconds.
+_outbox_snapshot = (0.0, None)
+
+
+@registry.add_collector
+def outbox_metrics():
+    from django.db.models import Count, Min
+    from django.utils import timezone
+
+    from .models import ExportOutbox
+
+    global _outbox_snapshot
+    taken, pending = _outbox_snapshot
+    if pending is None or time.monotonic() - taken >= settings.SURVEY_METRICS_QUEUE_TTL:
+        pending = ExportOutbox.objects.filter(delivered_at__isnull=True).aggregate(
+            depth=Count('id'), oldest=Min('created_at'),
+        )
+        _outbox_snapshot = (time.monotonic(), pending)
+    age = (timezone.now() - pending['oldest']).total_seconds() if pending['oldest'] else 0
+    return [
+        ('survey_export_queue_depth', 'gauge', "Export outbox rows not yet delivered.", [({}, pending['depth'])]),
+        ('survey_export_queue_oldest_seconds', 'gauge', "Age of the oldest undelivered outbox row.", [({}, age)]),
+    ]
+
+
+@registry.add_collector
+def mmap_cache_metrics():
+    from .streaming import mmap_cache
+
+    stats = mmap_cache.stats()
+    return [
+        ('survey_mmap_cache_hits_total', 'counter', "Clip mmap cache hits.", [({}, stats['hits'])]),
+        ('survey_mmap_cache_misses_total', 'counter', "Clip mmap cache misses.", [({}, stats['misses'])]),
+        ('survey_mmap_cache_evictions_total', 'counter', "Clip mmap cache evictions.", [({}, stats['evictions'])]),
+        ('survey_mmap_cache_bytes', 'gauge', "Bytes of clips currently mapped.", [({}, stats['bytes'])]),
+    ]
+
+
+@registry.add_collector
+def journal_metrics():
+    from . import journal
+
+    if not journal.enabled():
+        return []
+    stats = journal.get_journal().stats()
+    return [
+        ('survey_journal_pending', 'gauge', "Write-behind journal entries not yet committed.", [({}, stats['pending'])]),
+        ('survey_journal_oldest_seconds', 'gauge', "Age of the oldest uncommitted journal entry.",
+         [({}, stats['oldest_age'])]),
+        ('survey_journal_failed', 'gauge', "Journal entries the database rejected.", [({}, stats['failed'])]),
+    ]
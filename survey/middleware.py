@@ -0,0 +1,113 @@
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+from .metrics import (
+    request_latency,
+    request_queries,
+    request_query_seconds,
+    response_bytes,
+    responses,
+    stream_duration,
+)
+
+
+class QueryTimer:
+    """
+    connection.execute_wrapper that counts queries and their time.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.count += 1
+
+
+class MetricsMiddleware:
+    """
+    Records per-view latency, SQL query count and time, response bytes and,
+    for streamed bodies (AudioStreamView), the time until the body was fully
+    sent. Adds a Server-Timing header with the app and db times.
+
+    Under ASGI the async path records latency and bytes only: queries run in
+    worker threads whose connections are not wrapped.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        start = time.perf_counter()
+        timer = QueryTimer()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(timer))
+            response = self.get_response(request)
+        self.record(request, response, start, timer)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        self.record(request, response, start, None)
+        return response
+
+    def record(self, request, response, start, timer):
+        elapsed = time.perf_counter() - start
+        match = request.resolver_match
+        view = match.view_name if match and match.view_name else 'unmatched'
+
+        request_latency.observe(elapsed, view, request.method)
+        responses.inc(1, view, str(response.status_code))
+        if timer is not None:
+            request_queries.inc(timer.count, view)
+            request_query_seconds.inc(timer.seconds, view)
+
+        if response.streaming:
+            length = response.get('Content-Length')
+            if length:
+                response_bytes.inc(int(length), view)
+            self.time_until_close(response, start, view)
+        else:
+            response_bytes.inc(len(response.content), view)
+
+        if settings.SURVEY_SERVER_TIMING:
+            timings = [f'app;dur={elapsed * 1000:.1f}']
+            if timer is not None:
+                timings.append(f'db;dur={timer.seconds * 1000:.1f};desc="{timer.count} queries"')
+            response['Server-Timing'] = ', '.join(timings)
+
+    def time_until_close(self, response, start, view):
+        # The server calls close() once it has sent the whole body (or the
+        # client went away); under wsgi.file_wrapper Django routes the
+        # wrapper's close() to it too.
+        close = response.close
+        recorded = []
+
+        def close_and_record():
+            try:
+                close()
+            finally:
+                if not recorded:
+                    recorded.append(True)
+                    stream_duration.observe(time.perf_counter() - start, view)
+
+        response.close = close_and_record
+
@@ -0,0 +1,48 @@
+# Generated by Django 6.0.1 on 2026-10-18 11:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('survey', '0004_exportoutbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='audio',
+            name='bits_per_sample',
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='audio',
+            name='channels',
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='audio',
+            name='data_offset',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='audio',
+            name='data_size',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='audio',
+            name='duration',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='audio',
+            name='peaks',
+            field=models.FileField(blank=True, upload_to='peaks/'),
+        ),
+        migrations.AddField(
+            model_name='audio',
+            name='sample_rate',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('survey', '0005_audio_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='audio',
+            name='sha256',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 6.0.1 on 2026-10-18 13:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('survey', '0006_audio_sha256'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AudioRatingAggregate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.BigIntegerField(default=0)),
+                ('annoyance_sum', models.BigIntegerField(default=0)),
+                ('annoyance_sumsq', models.BigIntegerField(default=0)),
+                ('eventfulness_sum', models.BigIntegerField(default=0)),
+                ('eventfulness_sumsq', models.BigIntegerField(default=0)),
+                ('pleasantness_sum', models.BigIntegerField(default=0)),
+                ('pleasantness_sumsq', models.BigIntegerField(default=0)),
+                ('chaotic_sum', models.BigIntegerField(default=0)),
+                ('chaotic_sumsq', models.BigIntegerField(default=0)),
+                ('vibrant_sum', models.BigIntegerField(default=0)),
+                ('vibrant_sumsq', models.BigIntegerField(default=0)),
+                ('uneventful_sum', models.BigIntegerField(default=0)),
+                ('uneventful_sumsq', models.BigIntegerField(default=0)),
+                ('calm_sum', models.BigIntegerField(default=0)),
+                ('calm_sumsq', models.BigIntegerField(default=0)),
+                ('monotonous_sum', models.BigIntegerField(default=0)),
+                ('monotonous_sumsq', models.BigIntegerField(default=0)),
+                ('traffic_noise_sum', models.BigIntegerField(default=0)),
+                ('traffic_noise_sumsq', models.BigIntegerField(default=0)),
+                ('other_noise_sum', models.BigIntegerField(default=0)),
+                ('other_noise_sumsq', models.BigIntegerField(default=0)),
+                ('human_sounds_sum', models.BigIntegerField(default=0)),
+                ('human_sounds_sumsq', models.BigIntegerField(default=0)),
+                ('natural_sounds_sum', models.BigIntegerField(default=0)),
+                ('natural_sounds_sumsq', models.BigIntegerField(default=0)),
+                ('audio', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='rating_aggregate', to='survey.audio')),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.0.1 on 2026-10-18 13:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('survey', '0007_audioratingaggregate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='audioevaluation',
+            name='iso_eventful',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='audioevaluation',
+            name='iso_pleasant',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 6.0.1 on 2026-10-18 14:00
+
+from django.db import migrations
+from django.db.models import Count, F, Max, Sum
+
+
+RATING_FIELDS = [
+    'annoyance', 'eventfulness', 'pleasantness', 'chaotic',
+    'vibrant', 'uneventful', 'calm', 'monotonous',
+    'traffic_noise', 'other_noise', 'human_sounds', 'natural_sounds',
+]
+
+
+def delete_duplicates(model, key_fields):
+    """
+    Keeps the latest row of every duplicated key and deletes the rest, as the
+    upserts do from now on: a retried submission carries the final answer.
+    Returns the number of rows deleted.
+    """
+    duplicates = (
+        model.objects.values(*key_fields)
+        .annotate(keep=Max('pk'), rows=Count('pk'))
+        .filter(rows__gt=1)
+        .order_by()
+    )
+    deleted = 0
+    for group in duplicates:
+        key = {field: group[field] for field in key_fields}
+        deleted += model.objects.filter(**key).exclude(pk=group['keep']).delete()[0]
+    return deleted
+
+
+def rebuild_rating_aggregates(apps):
+    # Same as survey.stats.rebuild_aggregates(), against the historical models.
+    AudioEvaluation = apps.get_model('survey', 'AudioEvaluation')
+    AudioRatingAggregate = apps.get_model('survey', 'AudioRatingAggregate')
+    annotations = {'count': Count('id')}
+    for field in RATING_FIELDS:
+        annotations[f'{field}_sum'] = Sum(field)
+        annotations[f'{field}_sumsq'] = Sum(F(field) * F(field))
+    rows = AudioEvaluation.objects.values('audio_id').annotate(**annotations).order_by()
+    AudioRatingAggregate.objects.all().delete()
+    AudioRatingAggregate.objects.bulk_create([
+        AudioRatingAggregate(**{name: value or 0 for name, value in row.items()})
+        for row in rows
+    ])
+
+
+def dedupe(apps, schema_editor):
+    delete_duplicates(apps.get_model('survey', 'NoiseResponse'), ['user_id', 'question_id'])
+    delete_duplicates(apps.get_model('survey', 'AudioEvaluation'), ['user_id', 'audio_id'])
+    # Deleted rows did not go through the signals; also covers databases
+    # that predate the aggregates.
+    rebuild_rating_aggregates(apps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('survey', '0008_audioevaluation_iso_coordinates'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe, migrations.RunPython.noop),
+    ]
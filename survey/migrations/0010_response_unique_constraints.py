@@ -0,0 +1,25 @@
+# Generated by Django 6.0.1 on 2026-10-18 14:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('survey', '0009_dedupe_responses'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='audioevaluation',
+            index=models.Index(fields=['audio', 'submitted_at'], name='evaluation_audio_submitted'),
+        ),
+        migrations.AddConstraint(
+            model_name='audioevaluation',
+            constraint=models.UniqueConstraint(fields=('user', 'audio'), name='unique_audio_evaluation'),
+        ),
+        migrations.AddConstraint(
+            model_name='noiseresponse',
+            constraint=models.UniqueConstraint(fields=('user', 'question'), name='unique_noise_response'),
+        ),
+    ]
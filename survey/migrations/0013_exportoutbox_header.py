@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-18 17:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('survey', '0012_audioupload_writing_until'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exportoutbox',
+            name='header',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-18 18:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('survey', '0013_exportoutbox_header'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exportoutbox',
+            name='leased_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
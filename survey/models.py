@@ -1,5 +1,8 @@
+import uuid
+
 from django.db import models
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.utils import timezone
 
 class UserProfile(models.Model):
     GENDER_CHOICES = [
@@ -16,6 +19,16 @@ class Audio(models.Model):
     title = models.CharField(max_length=100)
     file = models.FileField(upload_to='audios/')
 
+    # Filled in from the WAV header at ingest (see survey/audio.py)
+    duration = models.FloatField(null=True, blank=True)  # seconds
+    sample_rate = models.PositiveIntegerField(null=True, blank=True)
+    channels = models.PositiveSmallIntegerField(null=True, blank=True)
+    bits_per_sample = models.PositiveSmallIntegerField(null=True, blank=True)
+    data_offset = models.PositiveBigIntegerField(null=True, blank=True)  # byte offset of the first sample
+    data_size = models.PositiveBigIntegerField(null=True, blank=True)
+    peaks = models.FileField(upload_to='peaks/', blank=True)  # int8 min/max pairs
+    sha256 = models.CharField(max_length=64, blank=True)  # of the source file, keys derived variants
+
 class NoiseQuestion(models.Model):
     number = models.IntegerField()
     text = models.TextField()
@@ -26,7 +39,20 @@ class NoiseResponse(models.Model):
     question = models.ForeignKey(NoiseQuestion, on_delete=models.CASCADE)
     rating = models.IntegerField()  # 1 to 6
 
+    class Meta:
+        constraints = [
+            # A retried submission updates the answer instead of adding a row.
+            models.UniqueConstraint(fields=['user', 'question'], name='unique_noise_response'),
+        ]
+
 class AudioEvaluation(models.Model):
+    # Every slider and sound-source field, in export column order
+    RATING_FIELDS = [
+        'annoyance', 'eventfulness', 'pleasantness', 'chaotic',
+        'vibrant', 'uneventful', 'calm', 'monotonous',
+        'traffic_noise', 'other_noise', 'human_sounds', 'natural_sounds',
+    ]
+
     audio = models.ForeignKey(Audio, on_delete=models.CASCADE)
     user = models.ForeignKey(UserProfile, on_delete=models.CASCADE)
 
@@ -46,4 +72,97 @@ class AudioEvaluation(models.Model):
     human_sounds = models.IntegerField(default=0)
     natural_sounds = models.IntegerField(default=0)
 
+    # ISO 12913-3 circumplex coordinates, filled at write time (see survey/soundscape.py)
+    iso_pleasant = models.FloatField(null=True, blank=True, editable=False)
+    iso_eventful = models.FloatField(null=True, blank=True, editable=False)
+
     submitted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'audio'], name='unique_audio_evaluation'),
+        ]
+        indexes = [
+            models.Index(fields=['audio', 'submitted_at'], name='evaluation_audio_submitted'),
+        ]
+
+class AudioRatingAggregate(models.Model):
+    """
+    Running count, sum and sum of squares of every rating field for one Audio,
+    updated in the same transaction as each evaluation save or delete.
+    """
+    audio = models.OneToOneField(Audio, on_delete=models.CASCADE, related_name='rating_aggregate')
+    count = models.BigIntegerField(default=0)
+
+    annoyance_sum = models.BigIntegerField(default=0)
+    annoyance_sumsq = models.BigIntegerField(default=0)
+    eventfulness_sum = models.BigIntegerField(default=0)
+    eventfulness_sumsq = models.BigIntegerField(default=0)
+    pleasantness_sum = models.BigIntegerField(default=0)
+    pleasantness_sumsq = models.BigIntegerField(default=0)
+    chaotic_sum = models.BigIntegerField(default=0)
+    chaotic_sumsq = models.BigIntegerField(default=0)
+    vibrant_sum = models.BigIntegerField(default=0)
+    vibrant_sumsq = models.BigIntegerField(default=0)
+    uneventful_sum = models.BigIntegerField(default=0)
+    uneventful_sumsq = models.BigIntegerField(default=0)
+    calm_sum = models.BigIntegerField(default=0)
+    calm_sumsq = models.BigIntegerField(default=0)
+    monotonous_sum = models.BigIntegerField(default=0)
+    monotonous_sumsq = models.BigIntegerField(default=0)
+
+    traffic_noise_sum = models.BigIntegerField(default=0)
+    traffic_noise_sumsq = models.BigIntegerField(default=0)
+    other_noise_sum = models.BigIntegerField(default=0)
+    other_noise_sumsq = models.BigIntegerField(default=0)
+    human_sounds_sum = models.BigIntegerField(default=0)
+    human_sounds_sumsq = models.BigIntegerField(default=0)
+    natural_sounds_sum = models.BigIntegerField(default=0)
+    natural_sounds_sumsq = models.BigIntegerField(default=0)
+
+
+class ExportOutbox(models.Model):
+    """
+    One pending spreadsheet row, queued by the evaluation's post_save. It is
+    in the same transaction as the evaluation only when the save runs inside
+    one, as in the API views; a bare save in autocommit mode commits the two
+    separately. Drained in batches by `manage.py run_export_worker`.
+    """
+    evaluation = models.ForeignKey(AudioEvaluation, null=True, blank=True, on_delete=models.SET_NULL)
+    payload = models.JSONField()  # the row exactly as it will be appended
+    header = models.JSONField(null=True, blank=True)  # column names of payload when it was queued
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    leased_until = models.DateTimeField(null=True, blank=True)  # lease of the worker sending the row
+    delivered_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['delivered_at', 'next_attempt_at']),
+        ]
+
+
+class AudioUpload(models.Model):
+    """
+    A resumable chunked upload (see survey/uploads.py). Chunks are written
+    straight to `file_name` in the media storage; the Audio row is created
+    on finalize.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    title = models.CharField(max_length=100)
+    file_name = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    received = models.PositiveBigIntegerField(default=0)
+    writing_until = models.DateTimeField(null=True, blank=True)  # lease of the PUT writing at `received`
+
+    # From the WAV header, as soon as enough bytes have arrived
+    duration = models.FloatField(null=True, blank=True)
+    sample_rate = models.PositiveIntegerField(null=True, blank=True)
+    channels = models.PositiveSmallIntegerField(null=True, blank=True)
+
+    sha256 = models.CharField(max_length=64, blank=True)  # set on finalize
+    audio = models.OneToOneField(Audio, null=True, blank=True, on_delete=models.SET_NULL, related_name='upload')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
@@ -0,0 +1,167 @@
+"""
+Wide-format research export (one row per evaluation, one column per noise
+question) streamed straight from the database.
+
+Evaluations and noise responses are both read ordered by user with
+iterator(chunk_size), and the answers are merge-joined onto the evaluations
+one user at a time. The query count is fixed and memory stays flat however
+many participants there are. The columns match prepare_header_row().
+"""
+import csv
+
+from django.conf import settings
+
+from .models import AudioEvaluation, NoiseResponse
+from .export import get_question_numbers, prepare_header_row
+
+
+SLIDER_FIELDS = AudioEvaluation.RATING_FIELDS
+
+EVALUATION_COLUMNS = [
+    'user_id', 'user__user_id', 'audio__title', 'user__age', 'user__gender',
+    *SLIDER_FIELDS, 'submitted_at',
+]
+
+
+class ParquetUnavailable(Exception):
+    pass
+
+
+def iter_answers(chunk_size):
+    """
+    (user pk, {question number: rating}) for every user who answered, in user order.
+    The earliest answer to a question wins, as in get_ratings_by_user().
+    """
+    responses = (
+        NoiseResponse.objects
+        .order_by('user_id', 'pk')
+        .values_list('user_id', 'question__number', 'rating')
+        .iterator(chunk_size=chunk_size)
+    )
+    current, answers = None, {}
+    for user_id, number, rating in responses:
+        if user_id != current:
+            if current is not None:
+                yield current, answers
+            current, answers = user_id, {}
+        answers.setdefault(number, rating)
+    if current is not None:
+        yield current, answers
+
+
+def iter_records(chunk_size=None):
+    """
+    Yields (user_id, audio_title, age, gender, [answers...], [sliders...], submitted_at)
+    tuples with None for anything missing. Answers follow get_question_numbers().
+    """
+    chunk_size = chunk_size or settings.SURVEY_RESEARCH_EXPORT_CHUNK_SIZE
+    numbers = get_question_numbers()
+    evaluations = (
+        AudioEvaluation.objects
+        .order_by('user_id', 'pk')
+        .values_list(*EVALUATION_COLUMNS)
+        .iterator(chunk_size=chunk_size)
+    )
+    answers_by_user = iter_answers(chunk_size)
+    answered_user, answers = next(answers_by_user, (None, {}))
+
+    for row in evaluations:
+        user_pk = row[0]
+        while answered_user is not None and answered_user < user_pk:
+            answered_user, answers = next(answers_by_user, (None, {}))
+        user_answers = answers if answered_user == user_pk else {}
+        yield (
+            row[1], row[2], row[3], row[4],
+            [user_answers.get(number) for number in numbers],
+            list(row[5:5 + len(SLIDER_FIELDS)]),
+            row[-1],
+        )
+
+
+def iter_csv_rows(chunk_size=None):
+    """
+    The header row, then one list of strings per evaluation, formatted like prepare_data_row().
+    """
+    yield prepare_header_row()
+    for user_id, title, age, gender, answers, sliders, submitted_at in iter_records(chunk_size):
+        yield [
+            str(user_id),
+            str(title),
+            str(age) if age else "",
+            str(gender) if gender else "",
+            *(str(rating) if rating is not None else "NA" for rating in answers),
+            *(str(value) for value in sliders),
+            submitted_at.strftime("%Y-%m-%d %H:%M:%S") if submitted_at else "",
+        ]
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def iter_csv(chunk_size=None):
+    """
+    Encoded CSV lines, for a StreamingHttpResponse.
+    """
+    writer = csv.writer(_Echo())
+    for row in iter_csv_rows(chunk_size):
+        yield writer.writerow(row).encode('utf-8')
+
+
+def write_csv(f, chunk_size=None):
+    writer = csv.writer(f)
+    count = -1
+    for count, row in enumerate(iter_csv_rows(chunk_size)):
+        writer.writerow(row)
+    return count
+
+
+def write_parquet(path_or_file, chunk_size=None):
+    """
+    Writes the export as Parquet, one row group per chunk, with typed columns
+    (integers stay integers, missing answers are nulls). Needs pyarrow.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ParquetUnavailable("Parquet export needs pyarrow (pip install pyarrow)")
+
+    chunk_size = chunk_size or settings.SURVEY_RESEARCH_EXPORT_CHUNK_SIZE
+    header = prepare_header_row()
+    question_columns = header[4:-len(SLIDER_FIELDS) - 1]
+    slider_columns = header[-len(SLIDER_FIELDS) - 1:-1]
+    schema = pa.schema(
+        [('UserID', pa.string()), ('AudioTitle', pa.string()), ('Age', pa.int64()), ('Gender', pa.string())]
+        + [(name, pa.int64()) for name in question_columns]
+        + [(name, pa.int64()) for name in slider_columns]
+        + [('SubmittedAt', pa.timestamp('us', tz='UTC'))]
+    )
+
+    def flush(writer, batch):
+        columns = list(zip(*batch))
+        arrays = [
+            [str(value) for value in columns[0]],
+            list(columns[1]),
+            list(columns[2]),
+            list(columns[3]),
+        ]
+        arrays.extend(zip(*columns[4]) if question_columns else [])
+        arrays.extend(zip(*columns[5]))
+        arrays.append(list(columns[6]))
+        writer.write_batch(pa.record_batch([list(array) for array in arrays], schema=schema))
+
+    count = 0
+    with pq.ParquetWriter(path_or_file, schema) as writer:
+        batch = []
+        for record in iter_records(chunk_size):
+            batch.append(record)
+            if len(batch) >= chunk_size:
+                flush(writer, batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            flush(writer, batch)
+            count += len(batch)
+    return count
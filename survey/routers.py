@@ -0,0 +1,157 @@
+"""
+Routing between the primary database (`default`) and read replicas.
+
+Writes always go to the primary. Reads of the apps in SURVEY_REPLICA_APPS
+go to a replica only inside a read scope. The scope is opened by
+ReplicaRoutingMiddleware for GET/HEAD/OPTIONS requests, which covers the
+catalog, stats, exports, streams and admin browsing. replica_reads() opens
+it for code outside a request, e.g. the export command. Everything else
+reads from the primary: submissions, uploads (the resume offset is read
+under primary_reads()), the journal flusher, the export worker and the
+other management commands.
+
+Read-your-writes: the first write in a scope switches the rest of it back
+to the primary. A response to a POST/PUT/PATCH/DELETE sets a cookie that
+keeps the client on the primary for SURVEY_REPLICA_LAG seconds, so a
+redirect or a refresh after saving does not read a stale replica.
+
+With no replicas configured (SURVEY_READ_REPLICAS empty) every query uses
+the primary.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+
+STICKY_COOKIE = 'survey_primary'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Alias of the replica this context reads from, or None for the primary.
+_read_alias = ContextVar('survey_read_alias', default=None)
+
+
+def choose_replica():
+    replicas = settings.SURVEY_READ_REPLICAS
+    return random.choice(replicas) if replicas else None
+
+
+def current_read_alias():
+    return _read_alias.get()
+
+
+@contextmanager
+def replica_reads(alias=None):
+    """
+    Reads inside the block go to `alias`, or to a random replica.
+    """
+    token = _read_alias.set(alias or choose_replica())
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+@contextmanager
+def primary_reads():
+    token = _read_alias.set(None)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+def stream_reads(iterable):
+    """
+    Wraps a lazily evaluated response body so its queries keep reading
+    from this scope's database. A streamed body is consumed after the
+    middleware has closed the scope.
+    """
+    alias = current_read_alias()  # now, not on the first next()
+
+    def iterate():
+        iterator = iter(iterable)
+        while True:
+            token = _read_alias.set(alias)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                _read_alias.reset(token)
+            yield item
+
+    return iterate()
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        alias = _read_alias.get()
+        if alias and model._meta.app_label in settings.SURVEY_REPLICA_APPS:
+            return alias
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        # Read your own writes for the rest of the scope.
+        if _read_alias.get():
+            _read_alias.set(None)
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {'default', *settings.SURVEY_READ_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas receive the schema through replication.
+        if db in settings.SURVEY_READ_REPLICAS:
+            return False
+        return None
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Opens a replica read scope for safe requests from clients that have
+    not written recently, and marks clients that just wrote.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        token = _read_alias.set(self.read_alias(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            _read_alias.reset(token)
+        return self.mark_writer(request, response)
+
+    async def __acall__(self, request):
+        token = _read_alias.set(self.read_alias(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            _read_alias.reset(token)
+        return self.mark_writer(request, response)
+
+    def read_alias(self, request):
+        if request.method in SAFE_METHODS and STICKY_COOKIE not in request.COOKIES:
+            return choose_replica()
+        return None
+
+    def mark_writer(self, request, response):
+        if request.method not in SAFE_METHODS and settings.SURVEY_READ_REPLICAS:
+            response.set_cookie(
+                STICKY_COOKIE, '1', max_age=settings.SURVEY_REPLICA_LAG, httponly=True, samesite='Lax',
+            )
+        return response
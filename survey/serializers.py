@@ -1,5 +1,25 @@
 from rest_framework import serializers
-from .models import UserProfile, Audio, NoiseQuestion, NoiseResponse, AudioEvaluation
+from .models import UserProfile, Audio, NoiseQuestion, NoiseResponse, AudioEvaluation, AudioRatingAggregate
+from .stats import aggregate_summary
+from .audio import stream_path
+
+
+class BulkPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    Looks the object up in context["preloaded"][field_name] first, so a bulk
+    request resolves its foreign keys with one query per field instead of one per item.
+    """
+
+    def to_internal_value(self, data):
+        preloaded = self.context.get("preloaded", {}).get(self.field_name)
+        if preloaded:
+            try:
+                pk = self.get_queryset().model._meta.pk.to_python(data)
+            except Exception:
+                pk = None
+            if pk in preloaded:
+                return preloaded[pk]
+        return super().to_internal_value(data)
 
 
 class UserProfileSerializer(serializers.ModelSerializer):
@@ -11,6 +31,7 @@ class UserProfileSerializer(serializers.ModelSerializer):
 class AudioSerializer(serializers.ModelSerializer):
     file = serializers.SerializerMethodField()
     stream_url = serializers.SerializerMethodField()
+    peaks = serializers.SerializerMethodField()
     
     class Meta:
         model = Audio
@@ -27,11 +48,22 @@ class AudioSerializer(serializers.ModelSerializer):
         return obj.file.url
     
     def get_stream_url(self, obj):
+        # Versioned by content hash, so clients and CDNs may cache it forever
+        path = stream_path(obj)
+        request = self.context.get("request")
+        if request:
+            return request.build_absolute_uri(path)
+
+        return path
+
+    def get_peaks(self, obj):
+        if not obj.peaks:
+            return None
         request = self.context.get("request")
         if request:
-            return request.build_absolute_uri(f"/api/stream-audio/{obj.id}/")
+            return request.build_absolute_uri(f"/api/audios/{obj.id}/peaks/")
 
-        return f"/api/stream-audio/{obj.id}/"
+        return f"/api/audios/{obj.id}/peaks/"
 
 
 
@@ -42,12 +74,32 @@ class NoiseQuestionSerializer(serializers.ModelSerializer):
 
 
 class NoiseResponseSerializer(serializers.ModelSerializer):
+    serializer_related_field = BulkPrimaryKeyRelatedField
+
     class Meta:
         model = NoiseResponse
         fields = '__all__'
+        # Duplicates are upserted by the view, not rejected.
+        validators = []
 
 
 class AudioEvaluationSerializer(serializers.ModelSerializer):
+    serializer_related_field = BulkPrimaryKeyRelatedField
+
     class Meta:
         model = AudioEvaluation
-        fields = '__all__'
\ No newline at end of file
+        fields = '__all__'
+        # Duplicates are upserted by the view, not rejected.
+        validators = []
+
+
+class AudioRatingStatsSerializer(serializers.ModelSerializer):
+    title = serializers.CharField(source='audio.title')
+    ratings = serializers.SerializerMethodField()
+
+    class Meta:
+        model = AudioRatingAggregate
+        fields = ['audio', 'title', 'count', 'ratings']
+
+    def get_ratings(self, obj):
+        return aggregate_summary(obj)
\ No newline at end of file
@@ -0,0 +1,122 @@
+"""
+Reconciles the Google Sheet with the database.
+
+The sheet is read once (one get_all_values call) to collect the keys of
+the rows it already has: UserID, AudioTitle and SubmittedAt. Every
+evaluation whose key is missing is streamed from the research export and
+appended with append_rows, batch_size rows per call. Rows that failed to
+upload, or were lost before the outbox existed, are therefore resent. The
+rows are not duplicated. Outbox entries whose rows are now in the sheet
+are marked delivered.
+
+Before reading the export, the sync claims the undelivered outbox entries
+the way the export worker does (claim_outbox), so no worker sends them
+meanwhile. Rows held under a worker's lease are left to that worker: they
+are neither appended nor marked delivered here.
+"""
+from django.conf import settings
+from django.utils import timezone
+
+from .models import ExportOutbox
+from .export import ExportError, GoogleSheetsSink, claim_outbox
+from .research_export import iter_csv_rows
+
+
+KEY_COLUMNS = ("UserID", "AudioTitle", "SubmittedAt")
+# Positions of those columns in prepare_data_row() rows, whatever the questions.
+ROW_KEY_COLUMNS = (0, 1, -1)
+
+
+def row_key(row, columns):
+    return tuple(str(row[index]).strip() if -len(row) <= index < len(row) else "" for index in columns)
+
+
+def sheet_keys(values):
+    """
+    Keys of the data rows of a worksheet's get_all_values() result.
+    """
+    if len(values) < 2:
+        return set()
+    header = values[0]
+    missing = [name for name in KEY_COLUMNS if name not in header]
+    if missing:
+        raise ExportError(f"Sheet header is missing columns: {', '.join(missing)}")
+    columns = [header.index(name) for name in KEY_COLUMNS]
+    return {row_key(row, columns) for row in values[1:] if any(row)}
+
+
+def sync_sheet(sink=None, batch_size=None, chunk_size=None, dry_run=False):
+    """
+    Appends every evaluation missing from the sheet, except rows a worker
+    is sending. Returns counts of the
+    rows found in the sheet, the rows appended (or that would be, with
+    dry_run) and the outbox entries marked delivered.
+    """
+    sink = sink or GoogleSheetsSink()
+    batch_size = batch_size or settings.SURVEY_SHEETS_SYNC_BATCH_SIZE
+    sheet = sink.get_sheet()
+
+    values = sheet.get_all_values()
+    keys = sheet_keys(values)
+    found = len(keys)
+
+    now = timezone.now()
+    claimed = [] if dry_run else claim_outbox(None, now, due_only=False)
+    held = leased_keys(now, exclude={entry.pk for entry in claimed})
+
+    appended = 0
+    try:
+        rows = iter_csv_rows(chunk_size)
+        header = next(rows)
+        if not dry_run:
+            sink.ensure_header(header, values[0] if values else [])
+
+        seen = keys | held
+        batch = []
+        for row in rows:
+            key = row_key(row, ROW_KEY_COLUMNS)
+            if key in seen:
+                continue
+            seen.add(key)
+            batch.append(row)
+            if len(batch) >= batch_size:
+                appended += write_batch(sink, sheet, header, batch, keys, dry_run)
+                batch = []
+        if batch:
+            appended += write_batch(sink, sheet, header, batch, keys, dry_run)
+    finally:
+        delivered = mark_delivered(claimed, keys)
+    return {'found': found, 'appended': appended, 'delivered': delivered}
+
+
+def leased_keys(now, exclude=()):
+    """
+    Keys of the undelivered outbox rows a worker holds a lease on.
+    """
+    leased = ExportOutbox.objects.filter(delivered_at__isnull=True, leased_until__gt=now).values_list('id', 'payload')
+    return {row_key(payload, ROW_KEY_COLUMNS) for pk, payload in leased if pk not in exclude}
+
+
+def write_batch(sink, sheet, header, batch, keys, dry_run):
+    if not dry_run:
+        sheet.append_rows(sink.arrange(header, batch))
+    keys.update(row_key(row, ROW_KEY_COLUMNS) for row in batch)
+    return len(batch)
+
+
+def mark_delivered(claimed, keys):
+    """
+    Marks the claimed outbox entries whose rows are in the sheet as
+    delivered, so the worker does not append them a second time, and hands
+    the others back to the worker on their old schedule.
+    """
+    synced = [entry for entry in claimed if row_key(entry.payload, ROW_KEY_COLUMNS) in keys]
+    released = [entry for entry in claimed if row_key(entry.payload, ROW_KEY_COLUMNS) not in keys]
+    if synced:
+        ExportOutbox.objects.filter(pk__in=[entry.pk for entry in synced]).update(
+            delivered_at=timezone.now(), leased_until=None, last_error='',
+        )
+    for entry in released:
+        entry.leased_until = None  # next_attempt_at is still the value from before the claim
+    ExportOutbox.objects.bulk_update(released, ['next_attempt_at', 'leased_until'])
+    return len(synced)
@@ -1,159 +1,131 @@
-import os
-import json
-import threading
-import base64
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-from django.db.models.signals import post_save
+import logging
+
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.db import transaction
 from django.dispatch import receiver
-from django.conf import settings
-from dotenv import load_dotenv
 
+from .models import Audio, AudioEvaluation, NoiseQuestion
+from .audio import needs_ingest, ingest_audio
+from .streaming import file_info_cache, mmap_cache
+from .variants import build_variants
+from .catalog import invalidate_catalog
+from .stats import apply_evaluations
+from .soundscape import fill_iso_coordinates
+from .export import enqueue_evaluation, invalidate_question_cache
+
+logger = logging.getLogger(__name__)
+
+@receiver(post_save, sender=AudioEvaluation)
+def export_survey_data(sender, instance, created, raw=False, **kwargs):
+    """
+    Triggered immediately after data is saved to the DB.
+    Only queues the row; `manage.py run_export_worker` sends it to the sheet.
+    Fixture loads (raw saves) are not exported.
+    """
+    if created and not raw:
+        enqueue_evaluation(instance)
 
-load_dotenv()
 
-from .models import AudioEvaluation, NoiseQuestion, NoiseResponse
+@receiver(post_save, sender=NoiseQuestion)
+@receiver(post_delete, sender=NoiseQuestion)
+def noise_questions_changed(sender, **kwargs):
+    invalidate_question_cache()
 
 
-def _upload_worker(row_data, header_row):
+@receiver(post_save, sender=Audio)
+def ingest_audio_file(sender, instance, raw=False, **kwargs):
     """
-    Runs in a background thread.
-    Checks if headers exist. If not, adds them. Then adds data.
+    Parses the WAV header and builds the peaks sidecar and the variants when a
+    clip is added or replaced. Fixture loads (raw) are left to
+    `manage.py ingest_audio` and `manage.py build_audio_variants`. A save
+    flagged with `_ingest_on_commit` (finalize_upload) has this done once its
+    transaction commits, so no row lock is held while the variants render.
     """
-    try:
-        b64_creds = os.getenv('GOOGLE_CREDENTIALS_JSON')
-        sheet_id = os.getenv('GOOGLE_SHEET_ID')
+    if raw or not needs_ingest(instance):
+        return
+    if getattr(instance, '_ingest_on_commit', False):
+        transaction.on_commit(lambda: process_audio_file(instance, deferred=True))
+    else:
+        process_audio_file(instance)
 
-        if not b64_creds or not sheet_id:
-            print("❌ Export Error: Missing Render Environment Variables.")
-            return
 
-       
-        # Decode Base64 to get the JSON string
-        try:
-            json_str = base64.b64decode(b64_creds).decode("utf-8")
-            creds_dict = json.loads(json_str)
-        except Exception as e:
-            print(f"❌ Credential Decoding Error: {e}")
-            return
-
-        scope = [
-            "https://spreadsheets.google.com/feeds",
-            "https://www.googleapis.com/auth/drive"
-        ]
-        creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-        client = gspread.authorize(creds)
+def process_audio_file(audio, deferred=False):
+    try:
+        ingest_audio(audio, sha256=getattr(audio, '_known_sha256', None))
+    except (OSError, EOFError, ValueError) as e:
+        logger.warning("Audio ingest failed for %s: %s", audio.file.name, e)
+        return
+    if deferred:
+        invalidate_catalog()  # the catalog was invalidated by the save, before the metadata existed
+    try:
+        build_variants(audio)
+    except (OSError, EOFError, ValueError) as e:
+        logger.warning("Audio variants failed for %s: %s", audio.file.name, e)
 
-        
-        sheet = client.open_by_key(sheet_id).sheet1
 
+def _forget_audio_file(name):
+    if not name:
+        return
+    path = Audio._meta.get_field('file').storage.path(name)
+    file_info_cache.invalidate(path)
+    mmap_cache.invalidate(path)
 
-        try:
-            first_cell = sheet.acell('A1').value
-            if not first_cell:
-                print("📝 Sheet is empty. Adding headers...")
-                sheet.append_row(header_row)
-        except Exception:
 
-            pass
+@receiver(pre_save, sender=Audio)
+def audio_file_replaced(sender, instance, raw=False, **kwargs):
+    """
+    Drops the cached map of the previous file when an Audio gets a new one.
+    """
+    if raw or instance.pk is None:
+        return
+    old_name = Audio.objects.filter(pk=instance.pk).values_list('file', flat=True).first()
+    if old_name != instance.file.name:
+        _forget_audio_file(old_name)
 
 
-        sheet.append_row(row_data)
-        
-        print(f"✅ Successfully saved row for User ID: {row_data[0]}")
+@receiver(post_delete, sender=Audio)
+def audio_deleted(sender, instance, **kwargs):
+    _forget_audio_file(instance.file.name)
 
-    except Exception as e:
-        print(f"❌ Google Sheets API Error: {e}")
 
+# Registered after ingest_audio_file so the new metadata is in place first.
+@receiver(post_save, sender=Audio)
+@receiver(post_delete, sender=Audio)
+@receiver(post_save, sender=NoiseQuestion)
+@receiver(post_delete, sender=NoiseQuestion)
+def catalog_changed(sender, **kwargs):
+    invalidate_catalog()
 
 
-def prepare_header_row():
-    """
-    Generates the list of column names (The first row of the Excel file).
-    """
-    headers = ["UserID", "AudioTitle", "Age", "Gender"]
-    
-
-    questions = NoiseQuestion.objects.all().order_by("number")
-    for q in questions:
-        headers.append(f"Q{q.number}")
-
-    
-    headers.extend([
-        "Annoyance",
-        "Eventfulness",
-        "Pleasantness",
-        "Chaotic",
-        "Vibrant",
-        "Uneventful",
-        "Calm",
-        "Monotonous",
-        "TrafficNoise",
-        "OtherNoise",
-        "HumanSounds",
-        "NaturalSounds",
-        "SubmittedAt"
-    ])
-    return headers
-
-def prepare_data_row(instance):
-    """
-    Extracts data from the instance to match the header row.
-    """
-    user = instance.user
-    
-    row = [
-        str(user.user_id),
-        str(instance.audio.title),
-        str(user.age) if user.age else "",
-        str(user.gender) if user.gender else "",
-    ]
-
-    questions = NoiseQuestion.objects.all().order_by("number")
-    for q in questions:
-        response = NoiseResponse.objects.filter(user=user, question=q).first()
-        row.append(str(response.rating) if response else "NA")
-
-    submitted_str = instance.submitted_at.strftime("%Y-%m-%d %H:%M:%S") if instance.submitted_at else ""
-
-    row.extend([
-        str(instance.annoyance ),
-        str(instance.eventfulness ),
-        str(instance.pleasantness ),
-        str(instance.chaotic ),
-        str(instance.vibrant ),
-        str(instance.uneventful ),
-        str(instance.calm ),
-        str(instance.monotonous ),
-        str(instance.traffic_noise ),
-        str(instance.other_noise ),
-        str(instance.human_sounds ),
-        str(instance.natural_sounds ),
-        submitted_str
-    ])
-
-    return row
+@receiver(pre_save, sender=AudioEvaluation)
+def remember_previous_ratings(sender, instance, raw=False, **kwargs):
+    # Edits (e.g. in the admin) must take the old values out of the aggregates.
+    instance._previous_ratings = None
+    if raw or instance._state.adding or instance.pk is None:
+        return
+    previous = AudioEvaluation.objects.filter(pk=instance.pk).values('audio_id', *AudioEvaluation.RATING_FIELDS).first()
+    instance._previous_ratings = previous
 
 
+@receiver(pre_save, sender=AudioEvaluation)
+def set_iso_coordinates(sender, instance, raw=False, **kwargs):
+    if not raw:
+        fill_iso_coordinates([instance])
 
 
 @receiver(post_save, sender=AudioEvaluation)
-def export_survey_data(sender, instance, created, **kwargs):
-    """
-    Triggered immediately after data is saved to the DB.
-    """
-    if created:
-        try:
-            # 1. Prepare Data & Headers (Run in main thread to access DB safely)
-            data_row = prepare_data_row(instance)
-            header_row = prepare_header_row()
-
-            # 2. Send to Google Sheets (Background Thread)
-            thread = threading.Thread(
-                target=_upload_worker, 
-                args=(data_row, header_row)
-            )
-            thread.start()
-
-        except Exception as e:
-            print(f"❌ Signal logic failed: {e}")
\ No newline at end of file
+def update_rating_aggregates(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_previous_ratings', None)
+    if not previous:
+        apply_evaluations([instance])
+        return
+    with transaction.atomic():
+        apply_evaluations([previous], sign=-1)
+        apply_evaluations([instance])
+
+
+@receiver(post_delete, sender=AudioEvaluation)
+def remove_from_rating_aggregates(sender, instance, **kwargs):
+    apply_evaluations([instance], sign=-1)
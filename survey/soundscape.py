@@ -0,0 +1,137 @@
+"""
+ISO 12913-3 soundscape coordinates (ISOPleasant, ISOEventful) of evaluations.
+
+The eight perceived affective quality (PAQ) sliders are projected onto the
+pleasant / eventful circumplex:
+
+    P = (pa - an) + cos45 * (ca - ch) + cos45 * (vi - mo)
+    E = (ev - un) + cos45 * (ch - ca) + cos45 * (vi - mo)
+
+both divided by (1 + sqrt 2) * SURVEY_PAQ_SCALE_RANGE, so they lie in -1..1.
+Everything here works on whole arrays, never on one evaluation at a time.
+"""
+import numpy as np
+from django.conf import settings
+from django.db.models import Count, F, Sum
+
+from .models import AudioEvaluation
+
+
+# Column order of the PAQ matrices below
+PAQ_FIELDS = [
+    'pleasantness', 'vibrant', 'eventfulness', 'chaotic',
+    'annoyance', 'monotonous', 'uneventful', 'calm',
+]
+
+COS45 = np.cos(np.pi / 4)
+
+# Rows: ISOPleasant, ISOEventful; columns: PAQ_FIELDS
+PROJECTION = np.array([
+    [1, COS45, 0, -COS45, -1, -COS45, 0, COS45],
+    [0, COS45, 1, COS45, 0, -COS45, -1, -COS45],
+])
+
+
+def iso_coordinates(paq, scale_range=None):
+    """
+    (n, 2) float array of (ISOPleasant, ISOEventful) for an (n, 8) array of
+    PAQ ratings in PAQ_FIELDS order.
+    """
+    scale_range = scale_range or settings.SURVEY_PAQ_SCALE_RANGE
+    paq = np.asarray(paq, dtype=np.float64).reshape(-1, len(PAQ_FIELDS))
+    return paq @ PROJECTION.T / ((1 + np.sqrt(2)) * scale_range)
+
+
+def paq_matrix(evaluations):
+    return np.array(
+        [[getattr(evaluation, field) or 0 for field in PAQ_FIELDS] for evaluation in evaluations],
+        dtype=np.float64,
+    ).reshape(-1, len(PAQ_FIELDS))
+
+
+def fill_iso_coordinates(evaluations):
+    """
+    Sets iso_pleasant / iso_eventful on unsaved AudioEvaluation instances.
+    """
+    evaluations = list(evaluations)
+    if not evaluations:
+        return evaluations
+    coordinates = iso_coordinates(paq_matrix(evaluations))
+    for evaluation, (pleasant, eventful) in zip(evaluations, coordinates.tolist()):
+        evaluation.iso_pleasant = pleasant
+        evaluation.iso_eventful = eventful
+    return evaluations
+
+
+def backfill_iso_coordinates(queryset=None, chunk_size=2000):
+    """
+    Computes the coordinates for every evaluation in `queryset` (default: the
+    ones still missing them), one chunk per bulk_update. Returns the count.
+    """
+    if queryset is None:
+        queryset = AudioEvaluation.objects.filter(iso_pleasant__isnull=True)
+    queryset = queryset.order_by('pk')
+    updated = 0
+    last_pk = 0
+    while True:
+        rows = list(queryset.filter(pk__gt=last_pk).values_list('pk', *PAQ_FIELDS)[:chunk_size])
+        if not rows:
+            return updated
+        data = np.array(rows, dtype=np.float64)
+        coordinates = iso_coordinates(data[:, 1:])
+        AudioEvaluation.objects.bulk_update(
+            [
+                AudioEvaluation(pk=pk, iso_pleasant=pleasant, iso_eventful=eventful)
+                for pk, (pleasant, eventful) in zip(data[:, 0].astype(int).tolist(), coordinates.tolist())
+            ],
+            ['iso_pleasant', 'iso_eventful'],
+        )
+        updated += len(rows)
+        last_pk = rows[-1][0]
+
+
+def soundscape_distribution(queryset, bins=None):
+    """
+    Mean, spread and a normalized 2D density grid over -1..1 x -1..1 of the
+    (ISOPleasant, ISOEventful) points in `queryset`. The moments are summed
+    in SQL; only the histogram streams the points, straight into an array.
+    """
+    bins = bins or settings.SURVEY_SOUNDSCAPE_GRID_BINS
+    queryset = queryset.filter(iso_pleasant__isnull=False)
+    edges = np.linspace(-1.0, 1.0, bins + 1)
+    sums = queryset.aggregate(
+        n=Count('pk'),
+        p=Sum('iso_pleasant'),
+        e=Sum('iso_eventful'),
+        pp=Sum(F('iso_pleasant') * F('iso_pleasant')),
+        ee=Sum(F('iso_eventful') * F('iso_eventful')),
+        pe=Sum(F('iso_pleasant') * F('iso_eventful')),
+    )
+    count = sums['n']
+    if not count:
+        return {'count': 0, 'mean': None, 'sd': None, 'covariance': None,
+                'edges': edges.tolist(), 'density': None}
+
+    mean = np.array([sums['p'], sums['e']]) / count
+    if count > 1:
+        products = np.array([[sums['pp'], sums['pe']], [sums['pe'], sums['ee']]])
+        covariance = (products - count * np.outer(mean, mean)) / (count - 1)
+        covariance[np.diag_indices(2)] = np.maximum(covariance.diagonal(), 0)  # rounding
+    else:
+        covariance = np.zeros((2, 2))
+    sd = np.sqrt(covariance.diagonal())
+
+    points = np.fromiter(
+        queryset.values_list('iso_pleasant', 'iso_eventful').iterator(chunk_size=2000),
+        dtype=np.dtype((np.float64, 2)),
+    )
+    density, _, _ = np.histogram2d(points[:, 0], points[:, 1], bins=[edges, edges])
+    return {
+        'count': count,
+        'mean': {'pleasant': mean[0].item(), 'eventful': mean[1].item()},
+        'sd': {'pleasant': sd[0].item(), 'eventful': sd[1].item()},
+        'covariance': covariance.tolist(),
+        'edges': edges.tolist(),
+        # density[i][j]: share of points with pleasant in bin i and eventful in bin j
+        'density': (density / max(len(points), 1)).tolist(),
+    }
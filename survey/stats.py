@@ -0,0 +1,99 @@
+"""
+Per-audio rating statistics maintained incrementally in AudioRatingAggregate.
+
+Ratings are integers, so count / sum / sum of squares are kept exactly in
+BIGINT columns. Unlike a Welford running mean this is exact, mergeable and
+can be decremented when an evaluation is deleted, and the variance is
+computed with integer arithmetic so there is no cancellation error.
+"""
+import math
+from collections import defaultdict
+from statistics import NormalDist
+
+from django.conf import settings
+from django.db.models import Count, F, Sum
+
+from .models import AudioEvaluation, AudioRatingAggregate
+
+RATING_FIELDS = AudioEvaluation.RATING_FIELDS
+
+
+def rating_values(evaluation):
+    return {field: getattr(evaluation, field) or 0 for field in RATING_FIELDS}
+
+
+def apply_evaluations(evaluations, sign=1):
+    """
+    Adds (sign=1) or removes (sign=-1) evaluations from the aggregates with one
+    UPDATE per audio. `evaluations` may be model instances or dicts holding
+    audio_id and the rating fields. Runs in the caller's transaction.
+    """
+    deltas = defaultdict(lambda: defaultdict(int))
+    for evaluation in evaluations:
+        if isinstance(evaluation, dict):
+            audio_id, values = evaluation['audio_id'], evaluation
+        else:
+            audio_id, values = evaluation.audio_id, rating_values(evaluation)
+        delta = deltas[audio_id]
+        delta['count'] += sign
+        for field in RATING_FIELDS:
+            value = values[field] or 0
+            delta[f'{field}_sum'] += sign * value
+            delta[f'{field}_sumsq'] += sign * value * value
+
+    for audio_id, delta in deltas.items():
+        updates = {name: F(name) + value for name, value in delta.items()}
+        rows = AudioRatingAggregate.objects.filter(audio_id=audio_id).update(**updates)
+        if rows or sign < 0:
+            # Never create rows on removal: the audio itself may be mid-delete.
+            continue
+        AudioRatingAggregate.objects.bulk_create(
+            [AudioRatingAggregate(audio_id=audio_id)], ignore_conflicts=True
+        )
+        AudioRatingAggregate.objects.filter(audio_id=audio_id).update(**updates)
+
+
+def rebuild_aggregates():
+    """
+    Recomputes every aggregate from AudioEvaluation with one grouped query.
+    """
+    annotations = {'count': Count('id')}
+    for field in RATING_FIELDS:
+        annotations[f'{field}_sum'] = Sum(field)
+        annotations[f'{field}_sumsq'] = Sum(F(field) * F(field))
+    rows = AudioEvaluation.objects.values('audio_id').annotate(**annotations).order_by()
+
+    AudioRatingAggregate.objects.all().delete()
+    return AudioRatingAggregate.objects.bulk_create([
+        AudioRatingAggregate(**{name: value or 0 for name, value in row.items()})
+        for row in rows
+    ])
+
+
+def summarize(count, total, total_sq, confidence=None):
+    """
+    Mean, sample standard deviation and a normal-approximation confidence
+    interval for the mean.
+    """
+    if not count:
+        return {'mean': None, 'sd': None, 'ci': None}
+    confidence = confidence or settings.SURVEY_STATS_CONFIDENCE
+    mean = total / count
+    if count < 2:
+        return {'mean': mean, 'sd': None, 'ci': None}
+    variance = (count * total_sq - total * total) / (count * (count - 1))
+    sd = math.sqrt(max(variance, 0))
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    half_width = z * sd / math.sqrt(count)
+    return {'mean': mean, 'sd': sd, 'ci': [mean - half_width, mean + half_width]}
+
+
+def aggregate_summary(aggregate):
+    return {
+        field: summarize(
+            aggregate.count,
+            getattr(aggregate, f'{field}_sum'),
+            getattr(aggregate, f'{field}_sumsq'),
+        )
+        for field in RATING_FIELDS
+    }
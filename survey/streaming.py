@@ -0,0 +1,324 @@
+"""
+HTTP helpers for serving audio files: cached file metadata, validators
+(ETag / Last-Modified), If-Range and byte-range parsing, the memory-mapped
+hot-clip cache, and body iterators.
+"""
+import os
+import mmap
+import asyncio
+import time
+import uuid
+import mimetypes
+import threading
+from collections import namedtuple, OrderedDict
+
+from django.conf import settings
+from django.utils.http import http_date, parse_http_date_safe
+
+
+FileInfo = namedtuple('FileInfo', ['size', 'mtime', 'mtime_ns', 'etag', 'last_modified', 'content_type'])
+
+
+def guess_content_type(path):
+    content_type, _ = mimetypes.guess_type(path)
+    if not content_type:
+        content_type = 'audio/wav' if path.endswith('.wav') else 'audio/mpeg'
+    return content_type
+
+
+class FileInfoCache:
+    """
+    Per-process cache of size, validators and content type for each path.
+    An entry is trusted for SURVEY_AUDIO_STAT_TTL seconds without touching the
+    filesystem, then re-checked with one stat() and rebuilt if the mtime or
+    size changed.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        now = time.monotonic()
+        entry = self._entries.get(path)
+        if entry is not None and now - entry[1] < settings.SURVEY_AUDIO_STAT_TTL:
+            return entry[0]
+
+        st = os.stat(path)
+        info = entry[0] if entry is not None else None
+        if info is None or info.mtime_ns != st.st_mtime_ns or info.size != st.st_size:
+            info = FileInfo(
+                size=st.st_size,
+                mtime=int(st.st_mtime),
+                mtime_ns=st.st_mtime_ns,
+                etag=f'"{st.st_size:x}-{st.st_mtime_ns:x}"',
+                last_modified=http_date(st.st_mtime),
+                content_type=guess_content_type(path),
+            )
+        with self._lock:
+            self._entries[path] = (info, now)
+        return info
+
+    def invalidate(self, path):
+        with self._lock:
+            self._entries.pop(path, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+file_info_cache = FileInfoCache()
+
+
+class MmapCache:
+    """
+    Size-bounded LRU of read-only memory maps, one per clip and process.
+
+    Range requests are served as memoryview slices of the map, so there is no
+    open/seek/read per request and the pages themselves live in the kernel
+    page cache shared by every gunicorn worker. WSGI servers only accept
+    bytes, so each chunk is still copied once at that boundary.
+
+    An entry is dropped when the file's size or mtime no longer match, when
+    the Audio row pointing at it is saved or deleted, or when evicted.
+    """
+
+    def __init__(self):
+        self._maps = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, path, info):
+        """
+        memoryview over the whole file, or None if the cache is disabled or
+        the file does not fit.
+        """
+        limit = settings.SURVEY_AUDIO_MMAP_CACHE_BYTES
+        if not limit:
+            return None
+        with self._lock:
+            entry = self._maps.get(path)
+            if entry is not None and entry[0] == (info.size, info.mtime_ns):
+                self._maps.move_to_end(path)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                self._drop(path)
+            self.misses += 1
+
+        if not info.size or info.size > limit:
+            return None
+        with open(path, 'rb') as f:
+            view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        if len(view) != info.size:
+            return None  # changed under us; the next request re-checks
+
+        with self._lock:
+            if path in self._maps:
+                self._drop(path)
+            self._maps[path] = ((info.size, info.mtime_ns), view)
+            self._bytes += info.size
+            while self._bytes > limit and len(self._maps) > 1:
+                self._drop(next(iter(self._maps)))
+                self.evictions += 1
+        return view
+
+    def _drop(self, path):
+        # The map itself is closed once the last response slicing it is done.
+        _, view = self._maps.pop(path)
+        self._bytes -= len(view)
+
+    def invalidate(self, path):
+        with self._lock:
+            if path in self._maps:
+                self._drop(path)
+
+    def clear(self):
+        with self._lock:
+            self._maps.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._maps),
+                'bytes': self._bytes,
+                'max_bytes': settings.SURVEY_AUDIO_MMAP_CACHE_BYTES,
+            }
+
+
+mmap_cache = MmapCache()
+
+
+def if_range_matches(request, info):
+    """
+    False when an If-Range precondition fails, meaning the Range header must be
+    ignored and the whole file sent. If-Range needs a strong validator.
+    """
+    value = request.META.get('HTTP_IF_RANGE', '').strip()
+    if not value:
+        return True
+    if value.startswith('W/'):
+        return False
+    if value.startswith('"'):
+        return value == info.etag
+    date = parse_http_date_safe(value)
+    return date is not None and date == info.mtime
+
+
+def parse_range_header(header, size):
+    """
+    Parses a Range header against a file of `size` bytes.
+
+    Returns None when the header is malformed or not in bytes (serve the whole
+    file), [] when no range is satisfiable (416), otherwise a sorted list of
+    inclusive (start, end) pairs with overlapping or adjacent ranges merged.
+    """
+    units, sep, spec = header.partition('=')
+    if not sep or units.strip().lower() != 'bytes':
+        return None
+
+    ranges = []
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        first, sep, last = part.partition('-')
+        first, last = first.strip(), last.strip()
+        if not sep:
+            return None
+        if not first:
+            # Suffix range: the last N bytes.
+            if not last.isdigit():
+                return None
+            suffix = int(last)
+            if suffix and size:
+                ranges.append((max(size - suffix, 0), size - 1))
+            continue
+        if not first.isdigit() or (last and not last.isdigit()):
+            return None
+        start = int(first)
+        if last and int(last) < start:
+            return None
+        end = int(last) if last else size - 1
+        if start < size:
+            ranges.append((start, min(end, size - 1)))
+
+    ranges.sort()
+    merged = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    if len(merged) > settings.SURVEY_AUDIO_MAX_RANGES:
+        return None
+    return merged
+
+
+def iter_file_range(path, start, length, chunk_size=8192):
+    """
+    Yields `length` bytes of `path` starting at `start`.
+    """
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def iter_view_range(view, start, length, chunk_size=65536):
+    """
+    Yields memoryview slices covering `length` bytes of `view` from `start`.
+    """
+    end = start + length
+    for offset in range(start, end, chunk_size):
+        yield view[offset:min(offset + chunk_size, end)]
+
+
+def iter_range(path, view, start, length):
+    if view is not None:
+        return iter_view_range(view, start, length)
+    return iter_file_range(path, start, length)
+
+
+async def aiter_file_range(path, start, length, chunk_size=65536):
+    """
+    Async version of iter_file_range; each blocking read runs in a worker
+    thread so the event loop keeps serving other downloads.
+    """
+    f = await asyncio.to_thread(open, path, 'rb')
+    try:
+        await asyncio.to_thread(f.seek, start)
+        remaining = length
+        while remaining > 0:
+            chunk = await asyncio.to_thread(f.read, min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+async def aiter_view_range(view, start, length, chunk_size=65536):
+    for chunk in iter_view_range(view, start, length, chunk_size):
+        yield chunk
+
+
+def aiter_range(path, view, start, length):
+    if view is not None:
+        return aiter_view_range(view, start, length)
+    return aiter_file_range(path, start, length)
+
+
+class MultipartByteranges:
+    """
+    multipart/byteranges body for several ranges of one file, with its exact
+    Content-Length computed up front.
+    """
+
+    def __init__(self, path, ranges, size, content_type, view=None):
+        self.path = path
+        self.view = view
+        self.ranges = ranges
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f'multipart/byteranges; boundary={self.boundary}'
+        self.parts = [
+            (
+                (
+                    f'\r\n--{self.boundary}\r\n'
+                    f'Content-Type: {content_type}\r\n'
+                    f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n'
+                ).encode('ascii'),
+                start,
+                end - start + 1,
+            )
+            for start, end in ranges
+        ]
+        self.closing = f'\r\n--{self.boundary}--\r\n'.encode('ascii')
+        self.length = sum(len(head) + length for head, _, length in self.parts) + len(self.closing)
+
+    def __iter__(self):
+        for head, start, length in self.parts:
+            yield head
+            yield from iter_range(self.path, self.view, start, length)
+        yield self.closing
+
+    async def aiter(self):
+        for head, start, length in self.parts:
+            yield head
+            async for chunk in aiter_range(self.path, self.view, start, length):
+                yield chunk
+        yield self.closing
@@ -0,0 +1,18 @@
+"""
+Test runner for `manage.py test` (TEST_RUNNER).
+
+Without SURVEY_REPLICA_DATABASE_URLS there is no `replica` database. The
+replica routing tests need one on its own connection, so the runner adds
+it as a mirror of the test database; a configured replica is mirrored the
+same way by its settings.
+"""
+from django.db import connections
+from django.test.runner import DiscoverRunner
+
+
+class ReplicaMirrorRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        if 'replica' not in connections.settings:
+            default = connections.settings['default']
+            connections.settings['replica'] = {**default, 'TEST': {**default['TEST'], 'MIRROR': 'default'}}
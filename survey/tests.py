@@ -1,3 +1,1849 @@
-from django.test import TestCase
+import io
+import os
+import csv
+import base64
+import hashlib
+import json
+import logging
+import wave
+import struct
+import sys
+import shutil
+import tempfile
+import unittest
+import subprocess
+from unittest import mock
+import importlib.util
+from datetime import timedelta
 
-# Create your tests here.
+import numpy as np
+from django.contrib.auth.models import User
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import call_command
+from django.http import FileResponse
+from django.test import TestCase, TransactionTestCase, AsyncClient, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection, connections, router, OperationalError
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .models import (
+    UserProfile, Audio, NoiseQuestion, NoiseResponse, AudioEvaluation, ExportOutbox, AudioRatingAggregate, AudioUpload,
+)
+from .audio import parse_wav_header, read_wav_info, load_samples, compute_peaks, stream_path
+from .variants import resample, variant_name
+from .catalog import catalog_version_path, invalidate_catalog
+from .streaming import file_info_cache, mmap_cache, parse_range_header
+from . import export
+from .export import CSVFileSink, GoogleSheetsSink, ExportError, claim_outbox, drain_outbox, send_rows, prepare_header_row, prepare_data_row
+from .research_export import iter_csv_rows, write_parquet
+from .stats import rebuild_aggregates, summarize
+from .metrics import registry, Histogram
+from .log import BackgroundHandler, JsonFormatter, RedactFilter, SamplingFilter, REDACTED
+from .soundscape import PAQ_FIELDS, iso_coordinates, backfill_iso_coordinates
+from .bulk_import import SurveyImporter, iter_json_objects
+from .sheet_sync import sync_sheet
+from .uploads import digest_cache, start_upload, write_chunk
+from .journal import flush_journal, get_journal, write_entries
+from .routers import STICKY_COOKIE, replica_reads, primary_reads
+
+
+class FailingSink:
+    def write_rows(self, header_row, rows):
+        raise RuntimeError("quota exceeded")
+
+
+class FakeWorksheet:
+    """
+    In-memory stand-in for a gspread Worksheet; records every API call.
+    """
+
+    def __init__(self, rows=None):
+        self.rows = [list(row) for row in rows or []]
+        self.calls = []
+
+    def row_values(self, row):
+        self.calls.append("row_values")
+        return list(self.rows[row - 1]) if len(self.rows) >= row else []
+
+    def get_all_values(self):
+        self.calls.append("get_all_values")
+        return [list(row) for row in self.rows]
+
+    def batch_update(self, data):
+        self.calls.append("batch_update")
+        for update in data:
+            assert update["range"] == "A1", update
+            if self.rows:
+                self.rows[0] = list(update["values"][0])
+            else:
+                self.rows.append(list(update["values"][0]))
+
+    def append_rows(self, rows):
+        self.calls.append("append_rows")
+        self.rows.extend(list(row) for row in rows)
+
+
+def write_wav(path, frames=4410, rate=44100, channels=2):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with wave.open(path, "wb") as f:
+        f.setnchannels(channels)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(bytes(range(256)) * (frames * channels * 2 // 256) + b"\0" * (frames * channels * 2 % 256))
+    return path
+
+
+class MediaRootMixin:
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media_settings = override_settings(MEDIA_ROOT=self.media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+
+class SurveyFixtureMixin(MediaRootMixin):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.client = APIClient()
+        self.user = UserProfile.objects.create(user_id="22", age=22, gender="male")
+        write_wav(os.path.join(self.media_root, "audios", "CG01.wav"))
+        write_wav(os.path.join(self.media_root, "audios", "CG04.wav"))
+        self.audio = Audio.objects.create(title="File1", file="audios/CG01.wav")
+        self.audio2 = Audio.objects.create(title="File2", file="audios/CG04.wav")
+        self.questions = [
+            NoiseQuestion.objects.create(number=n, text=f"Question {n}") for n in (1, 2, 3)
+        ]
+
+    def evaluation_data(self, **overrides):
+        data = {"user": self.user.pk, "audio": self.audio.pk, "annoyance": 50, "calm": 70}
+        data.update(overrides)
+        return data
+
+    def make_users(self, count):
+        return [
+            UserProfile.objects.create(user_id=f"p{n}", age=30 + n, gender="female") for n in range(count)
+        ]
+
+
+class ExportOutboxTests(SurveyFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        fd, self.export_path = tempfile.mkstemp(suffix=".csv")
+        os.close(fd)
+        self.addCleanup(os.remove, self.export_path)
+
+    def test_evaluation_post_queues_row(self):
+        NoiseResponse.objects.create(user=self.user, question=self.questions[0], rating=4)
+        response = self.client.post("/api/evaluations/", self.evaluation_data(), format="json")
+        self.assertEqual(response.status_code, 201)
+
+        entry = ExportOutbox.objects.get()
+        self.assertEqual(entry.evaluation_id, response.data["id"])
+        self.assertEqual(entry.payload[:7], ["22", "File1", "22", "male", "4", "NA", "NA"])
+        self.assertIsNone(entry.delivered_at)
+
+    def test_drain_writes_one_batch_and_marks_delivered(self):
+        for user in self.make_users(3):
+            self.client.post("/api/evaluations/", self.evaluation_data(user=user.pk), format="json")
+
+        sink = CSVFileSink(self.export_path)
+        self.assertEqual(drain_outbox(sink, batch_size=2), 2)
+        self.assertEqual(drain_outbox(sink, batch_size=2), 1)
+        self.assertEqual(drain_outbox(sink, batch_size=2), 0)
+
+        with open(self.export_path, encoding="utf-8") as f:
+            lines = f.read().splitlines()
+        self.assertEqual(len(lines), 4)  # header + 3 rows
+        self.assertTrue(lines[0].startswith("UserID,AudioTitle,Age,Gender,Q1,Q2,Q3"))
+        self.assertFalse(ExportOutbox.objects.filter(delivered_at__isnull=True).exists())
+
+    def test_rows_keep_the_header_they_were_queued_under(self):
+        first, second = self.make_users(2)
+        NoiseResponse.objects.create(user=first, question=self.questions[1], rating=5)
+        self.client.post("/api/evaluations/", self.evaluation_data(user=first.pk), format="json")
+        self.questions[0].delete()  # Q1 goes away while the first row is queued
+        NoiseResponse.objects.create(user=second, question=self.questions[2], rating=6)
+        self.client.post("/api/evaluations/", self.evaluation_data(user=second.pk), format="json")
+
+        sheet = FakeWorksheet()
+        with self.assertLogs("survey.export", "INFO"):
+            self.assertEqual(drain_outbox(GoogleSheetsSink(sheet)), 2)
+        rows = [dict(zip(sheet.rows[0], row)) for row in sheet.rows[1:]]
+        self.assertEqual([(row["Q2"], row["Q3"], row["Annoyance"]) for row in rows], [("5", "NA", "50"), ("NA", "6", "50")])
+
+        ExportOutbox.objects.update(delivered_at=None, next_attempt_at=timezone.now())
+        drain_outbox(CSVFileSink(self.export_path))
+        with open(self.export_path, newline="", encoding="utf-8") as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual([(row["Q2"], row["Q3"], row["Annoyance"]) for row in rows], [("5", "NA", "50"), ("NA", "6", "50")])
+
+    def test_claimed_rows_are_not_sent_by_another_worker(self):
+        for user in self.make_users(3):
+            self.client.post("/api/evaluations/", self.evaluation_data(user=user.pk), format="json")
+
+        now = timezone.now()
+        first = claim_outbox(2, now)
+        second = claim_outbox(10, now)
+        self.assertEqual(len(first), 2)
+        self.assertEqual([entry.pk for entry in second], [ExportOutbox.objects.order_by("id").last().pk])
+        self.assertEqual(claim_outbox(10, now), [])
+        # A dead worker's lease runs out.
+        self.assertEqual(len(claim_outbox(10, now + timedelta(seconds=settings.SURVEY_EXPORT_CLAIM_LEASE))), 3)
+
+    def test_failed_batch_is_retried_with_backoff(self):
+        self.client.post("/api/evaluations/", self.evaluation_data(), format="json")
+
+        with self.assertLogs("survey.export", "ERROR") as logs:
+            self.assertEqual(drain_outbox(FailingSink()), 0)
+        self.assertIn("quota exceeded", logs.output[0])
+        entry = ExportOutbox.objects.get()
+        self.assertEqual(entry.attempts, 1)
+        self.assertEqual(entry.last_error, "quota exceeded")
+        self.assertGreater(entry.next_attempt_at, timezone.now())
+
+        # Not due yet, so nothing is sent.
+        sink = CSVFileSink(self.export_path)
+        self.assertEqual(drain_outbox(sink), 0)
+
+        ExportOutbox.objects.update(next_attempt_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(drain_outbox(sink), 1)
+
+
+class ExportRowQueryTests(SurveyFixtureMixin, TestCase):
+    def test_post_save_path_uses_constant_queries(self):
+        for question in self.questions:
+            NoiseResponse.objects.create(user=self.user, question=question, rating=question.number)
+        prepare_header_row()  # warm the question cache
+        AudioRatingAggregate.objects.create(audio=self.audio)
+
+        # savepoint, user + audio lookups, stored row lookup, upsert, responses,
+        # outbox insert, aggregate update, release
+        with self.assertNumQueries(9):
+            response = self.client.post("/api/evaluations/", self.evaluation_data(), format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(ExportOutbox.objects.get().payload[4:7], ["1", "2", "3"])
+
+    def test_question_changes_invalidate_cache(self):
+        self.assertEqual(prepare_header_row()[4:8], ["Q1", "Q2", "Q3", "Annoyance"])
+        with self.assertNumQueries(0):
+            prepare_header_row()
+
+        NoiseQuestion.objects.create(number=4, text="Question 4")
+        self.assertEqual(prepare_header_row()[4:8], ["Q1", "Q2", "Q3", "Q4"])
+
+        self.questions[0].delete()
+        self.assertEqual(prepare_header_row()[4:7], ["Q2", "Q3", "Q4"])
+
+
+class BulkNoiseResponseTests(SurveyFixtureMixin, TestCase):
+    def test_list_is_written_in_one_request(self):
+        answers = [{"user": self.user.pk, "question": q.pk, "rating": q.number} for q in self.questions]
+
+        # savepoint, user + question preload, bulk insert, release
+        with self.assertNumQueries(5):
+            response = self.client.post("/api/noise-responses/", answers, format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data, {"created": 3, "errors": []})
+        self.assertEqual(
+            sorted(NoiseResponse.objects.values_list("question__number", "rating")),
+            [(1, 1), (2, 2), (3, 3)],
+        )
+
+    def test_invalid_items_are_reported_without_rejecting_the_rest(self):
+        answers = [
+            {"user": self.user.pk, "question": self.questions[0].pk, "rating": 5},
+            {"user": self.user.pk, "question": 9999, "rating": 5},
+            {"user": self.user.pk, "question": self.questions[1].pk},
+        ]
+        response = self.client.post("/api/noise-responses/", answers, format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["created"], 1)
+        self.assertEqual([e["index"] for e in response.data["errors"]], [1, 2])
+        self.assertIn("question", response.data["errors"][0]["errors"])
+        self.assertIn("rating", response.data["errors"][1]["errors"])
+        self.assertEqual(NoiseResponse.objects.count(), 1)
+
+    def test_all_invalid_or_empty_is_rejected(self):
+        response = self.client.post("/api/noise-responses/", [{"rating": 1}], format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data["created"], 0)
+
+        response = self.client.post("/api/noise-responses/", [], format="json")
+        self.assertEqual(response.status_code, 400)
+
+    def test_single_object_still_accepted(self):
+        data = {"user": self.user.pk, "question": self.questions[0].pk, "rating": 2}
+        response = self.client.post("/api/noise-responses/", data, format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["rating"], 2)
+
+    def test_single_object_errors(self):
+        with self.assertLogs("survey.views", "WARNING"):
+            response = self.client.post("/api/noise-responses/", {"user": self.user.pk}, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("rating", response.data["error"])
+
+        data = {"user": self.user.pk, "question": self.questions[0].pk, "rating": 2}
+        self.client.raise_request_exception = False
+        with mock.patch("survey.views.NoiseResponseViewSet.perform_bulk_create", side_effect=OperationalError("down")), \
+                self.assertLogs("django.request", "ERROR"):
+            response = self.client.post("/api/noise-responses/", data, format="json")
+        self.assertEqual(response.status_code, 500)
+
+
+class BulkEvaluationTests(SurveyFixtureMixin, TestCase):
+    def test_session_is_written_and_queued_as_one_batch(self):
+        NoiseResponse.objects.create(user=self.user, question=self.questions[1], rating=6)
+        evaluations = [
+            self.evaluation_data(audio=self.audio.pk, annoyance=10),
+            self.evaluation_data(audio=self.audio2.pk, annoyance=20),
+        ]
+        prepare_header_row()  # warm the question cache
+        AudioRatingAggregate.objects.create(audio=self.audio)
+        AudioRatingAggregate.objects.create(audio=self.audio2)
+
+        # savepoint, user + audio preload, stored row lookup, upsert, responses,
+        # outbox insert, one aggregate update per clip, release
+        with self.assertNumQueries(10):
+            response = self.client.post("/api/evaluations/", evaluations, format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["created"], 2)
+
+        rows = {entry.evaluation.audio.title: entry.payload for entry in ExportOutbox.objects.all()}
+        self.assertEqual(rows["File1"][4:8], ["NA", "6", "NA", "10"])
+        self.assertEqual(rows["File2"][4:8], ["NA", "6", "NA", "20"])
+        self.assertTrue(all(row[-1] for row in rows.values()))  # SubmittedAt filled
+
+    def test_invalid_evaluation_is_not_queued(self):
+        evaluations = [self.evaluation_data(), self.evaluation_data(audio=9999)]
+        response = self.client.post("/api/evaluations/", evaluations, format="json")
+        self.assertEqual(response.data["created"], 1)
+        self.assertEqual(response.data["errors"][0]["index"], 1)
+        self.assertEqual(AudioEvaluation.objects.count(), 1)
+        self.assertEqual(ExportOutbox.objects.count(), 1)
+
+
+class AudioDeliveryTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.size = os.path.getsize(write_wav(os.path.join(self.media_root, "audios", "clip.wav")))
+        self.audio = Audio.objects.create(title="Clip", file="audios/clip.wav")
+        self.path = self.audio.file.path  # moved to its content-addressed name by ingest
+        self.url = stream_path(self.audio)
+
+    def test_stream_mode_serves_ranges(self):
+        response = self.client.get(self.url, HTTP_RANGE="bytes=10-19")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], f"bytes 10-19/{self.size}")
+        with open(self.path, "rb") as f:
+            self.assertEqual(b"".join(response.streaming_content), f.read()[10:20])
+
+    @override_settings(SURVEY_AUDIO_DELIVERY="sendfile")
+    def test_sendfile_mode_uses_file_response_without_range(self):
+        response = self.client.get(self.url)
+        self.assertIsInstance(response, FileResponse)
+        self.assertEqual(response["Content-Length"], str(self.size))
+        self.assertEqual(response["Access-Control-Allow-Origin"], "*")
+        response.close()
+
+        response = self.client.get(self.url, HTTP_RANGE="bytes=0-9")
+        self.assertEqual(response.status_code, 206)
+        self.assertNotIsInstance(response, FileResponse)
+        response.close()
+
+    @override_settings(SURVEY_AUDIO_DELIVERY="x-accel-redirect", SURVEY_AUDIO_ACCEL_PREFIX="/protected-media/")
+    def test_x_accel_redirect_mode(self):
+        response = self.client.get(self.url, HTTP_RANGE="bytes=0-9")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["X-Accel-Redirect"], f"/protected-media/{self.audio.file.name}")
+        self.assertEqual(response["Content-Type"], "audio/x-wav")
+        self.assertEqual(response.content, b"")
+
+    @override_settings(SURVEY_AUDIO_DELIVERY="x-sendfile")
+    def test_x_sendfile_mode(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response["X-Sendfile"], self.path)
+
+
+class RangeHeaderParsingTests(TestCase):
+    def test_parse_range_header(self):
+        self.assertEqual(parse_range_header("bytes=0-9", 100), [(0, 9)])
+        self.assertEqual(parse_range_header("bytes=90-", 100), [(90, 99)])
+        self.assertEqual(parse_range_header("bytes=-10", 100), [(90, 99)])
+        self.assertEqual(parse_range_header("bytes=-500", 100), [(0, 99)])
+        self.assertEqual(parse_range_header("bytes=50-500", 100), [(50, 99)])
+        self.assertEqual(parse_range_header("bytes=0-4, 5-9, 20-29", 100), [(0, 9), (20, 29)])
+        self.assertEqual(parse_range_header("bytes=100-", 100), [])
+        self.assertEqual(parse_range_header("bytes=-0", 100), [])
+        self.assertIsNone(parse_range_header("bytes=9-0", 100))
+        self.assertIsNone(parse_range_header("items=0-9", 100))
+        self.assertIsNone(parse_range_header("bytes=abc", 100))
+
+
+@override_settings(SURVEY_AUDIO_STAT_TTL=0)
+class ConditionalStreamTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        file_info_cache.clear()
+        with open(write_wav(os.path.join(self.media_root, "audios", "clip.wav")), "rb") as f:
+            self.data = f.read()
+        self.audio = Audio.objects.create(title="Clip", file="audios/clip.wav")
+        self.path = self.audio.file.path
+        self.url = stream_path(self.audio)
+
+    def test_full_response_has_validators(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), self.data)
+        self.assertTrue(response["ETag"].startswith('"'))
+        self.assertIn("Last-Modified", response)
+
+    def test_if_none_match_and_if_modified_since_return_304(self):
+        first = self.client.get(self.url)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], first["ETag"])
+        self.assertEqual(response["Access-Control-Allow-Origin"], "*")
+
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=first["Last-Modified"])
+        self.assertEqual(response.status_code, 304)
+
+    def test_etag_changes_when_file_changes(self):
+        etag = self.client.get(self.url)["ETag"]
+        stat = os.stat(self.path)
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_suffix_range(self):
+        response = self.client.get(self.url, HTTP_RANGE="bytes=-100")
+        self.assertEqual(response.status_code, 206)
+        size = len(self.data)
+        self.assertEqual(response["Content-Range"], f"bytes {size - 100}-{size - 1}/{size}")
+        self.assertEqual(b"".join(response.streaming_content), self.data[-100:])
+
+    def test_unsatisfiable_range_returns_416(self):
+        response = self.client.get(self.url, HTTP_RANGE=f"bytes={len(self.data)}-")
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], f"bytes */{len(self.data)}")
+
+    def test_if_range_mismatch_sends_whole_file(self):
+        etag = self.client.get(self.url)["ETag"]
+        response = self.client.get(self.url, HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 206)
+
+        response = self.client.get(self.url, HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Length"], str(len(self.data)))
+
+    def test_multiple_ranges_use_multipart_byteranges(self):
+        response = self.client.get(self.url, HTTP_RANGE="bytes=0-3, 100-103")
+        self.assertEqual(response.status_code, 206)
+        self.assertTrue(response["Content-Type"].startswith("multipart/byteranges; boundary="))
+        body = b"".join(response.streaming_content)
+        self.assertEqual(len(body), int(response["Content-Length"]))
+        self.assertIn(self.data[0:4], body)
+        self.assertIn(b"Content-Range: bytes 100-103/", body)
+        self.assertIn(self.data[100:104], body)
+
+
+class AudioIngestTests(MediaRootMixin, TestCase):
+    def test_header_with_extra_chunks(self):
+        fmt = struct.pack("<HHIIHH", 1, 1, 8000, 16000, 2, 16)
+        data = b"\x01\x00" * 80
+        body = b"WAVE" + b"fmt " + struct.pack("<I", len(fmt)) + fmt
+        body += b"LIST" + struct.pack("<I", 3) + b"abc\0"  # odd chunk, padded
+        body += b"data" + struct.pack("<I", len(data)) + data
+        raw = b"RIFF" + struct.pack("<I", len(body)) + body
+
+        info = parse_wav_header(io.BytesIO(raw), file_size=len(raw))
+        self.assertEqual((info.channels, info.sample_rate, info.bits_per_sample), (1, 8000, 16))
+        self.assertEqual(info.data_offset, len(raw) - len(data))
+        self.assertEqual(info.frames, 80)
+        self.assertAlmostEqual(info.duration, 0.01)
+
+        with self.assertRaises(EOFError):
+            parse_wav_header(io.BytesIO(raw[:40]))
+
+    def test_peaks_are_min_max_per_bucket(self):
+        samples = np.array([[0.0, 0.5], [-1.0, 0.25], [0.1, 0.1], [0.2, -0.2]], dtype=np.float32)
+        peaks = compute_peaks(samples, sample_rate=4, peaks_per_second=2)
+        self.assertEqual(peaks.tolist(), [-127, 64, -25, 25])
+
+    def test_24_bit_samples(self):
+        path = os.path.join(self.media_root, "clip24.wav")
+        with wave.open(path, "wb") as f:
+            f.setnchannels(1)
+            f.setsampwidth(3)
+            f.setframerate(8000)
+            f.writeframes(b"\x00\x00\x40" + b"\x00\x00\xc0")  # +0.5, -0.5
+        samples = load_samples(path, read_wav_info(path))
+        self.assertEqual(samples[:, 0].tolist(), [0.5, -0.5])
+
+    def test_saving_audio_ingests_metadata_and_peaks(self):
+        write_wav(os.path.join(self.media_root, "audios", "clip.wav"), frames=44100)
+        audio = Audio.objects.create(title="Clip", file="audios/clip.wav")
+
+        audio.refresh_from_db()
+        self.assertAlmostEqual(audio.duration, 1.0)
+        self.assertEqual((audio.sample_rate, audio.channels, audio.bits_per_sample), (44100, 2, 16))
+        self.assertEqual(audio.data_offset, 44)
+        self.assertEqual(audio.peaks.size, 2 * 50)
+
+        response = self.client.get(f"/api/audios/{audio.pk}/")
+        self.assertEqual(response.data["duration"], 1.0)
+        self.assertTrue(response.data["peaks"].endswith(f"/api/audios/{audio.pk}/peaks/"))
+
+        response = self.client.get(f"/api/audios/{audio.pk}/peaks/")
+        self.assertEqual(response["X-Peaks-Per-Second"], "50")
+        self.assertEqual(len(b"".join(response.streaming_content)), 100)
+
+
+@override_settings(SURVEY_AUDIO_STAT_TTL=0)
+class AudioVariantTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        file_info_cache.clear()
+        write_wav(os.path.join(self.media_root, "audios", "clip.wav"), frames=44100 * 2)
+        self.audio = Audio.objects.create(title="Clip", file="audios/clip.wav")
+        self.audio.refresh_from_db()
+        self.url = stream_path(self.audio)
+
+    def read_wav(self, data):
+        with wave.open(io.BytesIO(data), "rb") as f:
+            return f.getnchannels(), f.getframerate(), f.getsampwidth(), f.getnframes()
+
+    def test_resample_keeps_frequency(self):
+        t = np.arange(44100) / 44100
+        tone = np.sin(2 * np.pi * 1000 * t).astype(np.float32)[:, None]
+        out = resample(tone, 44100, 22050)
+        self.assertEqual(out.shape, (22050, 1))
+        self.assertEqual(np.argmax(np.abs(np.fft.rfft(out[:, 0]))), 1000)
+
+    def test_low_variant_is_mono_22k_and_cached_by_hash(self):
+        response = self.client.get(self.url, {"variant": "low"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.read_wav(b"".join(response.streaming_content)), (1, 22050, 2, 44100))
+
+        path = os.path.join(self.media_root, variant_name(self.audio, "low"))
+        self.assertTrue(os.path.exists(path))
+        mtime = os.stat(path).st_mtime_ns
+        self.client.get(self.url, {"variant": "low"})
+        self.assertEqual(os.stat(path).st_mtime_ns, mtime)
+
+    def test_preview_is_truncated(self):
+        with override_settings(SURVEY_AUDIO_VARIANTS={"short": {"channels": 1, "sample_rate": 22050, "seconds": 0.5}}):
+            call_command("build_audio_variants", stdout=io.StringIO())
+            response = self.client.get(self.url, {"variant": "short"})
+        self.assertEqual(self.read_wav(b"".join(response.streaming_content))[3], 11025)
+
+    def test_missing_variant_serves_the_original_without_rendering(self):
+        path = os.path.join(self.media_root, variant_name(self.audio, "low"))
+        os.remove(path)
+        with self.assertLogs("survey.views", "WARNING"):
+            response = self.client.get(self.url, {"variant": "low"})
+        self.assertEqual(self.read_wav(b"".join(response.streaming_content))[:2], (2, 44100))
+        self.assertEqual(response["Cache-Control"], settings.SURVEY_AUDIO_CACHE_CONTROL)
+        self.assertFalse(os.path.exists(path))
+
+        call_command("build_audio_variants", "--variant", "low", stdout=io.StringIO())
+        response = self.client.get(self.url, {"variant": "low"})
+        self.assertEqual(self.read_wav(b"".join(response.streaming_content))[:2], (1, 22050))
+
+    def test_save_data_hint_picks_low_variant(self):
+        response = self.client.get(self.url, HTTP_SAVE_DATA="on")
+        self.assertEqual(self.read_wav(b"".join(response.streaming_content))[:2], (1, 22050))
+        self.assertIn("Save-Data", response["Vary"])
+
+        response = self.client.get(self.url, {"variant": "original"}, HTTP_SAVE_DATA="on")
+        self.assertEqual(self.read_wav(b"".join(response.streaming_content))[:2], (2, 44100))
+
+    def test_unknown_variant(self):
+        response = self.client.get(self.url, {"variant": "hifi"})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(SURVEY_AUDIO_STAT_TTL=0, SURVEY_AUDIO_MMAP_CACHE_BYTES=1024 * 1024)
+class MmapCacheTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        file_info_cache.clear()
+        mmap_cache.clear()
+        mmap_cache.hits = mmap_cache.misses = mmap_cache.evictions = 0
+        self.addCleanup(mmap_cache.clear)
+        for n in range(3):
+            write_wav(os.path.join(self.media_root, "audios", f"clip{n}.wav"), frames=20000 + n)
+        self.audios = [
+            Audio.objects.create(title=f"Clip{n}", file=f"audios/clip{n}.wav") for n in range(3)
+        ]
+        self.paths = [audio.file.path for audio in self.audios]
+
+    def fetch(self, audio, **headers):
+        response = self.client.get(stream_path(audio), **headers)
+        return b"".join(response.streaming_content)
+
+    def test_ranges_are_served_from_the_map(self):
+        with open(self.paths[0], "rb") as f:
+            data = f.read()
+        self.assertEqual(self.fetch(self.audios[0]), data)
+        self.assertEqual(self.fetch(self.audios[0], HTTP_RANGE="bytes=100-70000"), data[100:70001])
+        multipart = self.fetch(self.audios[0], HTTP_RANGE="bytes=0-3,-4")
+        self.assertIn(data[:4], multipart)
+        self.assertIn(data[-4:], multipart)
+
+        stats = self.client.get("/api/stream-audio/cache-stats/").json()
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["hits"], 2)
+        self.assertEqual(stats["bytes"], len(data))
+
+    def test_lru_is_bounded(self):
+        size = os.path.getsize(self.paths[0])
+        with override_settings(SURVEY_AUDIO_MMAP_CACHE_BYTES=size * 2 + 100):
+            for audio in self.audios:
+                self.fetch(audio)
+            stats = mmap_cache.stats()
+        self.assertEqual(stats["entries"], 2)
+        self.assertEqual(stats["evictions"], 1)
+
+    def test_changed_or_replaced_file_is_remapped(self):
+        self.fetch(self.audios[0])
+        write_wav(self.paths[0], frames=100)
+        stat = os.stat(self.paths[0])
+        os.utime(self.paths[0], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        with open(self.paths[0], "rb") as f:
+            self.assertEqual(self.fetch(self.audios[0]), f.read())
+
+        audio = self.audios[1]
+        self.fetch(audio)
+        self.assertEqual(mmap_cache.stats()["entries"], 2)
+        audio.file = self.audios[2].file.name
+        audio.save()
+        self.assertEqual(mmap_cache.stats()["entries"], 1)
+
+    def test_disabled(self):
+        with override_settings(SURVEY_AUDIO_MMAP_CACHE_BYTES=0):
+            self.fetch(self.audios[0])
+        self.assertEqual(mmap_cache.stats()["misses"], 0)
+
+
+@override_settings(SURVEY_AUDIO_STAT_TTL=0)
+class AsyncEndpointTests(SurveyFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        file_info_cache.clear()
+        self.async_client = AsyncClient()
+        with open(self.audio.file.path, "rb") as f:
+            self.data = f.read()
+
+    async def read(self, response):
+        return b"".join([chunk async for chunk in response.streaming_content])
+
+    async def test_stream_with_async_iterator(self):
+        url = stream_path(self.audio, "/api/async/stream-audio/")
+        response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_async)
+        self.assertEqual(await self.read(response), self.data)
+
+        response = await self.async_client.get(url, headers={"range": "bytes=-16"})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(await self.read(response), self.data[-16:])
+
+        response = await self.async_client.get(url, headers={"range": "bytes=0-1,10-11"})
+        self.assertIn(self.data[10:12], await self.read(response))
+
+    async def test_stream_without_mmap_reads_in_threads(self):
+        with override_settings(SURVEY_AUDIO_MMAP_CACHE_BYTES=0, SURVEY_AUDIO_DELIVERY="sendfile"):
+            response = await self.async_client.get(stream_path(self.audio, "/api/async/stream-audio/"))
+            self.assertTrue(response.is_async)
+            self.assertEqual(await self.read(response), self.data)
+
+    def test_asgi_serves_stream_url_with_async_view(self):
+        code = (
+            "import audioupload.{}\n"
+            "from django.urls import resolve\n"
+            "print(resolve('/api/stream-audio/1/').func.view_class.__name__,"
+            " resolve('/api/stream-audio/1/abc/').func.view_class.__name__)\n"
+        )
+        env = {k: v for k, v in os.environ.items() if k != "SURVEY_ASYNC_STREAMING"}
+        env["DJANGO_SETTINGS_MODULE"] = "audioupload.settings"
+        base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        for module, view in (("asgi", "AsyncAudioStreamView"), ("wsgi", "AudioStreamView")):
+            result = subprocess.run(
+                [sys.executable, "-c", code.format(module)], cwd=base_dir,
+                env=env, capture_output=True, text=True, check=True,
+            )
+            self.assertEqual(result.stdout.split(), [view, view])
+
+    async def test_async_bulk_submission(self):
+        answers = [{"user": self.user.pk, "question": q.pk, "rating": 3} for q in self.questions]
+        response = await self.async_client.post(
+            "/api/async/noise-responses/", answers, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json(), {"created": 3, "errors": []})
+
+        response = await self.async_client.post(
+            "/api/async/evaluations/", self.evaluation_data(), content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(await ExportOutbox.objects.acount(), 1)
+
+
+class CatalogCacheTests(SurveyFixtureMixin, TestCase):
+    def test_bootstrap_payload_is_cached_with_etag(self):
+        response = self.client.get("/api/bootstrap/")
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual([a["title"] for a in body["audios"]], ["File1", "File2"])
+        self.assertEqual([q["number"] for q in body["noise_questions"]], [1, 2, 3])
+        self.assertTrue(body["audios"][0]["stream_url"].startswith("http://testserver/api/stream-audio/"))
+        self.assertIn("max-age=", response["Cache-Control"])
+        etag = response["ETag"]
+
+        with self.assertNumQueries(0):
+            response = self.client.get("/api/bootstrap/")
+        self.assertEqual(response["ETag"], etag)
+
+        with self.assertNumQueries(0):
+            response = self.client.get("/api/bootstrap/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_catalog_changes_invalidate(self):
+        etag = self.client.get("/api/bootstrap/")["ETag"]
+        self.questions[0].delete()
+        response = self.client.get("/api/bootstrap/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["noise_questions"]), 2)
+
+        etag = response["ETag"]
+        self.audio.title = "Renamed"
+        self.audio.save()
+        response = self.client.get("/api/bootstrap/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.json()["audios"][0]["title"], "Renamed")
+
+    def test_change_in_another_worker_invalidates(self):
+        etag = self.client.get("/api/bootstrap/")["ETag"]
+        NoiseQuestion.objects.filter(pk=self.questions[0].pk).update(text="Changed")
+        with mock.patch("survey.catalog.cache", LocMemCache("other-worker", {})):
+            invalidate_catalog()
+
+        response = self.client.get("/api/bootstrap/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["noise_questions"][0]["text"], "Changed")
+
+    def test_list_endpoints_support_conditional_get(self):
+        for url in ("/api/audios/", "/api/noise-questions/"):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            with self.assertNumQueries(0):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+            self.assertEqual(response.status_code, 304)
+
+        NoiseQuestion.objects.create(number=4, text="Question 4")
+        response = self.client.get("/api/noise-questions/")
+        self.assertEqual(len(response.json()), 4)
+
+
+class RatingAggregateTests(SurveyFixtureMixin, TestCase):
+    def aggregate(self):
+        return AudioRatingAggregate.objects.get(audio=self.audio)
+
+    def test_saves_edits_and_deletes_update_aggregates(self):
+        first = AudioEvaluation.objects.create(user=self.user, audio=self.audio, annoyance=20, calm=70)
+        AudioEvaluation.objects.create(user=self.make_users(1)[0], audio=self.audio, annoyance=40)
+        aggregate = self.aggregate()
+        self.assertEqual((aggregate.count, aggregate.annoyance_sum, aggregate.annoyance_sumsq), (2, 60, 2000))
+
+        first.annoyance = 10
+        first.save()
+        aggregate = self.aggregate()
+        self.assertEqual((aggregate.count, aggregate.annoyance_sum, aggregate.annoyance_sumsq), (2, 50, 1700))
+
+        first.delete()
+        aggregate = self.aggregate()
+        self.assertEqual((aggregate.count, aggregate.annoyance_sum, aggregate.calm_sum), (1, 40, 0))
+
+    def test_bulk_path_and_rebuild_agree(self):
+        evaluations = [
+            self.evaluation_data(user=user.pk, annoyance=value)
+            for user, value in zip(self.make_users(3), (10, 20, 60))
+        ]
+        response = self.client.post("/api/evaluations/", evaluations, format="json")
+        self.assertEqual(response.status_code, 201)
+        incremental = self.aggregate()
+
+        rebuild_aggregates()
+        rebuilt = self.aggregate()
+        for field in AudioEvaluation.RATING_FIELDS:
+            self.assertEqual(getattr(rebuilt, f"{field}_sum"), getattr(incremental, f"{field}_sum"))
+            self.assertEqual(getattr(rebuilt, f"{field}_sumsq"), getattr(incremental, f"{field}_sumsq"))
+        self.assertEqual(rebuilt.count, 3)
+
+    def test_stats_endpoint(self):
+        for user, value in zip(self.make_users(3), (10, 20, 60)):
+            AudioEvaluation.objects.create(user=user, audio=self.audio, annoyance=value)
+
+        response = self.client.get(f"/api/stats/audios/{self.audio.pk}/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["count"], 3)
+        annoyance = response.data["ratings"]["annoyance"]
+        self.assertAlmostEqual(annoyance["mean"], 30.0)
+        self.assertAlmostEqual(annoyance["sd"], float(np.std([10, 20, 60], ddof=1)))
+        low, high = annoyance["ci"]
+        self.assertAlmostEqual((low + high) / 2, 30.0)
+        self.assertEqual(self.client.get(f"/api/stats/audios/{self.audio2.pk}/").status_code, 404)
+
+    def test_summarize_edge_cases(self):
+        self.assertEqual(summarize(0, 0, 0)["mean"], None)
+        self.assertEqual(summarize(1, 5, 25), {"mean": 5.0, "sd": None, "ci": None})
+        self.assertEqual(summarize(4, 20, 100)["sd"], 0.0)
+
+
+class SoundscapeTests(SurveyFixtureMixin, TestCase):
+    def test_coordinates_match_iso_formula(self):
+        paq = dict(pleasantness=80, vibrant=60, eventfulness=30, chaotic=20,
+                   annoyance=10, monotonous=40, uneventful=50, calm=70)
+        c = np.cos(np.pi / 4)
+        scale = (1 + np.sqrt(2)) * 100
+        expected_p = ((80 - 10) + c * (70 - 20) + c * (60 - 40)) / scale
+        expected_e = ((30 - 50) + c * (20 - 70) + c * (60 - 40)) / scale
+
+        pleasant, eventful = iso_coordinates([[paq[field] for field in PAQ_FIELDS]])[0]
+        self.assertAlmostEqual(pleasant, expected_p)
+        self.assertAlmostEqual(eventful, expected_e)
+
+        evaluation = AudioEvaluation.objects.create(user=self.user, audio=self.audio, **paq)
+        evaluation.refresh_from_db()
+        self.assertAlmostEqual(evaluation.iso_pleasant, expected_p)
+        self.assertAlmostEqual(evaluation.iso_eventful, expected_e)
+
+    def test_extremes_reach_unit_square(self):
+        fully_pleasant = dict(pleasantness=100, vibrant=100, calm=100)
+        pleasant, eventful = iso_coordinates([[fully_pleasant.get(field, 0) for field in PAQ_FIELDS]])[0]
+        self.assertAlmostEqual(pleasant, 1.0)
+        self.assertAlmostEqual(eventful, 0.0)
+
+    def test_bulk_path_and_backfill(self):
+        response = self.client.post(
+            "/api/evaluations/",
+            [self.evaluation_data(pleasantness=100), self.evaluation_data(audio=self.audio2.pk)],
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(AudioEvaluation.objects.filter(iso_pleasant__isnull=True).exists())
+
+        AudioEvaluation.objects.update(iso_pleasant=None, iso_eventful=None)
+        self.assertEqual(backfill_iso_coordinates(chunk_size=1), 2)
+        self.assertEqual(AudioEvaluation.objects.filter(iso_pleasant__isnull=True).count(), 0)
+
+    def test_soundscape_endpoint(self):
+        for user, pleasantness in zip(self.make_users(3), (100, 0, 50)):
+            AudioEvaluation.objects.create(user=user, audio=self.audio, pleasantness=pleasantness)
+
+        response = self.client.get(f"/api/stats/audios/{self.audio.pk}/soundscape/")
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["count"], 3)
+        self.assertAlmostEqual(data["mean"]["pleasant"], 0.5 / (1 + np.sqrt(2)))
+        self.assertAlmostEqual(data["mean"]["eventful"], 0.0)
+        self.assertEqual(len(data["density"]), 10)
+        self.assertAlmostEqual(sum(map(sum, data["density"])), 1.0)
+        points = np.array(AudioEvaluation.objects.values_list("iso_pleasant", "iso_eventful"))
+        self.assertAlmostEqual(data["sd"]["pleasant"], points[:, 0].std(ddof=1))
+        np.testing.assert_allclose(data["covariance"], np.cov(points, rowvar=False), atol=1e-12)
+
+    def test_soundscape_does_not_need_an_aggregate_row(self):
+        AudioEvaluation.objects.create(user=self.user, audio=self.audio, pleasantness=100)
+        AudioRatingAggregate.objects.all().delete()
+
+        response = self.client.get(f"/api/stats/audios/{self.audio.pk}/soundscape/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["count"], 1)
+        self.assertEqual(response.json()["sd"], {"pleasant": 0.0, "eventful": 0.0})
+        self.assertEqual(self.client.get("/api/stats/audios/9999/soundscape/").status_code, 404)
+
+
+class ResearchExportTests(SurveyFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        other = UserProfile.objects.create(user_id="23", age=30, gender="female")
+        NoiseResponse.objects.create(user=self.user, question=self.questions[0], rating=4)
+        NoiseResponse.objects.create(user=other, question=self.questions[2], rating=5)
+        AudioEvaluation.objects.create(user=other, audio=self.audio, annoyance=5)
+        AudioEvaluation.objects.create(user=self.user, audio=self.audio2, calm=60)
+        AudioEvaluation.objects.create(user=self.user, audio=self.audio, annoyance=30)
+
+    def test_rows_match_prepare_data_row(self):
+        rows = list(iter_csv_rows(chunk_size=1))
+        self.assertEqual(rows[0], prepare_header_row())
+        expected = [
+            prepare_data_row(evaluation)
+            for evaluation in AudioEvaluation.objects.order_by("user_id", "pk")
+        ]
+        self.assertEqual(rows[1:], expected)
+        self.assertEqual(rows[1][4:7], ["4", "NA", "NA"])
+
+    def test_query_count_does_not_grow_with_participants(self):
+        prepare_header_row()  # warm the question cache
+        with self.assertNumQueries(2):
+            list(iter_csv_rows(chunk_size=2))
+
+        for n in range(10):
+            user = UserProfile.objects.create(user_id=f"u{n}", age=20 + n, gender="female")
+            NoiseResponse.objects.create(user=user, question=self.questions[1], rating=n)
+            AudioEvaluation.objects.create(user=user, audio=self.audio)
+        with self.assertNumQueries(2):
+            self.assertEqual(len(list(iter_csv_rows(chunk_size=2))), 14)
+
+    def test_endpoint_is_staff_only_and_streams(self):
+        self.assertEqual(self.client.get("/api/export/research/").status_code, 302)
+
+        staff = User.objects.create_user("staff", password="x", is_staff=True)
+        self.client.force_login(staff)
+        response = self.client.get("/api/export/research/")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(lines[0].startswith("UserID,AudioTitle,Age,Gender,Q1,Q2,Q3,Annoyance"))
+        self.assertEqual(self.client.get("/api/export/research/?format=xlsx").status_code, 400)
+
+    def test_command_writes_csv(self):
+        fd, path = tempfile.mkstemp(suffix=".csv")
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        call_command("export_research_data", path, stderr=io.StringIO())
+        with open(path, encoding="utf-8") as f:
+            self.assertEqual(len(f.read().splitlines()), 4)
+
+    @unittest.skipUnless(importlib.util.find_spec("pyarrow"), "pyarrow is not installed")
+    def test_parquet_keeps_types(self):
+        import pyarrow.parquet as pq
+
+        buffer = io.BytesIO()
+        self.assertEqual(write_parquet(buffer, chunk_size=2), 3)
+        buffer.seek(0)
+        table = pq.read_table(buffer)
+        self.assertEqual(table.column_names, prepare_header_row())
+        self.assertEqual(table.column("Q1").to_pylist(), [4, 4, None])
+
+    @unittest.skipUnless(importlib.util.find_spec("pyarrow"), "pyarrow is not installed")
+    def test_endpoint_serves_parquet(self):
+        import pyarrow.parquet as pq
+
+        staff = User.objects.create_user("staff", password="x", is_staff=True)
+        self.client.force_login(staff)
+        response = self.client.get("/api/export/research/?format=parquet")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('filename="user_survey_analysis.parquet"', response["Content-Disposition"])
+        table = pq.read_table(io.BytesIO(b"".join(response.streaming_content)))
+        self.assertEqual(table.num_rows, 3)
+        self.assertEqual(table.column_names, prepare_header_row())
+
+
+class UpsertTests(SurveyFixtureMixin, TestCase):
+    def test_retried_evaluation_updates_instead_of_duplicating(self):
+        first = self.client.post("/api/evaluations/", self.evaluation_data(annoyance=20), format="json")
+        self.assertEqual(first.status_code, 201)
+        retry = self.client.post("/api/evaluations/", self.evaluation_data(annoyance=30), format="json")
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.data["id"], first.data["id"])
+        self.assertEqual(retry.data["submitted_at"], first.data["submitted_at"])
+
+        evaluation = AudioEvaluation.objects.get()
+        self.assertEqual(evaluation.annoyance, 30)
+        self.assertEqual(ExportOutbox.objects.count(), 1)
+
+        aggregate = AudioRatingAggregate.objects.get(audio=self.audio)
+        self.assertEqual((aggregate.count, aggregate.annoyance_sum, aggregate.annoyance_sumsq), (1, 30, 900))
+
+    def test_retry_before_export_refreshes_the_queued_row(self):
+        self.client.post("/api/evaluations/", self.evaluation_data(annoyance=20), format="json")
+        self.client.post("/api/evaluations/", self.evaluation_data(annoyance=30), format="json")
+
+        payload = ExportOutbox.objects.get().payload
+        self.assertEqual(payload[prepare_header_row().index("Annoyance")], "30")
+
+    def test_bulk_retry_is_idempotent(self):
+        session = [
+            self.evaluation_data(audio=self.audio.pk, annoyance=10),
+            self.evaluation_data(audio=self.audio2.pk, annoyance=20),
+        ]
+        for _ in range(2):
+            response = self.client.post("/api/evaluations/", session, format="json")
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(response.data, {"created": 2, "errors": []})
+
+        self.assertEqual(AudioEvaluation.objects.count(), 2)
+        self.assertEqual(ExportOutbox.objects.count(), 2)
+        self.assertEqual(AudioRatingAggregate.objects.get(audio=self.audio2).annoyance_sum, 20)
+
+    def test_duplicates_within_one_batch_keep_the_last(self):
+        session = [self.evaluation_data(annoyance=10), self.evaluation_data(annoyance=40)]
+        response = self.client.post("/api/evaluations/", session, format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(AudioEvaluation.objects.get().annoyance, 40)
+
+    def test_retried_noise_responses_update_the_answer(self):
+        answers = [{"user": self.user.pk, "question": q.pk, "rating": 2} for q in self.questions]
+        self.client.post("/api/noise-responses/", answers, format="json")
+        answers[0]["rating"] = 5
+        response = self.client.post("/api/noise-responses/", answers, format="json")
+        self.assertEqual(response.status_code, 201)
+
+        response = self.client.post(
+            "/api/noise-responses/", {"user": self.user.pk, "question": self.questions[1].pk, "rating": 6}, format="json"
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            dict(NoiseResponse.objects.values_list("question__number", "rating")), {1: 5, 2: 6, 3: 2}
+        )
+
+
+@override_settings(SURVEY_METRICS_QUEUE_TTL=0)
+class MetricsTests(SurveyFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        registry.clear()
+        self.staff = User.objects.create_user("staff", password="x", is_staff=True)
+
+    def scrape(self):
+        self.client.force_login(self.staff)
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+        return response.content.decode()
+
+    def test_server_timing_and_request_metrics(self):
+        response = self.client.get("/api/bootstrap/")
+        self.assertRegex(response["Server-Timing"], r'^app;dur=[\d.]+, db;dur=[\d.]+;desc="2 queries"$')
+
+        text = self.scrape()
+        self.assertIn('survey_request_duration_seconds_bucket{view="bootstrap",method="GET",le="+Inf"} 1', text)
+        self.assertIn('survey_request_duration_seconds_count{view="bootstrap",method="GET"} 1', text)
+        self.assertIn('survey_request_queries_total{view="bootstrap"} 2', text)
+        self.assertIn('survey_responses_total{view="bootstrap",status="200"} 1', text)
+        self.assertIn("survey_export_queue_depth 0", text)
+        self.assertIn("survey_mmap_cache_hits_total", text)
+
+    def test_stream_duration_is_recorded_when_the_body_is_sent(self):
+        response = self.client.get(stream_path(self.audio), HTTP_RANGE="bytes=0-99")
+        self.assertEqual(response.status_code, 206)
+        self.assertNotIn('survey_stream_duration_seconds_count{view="stream-audio-version"}', self.scrape())
+
+        b"".join(response.streaming_content)
+        response.close()
+        text = self.scrape()
+        self.assertIn('survey_stream_duration_seconds_count{view="stream-audio-version"} 1', text)
+        self.assertIn('survey_response_bytes_total{view="stream-audio-version"} 100', text)
+
+    def test_sink_latency_and_queue_depth(self):
+        self.client.post("/api/evaluations/", self.evaluation_data(), format="json")
+        self.assertIn("survey_export_queue_depth 1", self.scrape())
+
+        with self.assertLogs("survey.export", "ERROR"):
+            drain_outbox(FailingSink())
+        text = self.scrape()
+        self.assertIn('survey_export_sink_duration_seconds_count{outcome="failed"} 1', text)
+        self.assertIn('survey_export_rows_total{outcome="failed"} 1', text)
+
+    @override_settings(SURVEY_METRICS_TOKEN="secret")
+    def test_token_is_required_when_configured(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 401)
+        response = self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(response.status_code, 200)
+
+    def test_staff_only_without_a_token(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 403)
+        self.scrape()
+
+    @override_settings(SURVEY_METRICS_QUEUE_TTL=60)
+    def test_queue_depth_is_counted_once_per_ttl(self):
+        self.scrape()
+        with self.assertNumQueries(0):
+            registry.render()
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram("h", "test", ["view"], buckets=(0.1, 1))
+        for value in (0.05, 0.5, 5):
+            histogram.observe(value, "v")
+        lines = histogram.render()
+        self.assertIn('h_bucket{view="v",le="0.1"} 1', lines)
+        self.assertIn('h_bucket{view="v",le="1"} 2', lines)
+        self.assertIn('h_bucket{view="v",le="+Inf"} 3', lines)
+        self.assertIn('h_sum{view="v"} 5.55', lines)
+
+
+class LoggingTests(TestCase):
+    def make_record(self, level=logging.INFO, msg="hello %s", args=("world",), **extra):
+        record = logging.LogRecord("survey.views", level, __file__, 1, msg, args, None)
+        record.__dict__.update(extra)
+        return record
+
+    def test_redaction_reaches_nested_payloads(self):
+        record = self.make_record(payload=[{"user_id": "22", "age": 30, "rating": 4}], user_id="22")
+        RedactFilter(["user_id", "age"]).filter(record)
+        self.assertEqual(record.payload, [{"user_id": REDACTED, "age": REDACTED, "rating": 4}])
+        self.assertEqual(record.user_id, REDACTED)
+
+    def test_redaction_reaches_message_arguments(self):
+        redact = RedactFilter(["user_id"])
+        record = self.make_record(msg="rejected %s", args=({"user_id": "22", "rating": 4},))
+        redact.filter(record)
+        self.assertNotIn("22", record.getMessage())
+        self.assertIn("4", record.getMessage())
+
+        record = self.make_record(msg="user %(user_id)s", args=({"user_id": "22"},))
+        redact.filter(record)
+        self.assertEqual(record.getMessage(), f"user {REDACTED}")
+
+    def test_django_loggers_use_the_background_handler(self):
+        for name in ("django", "django.server"):
+            handlers = logging.getLogger(name).handlers
+            self.assertTrue(handlers)
+            self.assertTrue(all(isinstance(handler, BackgroundHandler) for handler in handlers), name)
+
+    def test_background_handler_writes_json_lines(self):
+        stream = io.StringIO()
+        handler = BackgroundHandler(stream)
+        handler.setFormatter(JsonFormatter())
+        self.addCleanup(handler.close)
+
+        handler.handle(self.make_record(payload={"rating": 4}))
+        handler.flush()
+        entry = json.loads(stream.getvalue())
+        self.assertEqual(entry["message"], "hello world")
+        self.assertEqual(entry["logger"], "survey.views")
+        self.assertEqual(entry["payload"], {"rating": 4})
+
+    def test_full_queue_drops_instead_of_blocking(self):
+        handler = BackgroundHandler(io.StringIO(), maxsize=1)
+        handler.listener.stop()
+        self.addCleanup(handler.close)
+        handler.handle(self.make_record())
+        handler.handle(self.make_record())
+        self.assertEqual(handler.dropped, 1)
+
+    def test_sampling_keeps_warnings(self):
+        sampler = SamplingFilter(rate=0)
+        self.assertFalse(sampler.filter(self.make_record(logging.INFO)))
+        self.assertTrue(sampler.filter(self.make_record(logging.WARNING)))
+
+
+class BulkImportTests(SurveyFixtureMixin, TestCase):
+    def write_csv(self, rows):
+        fd, path = tempfile.mkstemp(suffix=".csv")
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(prepare_header_row())
+            writer.writerows(rows)
+        return path
+
+    def csv_row(self, user_id, title, annoyance, submitted="2025-03-01 10:00:00"):
+        sliders = [annoyance] + [50] * (len(AudioEvaluation.RATING_FIELDS) - 1)
+        return [user_id, title, 40, "female", 4, "NA", 2.0] + sliders + [submitted]
+
+    def test_csv_import(self):
+        path = self.write_csv([
+            self.csv_row("a1", "File1", 10),
+            self.csv_row("a1", "File2", 20),
+            self.csv_row("a2", "File1", 30),
+            self.csv_row("a2", "Missing", 40),
+            self.csv_row("22", "File2", 70),
+        ])
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command("import_survey_data", path, chunk_size=2, stdout=stdout, stderr=stderr)
+
+        self.assertIn("4 AudioEvaluation", stdout.getvalue())
+        self.assertIn("Skipped 1 rows", stderr.getvalue())
+        self.assertEqual(UserProfile.objects.count(), 3)
+        self.assertEqual(UserProfile.objects.get(user_id="22").age, 22)
+        self.assertEqual(NoiseResponse.objects.count(), 6)
+        self.assertEqual(
+            sorted(NoiseResponse.objects.filter(user__user_id="a1").values_list("rating", flat=True)), [2, 4]
+        )
+
+        evaluation = AudioEvaluation.objects.get(user__user_id="a2")
+        self.assertEqual(evaluation.annoyance, 30)
+        self.assertEqual(evaluation.submitted_at.year, 2025)
+        self.assertIsNotNone(evaluation.iso_pleasant)
+        self.assertFalse(ExportOutbox.objects.exists())
+
+        stats = AudioRatingAggregate.objects.get(audio=self.audio)
+        self.assertEqual((stats.count, stats.annoyance_sum), (2, 40))
+
+    def test_reimport_updates_in_place(self):
+        path = self.write_csv([self.csv_row("a1", "File1", 10)])
+        call_command("import_survey_data", path, stdout=io.StringIO())
+        path = self.write_csv([self.csv_row("a1", "File1", 15)])
+        call_command("import_survey_data", path, export=True, stdout=io.StringIO())
+
+        self.assertEqual(AudioEvaluation.objects.get().annoyance, 15)
+        self.assertEqual(ExportOutbox.objects.count(), 1)
+        self.assertEqual(AudioRatingAggregate.objects.get(audio=self.audio).annoyance_sum, 15)
+
+    def importer_with_rows(self, count, export=False):
+        importer = SurveyImporter(chunk_size=1000, export=export)
+        header = prepare_header_row()
+        importer.csv_columns(header)
+        for n in range(count):
+            importer.add_csv_row(dict(zip(header, map(str, self.csv_row(f"q{count}{export}-{n}", "File1", n)))))
+        return importer
+
+    def test_queries_per_chunk_do_not_grow_with_rows(self):
+        def run(count):
+            importer = self.importer_with_rows(count)
+            with CaptureQueriesContext(connection) as queries:
+                importer.flush()
+            return len(queries)
+
+        self.assertEqual(run(3), run(30))
+
+    def test_export_adds_three_queries_per_chunk(self):
+        plain = self.importer_with_rows(40)
+        with CaptureQueriesContext(connection) as queries:
+            plain.flush()
+        importer = self.importer_with_rows(40, export=True)
+        # the rows with their users and audios, the users' answers, one outbox insert
+        with self.assertNumQueries(len(queries) + 3):
+            importer.flush()
+        self.assertEqual(ExportOutbox.objects.count(), 40)
+
+    def test_bad_cells_skip_their_rows(self):
+        rows = [self.csv_row(f"b{n}", "File1", 10) for n in range(5)]
+        rows[0][7] = "n/a"  # first slider
+        rows[1][4] = "?"  # Q1
+        rows[2][3] = ""  # Gender
+        rows[3][2] = "NA"  # Age
+        path = self.write_csv(rows)
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command("import_survey_data", path, chunk_size=2, stdout=stdout, stderr=stderr)
+
+        self.assertEqual(list(AudioEvaluation.objects.values_list("user__user_id", flat=True)), ["b4"])
+        self.assertEqual(list(UserProfile.objects.filter(user_id__startswith="b").values_list("user_id", flat=True)), ["b4"])
+        for reason in ("non-numeric Annoyance", "non-numeric Q1", "missing Gender", "non-numeric Age"):
+            self.assertIn(f"Skipped 1 rows: {reason}", stderr.getvalue())
+
+    def test_streams_fixture_objects(self):
+        fixture = [
+            {"model": "survey.noisequestion", "pk": 50, "fields": {"number": 9, "text": "A [nested] \"q\""}},
+            {"model": "survey.userprofile", "pk": 40, "fields": {"user_id": "f1", "age": 50, "gender": "male"}},
+            {"model": "survey.noiseresponse", "pk": 60, "fields": {"user": 40, "question": 50, "rating": 3}},
+            {"model": "survey.audioevaluation", "pk": 70, "fields": {
+                "user": 40, "audio": self.audio.pk, "annoyance": 80, "submitted_at": "2024-05-01T08:00:00Z",
+            }},
+        ]
+        text = json.dumps(fixture, indent=2)
+        self.assertEqual(list(iter_json_objects(io.StringIO(text), read_size=7)), fixture)
+        lines = "\n".join(json.dumps(obj) for obj in fixture)
+        self.assertEqual(list(iter_json_objects(io.StringIO(lines), read_size=5)), fixture)
+
+        importer = SurveyImporter(chunk_size=2)
+        for obj in iter_json_objects(io.StringIO(text)):
+            importer.add_fixture_object(obj)
+        result = importer.finish()
+
+        self.assertEqual(result["counts"], {
+            "NoiseQuestion": 1, "UserProfile": 1, "NoiseResponse": 1, "AudioEvaluation": 1,
+        })
+        evaluation = AudioEvaluation.objects.get(user__user_id="f1")
+        self.assertEqual(evaluation.annoyance, 80)
+        self.assertEqual(evaluation.submitted_at.year, 2024)
+        self.assertEqual(NoiseResponse.objects.get(user__user_id="f1").question.number, 9)
+        self.assertFalse(ExportOutbox.objects.exists())
+
+    def test_fixture_pks_never_reach_existing_rows(self):
+        other = UserProfile.objects.create(user_id="other", age=30)
+        fixture = [
+            {"model": "survey.audio", "pk": self.audio.pk, "fields": {"title": "Imported", "file": self.audio2.file.name}},
+            {"model": "survey.userprofile", "pk": other.pk, "fields": {"user_id": "f1", "age": 50}},
+            {"model": "survey.audioevaluation", "pk": 1, "fields": {"user": other.pk, "audio": self.audio.pk}},
+            {"model": "survey.audioevaluation", "pk": 2, "fields": {"user": self.user.pk, "audio": self.audio.pk}},
+        ]
+        importer = SurveyImporter()
+        for obj in fixture:
+            importer.add_fixture_object(obj)
+        result = importer.finish()
+
+        self.assertEqual(result["skipped"], {f"user {self.user.pk} not in the fixture": 1})
+        self.assertEqual(Audio.objects.get(pk=self.audio.pk).title, "File1")
+        evaluation = AudioEvaluation.objects.get()
+        self.assertEqual((evaluation.user.user_id, evaluation.audio.title), ("f1", "Imported"))
+        self.assertFalse(AudioEvaluation.objects.filter(user=other).exists())
+
+    def test_fixture_references_to_missing_rows_are_skipped(self):
+        fixture = [
+            {"model": "survey.userprofile", "pk": 1, "fields": {"user_id": "f1", "age": 50, "gender": "other"}},
+            {"model": "survey.noiseresponse", "pk": 2, "fields": {"user": 1, "question": 9999, "rating": 3}},
+            {"model": "survey.noiseresponse", "pk": 3, "fields": {"user": 1, "question": self.questions[0].pk, "rating": 4}},
+            {"model": "survey.audioevaluation", "pk": 4, "fields": {"user": 1, "audio": 9999}},
+        ]
+        importer = SurveyImporter()
+        for obj in fixture:
+            importer.add_fixture_object(obj)
+        result = importer.finish()
+
+        self.assertEqual(result["skipped"], {"unknown question 9999": 1, "unknown audio 9999": 1})
+        self.assertEqual(NoiseResponse.objects.get(user__user_id="f1").rating, 4)
+
+    def test_reimport_keeps_the_stored_submission_time(self):
+        evaluation = AudioEvaluation.objects.create(user=self.user, audio=self.audio, annoyance=5)
+        path = self.write_csv([self.csv_row("22", "File1", 15, submitted="2020-01-01 00:00:00")])
+        call_command("import_survey_data", path, stdout=io.StringIO())
+
+        evaluation.refresh_from_db()
+        self.assertEqual(evaluation.annoyance, 15)
+        self.assertNotEqual(evaluation.submitted_at.year, 2020)
+
+    def test_loaddata_does_not_export(self):
+        fd, path = tempfile.mkstemp(suffix=".json")
+        with os.fdopen(fd, "w") as f:
+            json.dump([{"model": "survey.audioevaluation", "pk": 90, "fields": {
+                "user": self.user.pk, "audio": self.audio.pk, "annoyance": 1,
+                "submitted_at": "2024-05-01T08:00:00Z",
+            }}], f)
+        self.addCleanup(os.remove, path)
+        call_command("loaddata", path, verbosity=0)
+        self.assertTrue(AudioEvaluation.objects.filter(pk=90).exists())
+        self.assertFalse(ExportOutbox.objects.exists())
+
+
+class SheetSyncTests(SurveyFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.users = self.make_users(3)
+        self.evaluations = [
+            AudioEvaluation.objects.create(user=user, audio=self.audio, annoyance=n)
+            for n, user in enumerate(self.users)
+        ]
+
+    def test_sink_reads_header_once(self):
+        sheet = FakeWorksheet()
+        sink = GoogleSheetsSink(sheet)
+        with self.assertLogs("survey.export", "INFO"):
+            self.assertEqual(drain_outbox(sink, batch_size=1), 1)
+        self.assertEqual(drain_outbox(sink, batch_size=1), 1)
+        self.assertEqual(sheet.calls, ["row_values", "batch_update", "append_rows", "append_rows"])
+        self.assertEqual(sheet.rows[0], prepare_header_row())
+
+    def test_sink_extends_an_old_header(self):
+        header = prepare_header_row()
+        old_header = [name for name in header if name != "Q2"]
+        sheet = FakeWorksheet([old_header])
+        drain_outbox(GoogleSheetsSink(sheet))
+        self.assertEqual(sheet.rows[0], old_header + ["Q2"])
+        row = dict(zip(sheet.rows[0], sheet.rows[1]))
+        self.assertEqual(row["UserID"], "p0")
+        self.assertEqual(row["Q2"], "NA")
+        self.assertEqual(row["SubmittedAt"], self.evaluations[0].submitted_at.strftime("%Y-%m-%d %H:%M:%S"))
+
+    def test_appends_only_missing_rows(self):
+        header = prepare_header_row()
+        present = prepare_data_row(self.evaluations[1])
+        sheet = FakeWorksheet([header, present])
+        # The first row's upload failed for good; the others are still queued.
+        ExportOutbox.objects.filter(evaluation=self.evaluations[0]).update(attempts=9, last_error="quota")
+
+        result = sync_sheet(GoogleSheetsSink(sheet), batch_size=1)
+
+        self.assertEqual(result, {"found": 1, "appended": 2, "delivered": 3})
+        self.assertEqual(sheet.calls, ["get_all_values", "append_rows", "append_rows"])
+        self.assertEqual(
+            sorted(row[0] for row in sheet.rows[1:]), ["p0", "p1", "p2"],
+        )
+        self.assertFalse(ExportOutbox.objects.filter(delivered_at__isnull=True).exists())
+
+        sheet.calls = []
+        self.assertEqual(sync_sheet(GoogleSheetsSink(sheet))["appended"], 0)
+        self.assertEqual(sheet.calls, ["get_all_values"])
+
+    def test_rows_leased_by_a_worker_are_left_to_it(self):
+        sheet = FakeWorksheet([prepare_header_row()])
+        now = timezone.now()
+        sending = claim_outbox(1, now)  # a worker is sending the first row
+        # The second failed and waits out its retry delay: the sync resends it.
+        ExportOutbox.objects.filter(evaluation=self.evaluations[1]).update(
+            attempts=1, next_attempt_at=now + timedelta(minutes=5), last_error="quota",
+        )
+
+        result = sync_sheet(GoogleSheetsSink(sheet))
+
+        self.assertEqual(result, {"found": 0, "appended": 2, "delivered": 2})
+        self.assertEqual(sorted(row[0] for row in sheet.rows[1:]), ["p1", "p2"])
+        self.assertEqual(list(ExportOutbox.objects.filter(delivered_at__isnull=True)), sending)
+        self.assertEqual(drain_outbox(GoogleSheetsSink(sheet)), 0)  # nothing else was left due
+
+        # The worker delivers its row; nothing is sent twice.
+        self.assertEqual(send_rows(GoogleSheetsSink(sheet), prepare_header_row(), sending, now), 1)
+        self.assertEqual(sorted(row[0] for row in sheet.rows[1:]), ["p0", "p1", "p2"])
+
+    def test_sync_fills_an_empty_sheet(self):
+        sheet = FakeWorksheet()
+        self.assertEqual(sync_sheet(GoogleSheetsSink(sheet), dry_run=True)["appended"], 3)
+        self.assertEqual(sheet.rows, [])
+
+        with self.assertLogs("survey.export", "INFO"):
+            result = sync_sheet(GoogleSheetsSink(sheet))
+        self.assertEqual(result["appended"], 3)
+        self.assertEqual(sheet.calls, ["get_all_values", "get_all_values", "batch_update", "append_rows"])
+        self.assertEqual(sheet.rows[0], prepare_header_row())
+        self.assertEqual(len(sheet.rows), 4)
+
+
+@override_settings(SURVEY_UPLOAD_BLOCK_SIZE=100)
+class ChunkedUploadTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        digest_cache.clear()
+        self.client.force_login(User.objects.create_user("staff", password="x", is_staff=True))
+        path = write_wav(os.path.join(self.media_root, "source", "clip.wav"), frames=2000)
+        with open(path, "rb") as f:
+            self.data = f.read()
+
+    def start(self, filename="clip.wav"):
+        response = self.client.post(
+            "/api/uploads/", {"title": "Park", "filename": filename, "size": len(self.data)},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 201)
+        return response.json()["id"]
+
+    def put(self, upload_id, start, end):
+        return self.client.put(
+            f"/api/uploads/{upload_id}/", self.data[start:end], content_type="application/octet-stream",
+            headers={"content-range": f"bytes {start}-{end - 1}/{len(self.data)}"},
+        )
+
+    def test_upload_in_chunks_and_finalize(self):
+        upload_id = self.start()
+        response = self.put(upload_id, 0, 30)
+        self.assertEqual(response.json()["offset"], 30)
+        self.assertIsNone(response.json()["sample_rate"])  # header not complete yet
+
+        response = self.put(upload_id, 30, 3000)
+        self.assertEqual(response.json()["sample_rate"], 44100)
+        self.assertEqual(self.put(upload_id, 30, 60).status_code, 409)
+        self.assertEqual(self.client.post(f"/api/uploads/{upload_id}/finalize/").status_code, 409)
+        self.assertEqual(self.put(upload_id, 3000, len(self.data)).json()["complete"], True)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post(f"/api/uploads/{upload_id}/finalize/")
+        self.assertEqual(response.status_code, 201)
+        audio = Audio.objects.get(pk=response.json()["id"])
+        self.assertIsNone(audio.duration)  # not ingested with the upload locked
+        for callback in callbacks:
+            callback()
+        audio.refresh_from_db()
+        self.assertEqual(audio.title, "Park")
+        self.assertEqual(audio.sha256, hashlib.sha256(self.data).hexdigest())
+        self.assertAlmostEqual(audio.duration, 2000 / 44100)
+        self.assertTrue(audio.peaks.name)
+        with open(audio.file.path, "rb") as f:
+            self.assertEqual(f.read(), self.data)
+
+        again = self.client.post(f"/api/uploads/{upload_id}/finalize/")
+        self.assertEqual(again.json()["id"], audio.pk)
+        self.assertEqual(Audio.objects.count(), 1)
+
+    def test_resume_after_dropped_connection_on_another_worker(self):
+        upload_id = self.start()
+        upload = AudioUpload.objects.get(pk=upload_id)
+        # The client meant to send 5000 bytes but the connection died after 1234.
+        self.assertEqual(write_chunk(upload, 0, 5000, io.BytesIO(self.data[:1234])), 1234)
+        digest_cache.clear()
+
+        state = self.client.get(f"/api/uploads/{upload_id}/").json()
+        self.assertEqual(state["offset"], 1234)
+        self.assertEqual(self.put(upload_id, state["offset"], len(self.data)).status_code, 200)
+        digest_cache.clear()
+        self.client.post(f"/api/uploads/{upload_id}/finalize/")
+        self.assertEqual(AudioUpload.objects.get().sha256, hashlib.sha256(self.data).hexdigest())
+
+    def test_concurrent_chunk_for_the_same_offset_is_refused(self):
+        upload_id = self.start()
+        self.put(upload_id, 0, 100)
+        # Another request holds the offset while it writes.
+        AudioUpload.objects.filter(pk=upload_id).update(writing_until=timezone.now() + timedelta(minutes=1))
+        self.assertEqual(self.put(upload_id, 100, 200).status_code, 409)
+        self.assertEqual(os.path.getsize(os.path.join(self.media_root, AudioUpload.objects.get().file_name)), 100)
+
+        # Its lease ran out (the writer died).
+        AudioUpload.objects.filter(pk=upload_id).update(writing_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.put(upload_id, 100, len(self.data)).json()["complete"], True)
+
+    def test_failed_write_leaves_the_upload_as_it_was(self):
+        upload_id = self.start()
+        self.put(upload_id, 0, 100)
+        upload = AudioUpload.objects.get(pk=upload_id)
+
+        class BrokenStream(io.BytesIO):
+            def read(self, size=-1):
+                if self.tell():
+                    raise OSError("connection reset")
+                return super().read(10)
+
+        with self.assertRaises(OSError):
+            write_chunk(upload, 100, 500, BrokenStream(self.data[100:600]))
+        upload.refresh_from_db()
+        self.assertEqual((upload.received, upload.writing_until), (100, None))
+        self.assertEqual(os.path.getsize(os.path.join(self.media_root, upload.file_name)), 100)
+
+        self.put(upload_id, 100, len(self.data))
+        self.client.post(f"/api/uploads/{upload_id}/finalize/")
+        self.assertEqual(AudioUpload.objects.get().sha256, hashlib.sha256(self.data).hexdigest())
+
+    def test_rejects_non_wav_early(self):
+        self.data = b"ID3" + bytes(5000)
+        upload_id = self.start("song.mp3")
+        response = self.put(upload_id, 0, 100)
+        self.assertEqual(response.status_code, 415)
+        self.assertFalse(AudioUpload.objects.exists())
+        self.assertEqual(os.listdir(os.path.join(self.media_root, "audios")), [])
+
+    def test_validation_and_access(self):
+        response = self.client.post(
+            "/api/uploads/", {"title": "Big", "filename": "a.wav", "size": 10 ** 12}, content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 413)
+        upload_id = self.start()
+        response = self.client.put(
+            f"/api/uploads/{upload_id}/", b"x", content_type="application/octet-stream",
+            headers={"content-range": "bytes 0-0/5"},
+        )
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(self.client.delete(f"/api/uploads/{upload_id}/").status_code, 204)
+        self.assertFalse(AudioUpload.objects.exists())
+
+        self.client.logout()
+        self.assertEqual(self.client.post("/api/uploads/", {}, content_type="application/json").status_code, 302)
+
+
+class ContentAddressedStorageTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        write_wav(os.path.join(self.media_root, "audios", "a.wav"))
+        write_wav(os.path.join(self.media_root, "audios", "b.wav"))
+        self.audio = Audio.objects.create(title="A", file="audios/a.wav")
+
+    def test_identical_clips_share_one_file(self):
+        other = Audio.objects.create(title="B", file="audios/b.wav")
+        sha = self.audio.sha256
+        self.assertEqual(self.audio.file.name, f"audios/{sha[:2]}/{sha}.wav")
+        self.assertEqual(other.file.name, self.audio.file.name)
+        self.assertEqual(Audio.objects.get(pk=other.pk).file.name, self.audio.file.name)
+        self.assertEqual(os.listdir(os.path.join(self.media_root, "audios")), [sha[:2]])
+        self.assertEqual(self.audio.peaks.name, f"peaks/{self.audio.file.name}.peaks")
+
+    def test_versioned_url_is_immutable_and_old_urls_redirect(self):
+        url = stream_path(self.audio)
+        self.assertEqual(url, f"/api/stream-audio/{self.audio.pk}/{self.audio.sha256[:16]}/")
+        self.assertEqual(self.client.get(f"/api/audios/{self.audio.pk}/").data["stream_url"], f"http://testserver{url}")
+
+        response = self.client.get(url, HTTP_RANGE="bytes=0-9")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Cache-Control"], "public, max-age=31536000, immutable")
+
+        response = self.client.get(f"/api/stream-audio/{self.audio.pk}/", {"variant": "low"})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response["Location"], f"{url}?variant=low")
+        self.assertEqual(response["Cache-Control"], "no-cache")
+
+        response = self.client.get(f"/api/async/stream-audio/{self.audio.pk}/")
+        self.assertEqual(response["Location"], stream_path(self.audio, "/api/async/stream-audio/"))
+
+    def test_replaced_file_gets_a_new_version(self):
+        old_url = stream_path(self.audio)
+        write_wav(os.path.join(self.media_root, "audios", "c.wav"), frames=1000)
+        self.audio.file = "audios/c.wav"
+        self.audio.save()
+
+        new_url = stream_path(self.audio)
+        self.assertNotEqual(new_url, old_url)
+        response = self.client.get(old_url)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response["Location"], new_url)
+        self.assertEqual(self.client.get(new_url).status_code, 200)
+
+
+class WriteBehindMixin:
+    def setUp(self):
+        super().setUp()
+        journal_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, journal_dir, ignore_errors=True)
+        journal_settings = override_settings(
+            SURVEY_WRITE_BEHIND=True,
+            SURVEY_WRITE_BEHIND_FLUSHER=False,
+            SURVEY_WRITE_BEHIND_JOURNAL=os.path.join(journal_dir, "journal.sqlite3"),
+        )
+        journal_settings.enable()
+        self.addCleanup(journal_settings.disable)
+        self.journal = get_journal()
+        self.addCleanup(self.journal.close)
+
+
+class WriteBehindTests(WriteBehindMixin, SurveyFixtureMixin, TestCase):
+    def test_submissions_are_acknowledged_then_flushed(self):
+        response = self.client.post("/api/evaluations/", self.evaluation_data(annoyance=40), format="json")
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data["annoyance"], 40)
+        answers = [{"user": self.user.pk, "question": q.pk, "rating": 2} for q in self.questions]
+        response = self.client.post("/api/noise-responses/", answers + [{"user": self.user.pk}], format="json")
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual((response.data["queued"], response.data["errors"][0]["index"]), (3, 3))
+
+        self.assertFalse(AudioEvaluation.objects.exists())
+        self.assertEqual(self.journal.stats()["pending"], 4)
+
+        self.assertEqual(flush_journal(), 4)
+        evaluation = AudioEvaluation.objects.get()
+        self.assertEqual((evaluation.user, evaluation.annoyance), (self.user, 40))
+        self.assertIsNotNone(evaluation.iso_pleasant)
+        self.assertEqual(NoiseResponse.objects.count(), 3)
+        self.assertEqual(ExportOutbox.objects.count(), 1)
+        self.assertEqual(AudioRatingAggregate.objects.get(audio=self.audio).annoyance_sum, 40)
+        self.assertEqual(self.journal.stats()["pending"], 0)
+        self.assertEqual(flush_journal(), 0)
+
+    def test_invalid_submission_is_rejected_before_the_journal(self):
+        response = self.client.post("/api/evaluations/", self.evaluation_data(audio=9999), format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.journal.stats()["pending"], 0)
+
+    def test_replay_after_a_crash_is_idempotent(self):
+        self.client.post("/api/evaluations/", self.evaluation_data(annoyance=40), format="json")
+        # A flusher committed the batch, then died before deleting its entries.
+        entries = self.journal.claim(10, lease=60)
+        write_entries("evaluations", [(pk, payload) for pk, _, payload in entries])
+        self.assertEqual(flush_journal(), 0)  # still leased to the dead flusher
+
+        with override_settings(SURVEY_WRITE_BEHIND_LEASE=0):
+            self.journal.release([pk for pk, _, _ in entries])
+            self.assertEqual(flush_journal(), 1)
+        self.assertEqual(AudioEvaluation.objects.count(), 1)
+        self.assertEqual(ExportOutbox.objects.count(), 1)
+        stats = AudioRatingAggregate.objects.get(audio=self.audio)
+        self.assertEqual((stats.count, stats.annoyance_sum), (1, 40))
+
+    def test_rejected_entry_is_kept_and_the_rest_committed(self):
+        gone = UserProfile.objects.create(user_id="gone", age=40)
+        self.client.post("/api/evaluations/", self.evaluation_data(user=gone.pk), format="json")
+        self.client.post("/api/evaluations/", self.evaluation_data(), format="json")
+        gone.delete()
+
+        with self.assertLogs("survey.journal", "ERROR"):
+            with self.assertNumQueries(12):
+                self.assertEqual(flush_journal(), 2)
+        self.assertEqual(list(AudioEvaluation.objects.values_list("user_id", flat=True)), [self.user.pk])
+        self.assertEqual(self.journal.stats(), {"pending": 0, "oldest_age": 0, "failed": 1})
+
+
+    def test_a_failing_entry_does_not_block_its_batch(self):
+        self.client.post("/api/evaluations/", self.evaluation_data(annoyance=40), format="json")
+        # e.g. queued before a field was renamed
+        self.journal.append("evaluations", [{"user_id": self.user.pk, "audio_id": self.audio2.pk, "loudness": 3}])
+        self.client.post("/api/evaluations/", self.evaluation_data(user=self.make_users(1)[0].pk), format="json")
+
+        with self.assertLogs("survey.journal", "WARNING") as logs:
+            self.assertEqual(flush_journal(), 3)
+        self.assertIn("TypeError", logs.output[-1])
+        self.assertEqual(AudioEvaluation.objects.filter(audio=self.audio).count(), 2)
+        self.assertEqual(self.journal.stats(), {"pending": 0, "oldest_age": 0, "failed": 1})
+        self.assertEqual(flush_journal(), 0)
+
+    def test_flusher_starts_with_servers_only(self):
+        code = (
+            "import django\n"
+            "django.setup()\n"
+            "{}\n"
+            "from survey import journal\n"
+            "print(journal._flusher is not None)\n"
+        )
+        env = {
+            **os.environ, "DJANGO_SETTINGS_MODULE": "audioupload.settings", "SURVEY_WRITE_BEHIND": "1",
+            "SURVEY_WRITE_BEHIND_JOURNAL": os.path.join(self.media_root, "journal.sqlite3"),
+            "DATABASE_URL": f"sqlite:///{os.path.join(self.media_root, 'db.sqlite3')}",
+        }
+        base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        for entry_point, expected in [
+            ("import audioupload.wsgi", "True"),
+            ("import audioupload.asgi", "True"),
+            ("from django.core.management import call_command; call_command('check')", "False"),
+        ]:
+            result = subprocess.run(
+                [sys.executable, "-c", code.format(entry_point)], cwd=base_dir,
+                env=env, capture_output=True, text=True, check=True,
+            )
+            self.assertEqual(result.stdout.split()[-1], expected, entry_point)
+
+@override_settings(SURVEY_READ_REPLICAS=["replica"], SURVEY_REPLICA_LAG=5)
+class ReplicaRoutingTests(SurveyFixtureMixin, TransactionTestCase):
+    # `replica` mirrors the test database, on its own connection.
+    databases = {"default", "replica"}
+
+    def setUp(self):
+        super().setUp()
+        # The fixture catalog changed long ago, past the replica lag.
+        os.utime(catalog_version_path(), (0, 0))
+
+    def survey_queries(self, context):
+        return [query["sql"] for query in context.captured_queries if '"survey_' in query["sql"]]
+
+    def request(self, method, path, **kwargs):
+        with CaptureQueriesContext(connections["default"]) as primary, \
+                CaptureQueriesContext(connections["replica"]) as replica:
+            response = getattr(self.client, method)(path, **kwargs)
+            if response.streaming:
+                b"".join(response.streaming_content)
+        return response, self.survey_queries(primary), self.survey_queries(replica)
+
+    def test_reads_outside_a_scope_use_the_primary(self):
+        self.assertEqual(router.db_for_read(Audio), "default")
+        with replica_reads():
+            self.assertEqual(router.db_for_read(Audio), "replica")
+            self.assertEqual(router.db_for_read(User), "default")  # only SURVEY_REPLICA_APPS
+            with primary_reads():
+                self.assertEqual(router.db_for_read(Audio), "default")
+        self.assertEqual(router.db_for_write(Audio), "default")
+
+    def test_catalog_and_stats_reads_go_to_the_replica(self):
+        cache.clear()
+        response, primary, replica = self.request("get", "/api/audios/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 2)
+        self.assertEqual(primary, [])
+        self.assertTrue(replica)
+
+        response, primary, replica = self.request("get", "/api/stats/audios/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(primary, [])
+        self.assertTrue(replica)
+
+    def test_catalog_is_built_from_the_primary_right_after_a_change(self):
+        write_wav(os.path.join(self.media_root, "audios", "CG05.wav"))
+        Audio.objects.filter(pk=self.audio2.pk).delete()
+        Audio.objects.create(title="File3", file="audios/CG05.wav")
+
+        response, primary, replica = self.request("get", "/api/audios/")
+        self.assertEqual([audio["title"] for audio in response.json()], ["File1", "File3"])
+        self.assertTrue(primary)
+        self.assertEqual(replica, [])
+
+    def test_streamed_export_reads_from_the_replica(self):
+        AudioEvaluation.objects.create(**{**self.evaluation_data(), "user": self.user, "audio": self.audio})
+        self.client.force_login(User.objects.create_user("staff", password="x", is_staff=True))
+
+        response, primary, replica = self.request("get", "/api/export/research/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(primary, [])
+        self.assertTrue(any("survey_audioevaluation" in sql for sql in replica))
+
+    def test_writes_stay_on_the_primary_and_the_writer_sticks_to_it(self):
+        response, primary, replica = self.request(
+            "post", "/api/noise-responses/",
+            data={"user": self.user.pk, "question": self.questions[0].pk, "rating": 3}, format="json",
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(primary)
+        self.assertEqual(replica, [])
+        self.assertEqual(response.cookies[STICKY_COOKIE]["max-age"], 5)
+
+        cache.clear()
+        _, primary, replica = self.request("get", "/api/audios/")
+        self.assertTrue(primary)
+        self.assertEqual(replica, [])
+
+        del self.client.cookies[STICKY_COOKIE]
+        cache.clear()
+        _, primary, replica = self.request("get", "/api/audios/")
+        self.assertEqual(primary, [])
+        self.assertTrue(replica)
+
+    def test_upload_resume_offset_is_read_from_the_primary(self):
+        upload = start_upload("Park", "clip.wav", 100)
+        self.client.force_login(User.objects.create_user("staff", password="x", is_staff=True))
+
+        response, primary, replica = self.request("get", f"/api/uploads/{upload.pk}/")  # no sticky cookie
+        self.assertEqual(response.json()["offset"], 0)
+        self.assertTrue(any("survey_audioupload" in sql for sql in primary))
+        self.assertEqual(replica, [])
+
+    def test_a_write_switches_the_rest_of_the_scope_to_the_primary(self):
+        with replica_reads():
+            self.assertEqual(Audio.objects.using(router.db_for_read(Audio)).count(), 2)
+            UserProfile.objects.create(user_id="new", age=30)
+            self.assertEqual(router.db_for_read(UserProfile), "default")
+        with replica_reads():
+            self.assertEqual(router.db_for_read(UserProfile), "replica")
+
+
+class LazySheetsClientTests(unittest.TestCase):
+    def setUp(self):
+        export._sheets_client = None
+        self.addCleanup(setattr, export, "_sheets_client", None)
+        creds = base64.b64encode(json.dumps({"type": "service_account"}).encode()).decode()
+        environment = mock.patch.dict(os.environ, {"GOOGLE_CREDENTIALS_JSON": creds, "GOOGLE_SHEET_ID": "sheet-id"})
+        environment.start()
+        self.addCleanup(environment.stop)
+
+    def test_startup_does_not_import_the_sheets_stack(self):
+        code = (
+            "import sys\n"
+            "from django.core.wsgi import get_wsgi_application\n"
+            "get_wsgi_application()\n"
+            "from django.urls import resolve\n"
+            "resolve('/api/audios/')\n"
+            "print(sorted(m for m in sys.modules if m.split('.')[0] in ('gspread', 'oauth2client', 'dotenv')))\n"
+        )
+        env = {**os.environ, "DJANGO_SETTINGS_MODULE": "audioupload.settings"}
+        result = subprocess.run(
+            [sys.executable, "-c", code], cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            env=env, capture_output=True, text=True, check=True,
+        )
+        self.assertEqual(result.stdout.strip().splitlines()[-1], "[]")
+
+    def test_client_is_authorized_once_and_reused(self):
+        client = mock.Mock()
+        client.open_by_key.return_value.sheet1 = FakeWorksheet()
+        with mock.patch("gspread.authorize", return_value=client) as authorize, \
+                mock.patch("oauth2client.service_account.ServiceAccountCredentials.from_json_keyfile_dict"):
+            GoogleSheetsSink().get_sheet()
+            GoogleSheetsSink().get_sheet()
+        self.assertEqual(authorize.call_count, 1)
+        self.assertEqual(client.open_by_key.call_count, 2)
+
+    def test_bad_credentials(self):
+        os.environ["GOOGLE_CREDENTIALS_JSON"] = "not base64"
+        with self.assertRaises(ExportError):
+            GoogleSheetsSink().get_sheet()
+        del os.environ["GOOGLE_SHEET_ID"]
+        with self.assertRaises(ExportError):
+            GoogleSheetsSink().get_sheet()
+
+
+
+class LoadTestSmokeTests(unittest.TestCase):
+    def test_client_target_completes_sessions(self):
+        base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        output = os.path.join(tempfile.mkdtemp(), "run.json")
+        self.addCleanup(shutil.rmtree, os.path.dirname(output))
+        subprocess.run(
+            [sys.executable, os.path.join("benchmarks", "loadtest.py"), "--target", "client",
+             "--participants", "2", "--concurrency", "2", "--clips", "1", "--questions", "2",
+             "--seconds", "1", "--output", output],
+            cwd=base_dir, capture_output=True, text=True, check=True,
+        )
+        with open(output) as f:
+            result = json.load(f)
+        self.assertEqual((result["sessions_completed"], result["sessions_failed"]), (2, 0))
+        self.assertEqual(sum(entry["errors"] for entry in result["endpoints"].values()), 0)
+        self.assertEqual(result["export"]["rows"], 2)
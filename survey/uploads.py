@@ -0,0 +1,298 @@
+"""
+Resumable, chunked uploads of audio clips.
+
+POST /api/uploads/ registers an AudioUpload and reserves its file under
+MEDIA_ROOT/audios/. Every PUT carries the next bytes with
+`Content-Range: bytes <start>-<end>/<size>`. The body is copied straight
+into that file in SURVEY_UPLOAD_BLOCK_SIZE blocks, so memory use does not
+depend on the size of the clip. A chunk must start at the current
+offset; after a dropped connection, GET the upload to learn where to
+resume. POST .../finalize/ creates the Audio row.
+
+The SHA-256 is updated as the bytes arrive. The running digest lives in a
+per-process LRU; a chunk that lands on another worker re-hashes the
+bytes already on disk once. A PUT leases the offset before it writes, so
+concurrent PUTs for the same offset get 409 instead of interleaving their
+bytes. The WAV header is parsed as soon as it is
+complete, so a file that is not a WAV is rejected early in the upload,
+not after it finishes.
+"""
+import os
+import re
+import struct
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.text import get_valid_filename
+
+from .models import Audio, AudioUpload
+from .audio import parse_wav_header, WavError
+
+
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+
+class UploadError(ValueError):
+    status = 400
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        if status is not None:
+            self.status = status
+
+
+class UploadConflict(UploadError):
+    """
+    The chunk does not start at the upload's current offset.
+    """
+    status = 409
+
+
+def audio_storage():
+    return Audio._meta.get_field('file').storage
+
+
+def parse_content_range(value, size):
+    """
+    (start, length) of a `bytes <start>-<end>/<size>` header for this upload.
+    """
+    match = CONTENT_RANGE_RE.match((value or '').strip())
+    if not match:
+        raise UploadError("Content-Range must be 'bytes <start>-<end>/<size>'")
+    start, end, total = map(int, match.groups())
+    if total != size or end < start or end >= size:
+        raise UploadError(f"Content-Range does not fit an upload of {size} bytes", status=416)
+    return start, end - start + 1
+
+
+class DigestCache:
+    """
+    Per-process LRU of running SHA-256 objects, keyed by upload id, each
+    with the number of bytes it has consumed.
+    """
+
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, upload):
+        """
+        Removes and returns the digest of the upload's first `received`
+        bytes, re-reading them from disk if this process does not have it.
+        """
+        with self._lock:
+            entry = self._entries.pop(upload.pk, None)
+        if entry is not None and entry[0] == upload.received:
+            return entry[1]
+
+        digest = hashlib.sha256()
+        remaining = upload.received
+        block_size = settings.SURVEY_UPLOAD_BLOCK_SIZE
+        with open(audio_storage().path(upload.file_name), 'rb') as f:
+            while remaining:
+                block = f.read(min(block_size, remaining))
+                if not block:
+                    raise UploadError("Upload file is shorter than its recorded offset", status=409)
+                digest.update(block)
+                remaining -= len(block)
+        return digest
+
+    def put(self, upload_id, offset, digest):
+        with self._lock:
+            self._entries[upload_id] = (offset, digest)
+            self._entries.move_to_end(upload_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, upload_id):
+        with self._lock:
+            self._entries.pop(upload_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+digest_cache = DigestCache()
+
+
+def start_upload(title, filename, size):
+    title = (title or '').strip()
+    if not title:
+        raise UploadError("title is required")
+    if not isinstance(size, int) or size <= 0:
+        raise UploadError("size must be a positive integer")
+    if size > settings.SURVEY_UPLOAD_MAX_BYTES:
+        raise UploadError(f"Uploads are limited to {settings.SURVEY_UPLOAD_MAX_BYTES} bytes", status=413)
+
+    name = get_valid_filename(os.path.basename(filename or '')) or 'upload.wav'
+    # Reserves a unique name; the chunks are written into this file.
+    file_name = audio_storage().save(f'audios/{name}', ContentFile(b''))
+    return AudioUpload.objects.create(title=title[:100], file_name=file_name, size=size)
+
+
+def write_chunk(upload, start, length, stream):
+    """
+    Copies `length` bytes from `stream` into the upload at `start`, which
+    must be the current offset. If the stream ends early, whatever arrived
+    is kept and the client resumes from the new offset. If reading or
+    writing fails, the upload is left as it was before the chunk.
+    """
+    if upload.audio_id:
+        raise UploadError("Upload is already finalized", status=409)
+    if start != upload.received:
+        raise UploadConflict(f"Expected a chunk starting at {upload.received}")
+
+    claim = claim_offset(upload, start)
+    path = audio_storage().path(upload.file_name)
+    block_size = settings.SURVEY_UPLOAD_BLOCK_SIZE
+    written = 0
+    try:
+        digest = digest_cache.take(upload)
+        with open(path, 'r+b') as f:
+            f.seek(start)
+            f.truncate()  # drop anything a failed writer left past the offset
+            while written < length:
+                block = stream.read(min(block_size, length - written))
+                if not block:
+                    break
+                f.write(block)
+                digest.update(block)
+                written += len(block)
+    except BaseException:
+        digest_cache.discard(upload.pk)
+        with open(path, 'r+b') as f:
+            f.truncate(start)
+        AudioUpload.objects.filter(pk=upload.pk, writing_until=claim).update(writing_until=None)
+        raise
+
+    offset = start + written
+    updated = AudioUpload.objects.filter(pk=upload.pk, writing_until=claim).update(
+        received=offset, writing_until=None, updated_at=timezone.now(),
+    )
+    if not updated:
+        digest_cache.discard(upload.pk)
+        raise UploadConflict("The chunk outlived its write lease; resume from the current offset")
+    upload.received = offset
+    digest_cache.put(upload.pk, offset, digest)
+
+    if upload.sample_rate is None:
+        read_header(upload)
+    return written
+
+
+def claim_offset(upload, start):
+    """
+    Leases the upload's offset to this writer before any byte is written,
+    so two PUTs for the same offset cannot both write into the file. The
+    lease expires after SURVEY_UPLOAD_WRITE_LEASE seconds in case the
+    writer died. Returns the lease, which identifies the claim.
+    """
+    now = timezone.now()
+    claim = now + timedelta(seconds=settings.SURVEY_UPLOAD_WRITE_LEASE)
+    claimed = AudioUpload.objects.filter(
+        Q(writing_until__isnull=True) | Q(writing_until__lt=now),
+        pk=upload.pk, received=start, audio__isnull=True,
+    ).update(writing_until=claim)
+    if not claimed:
+        raise UploadConflict("Another chunk is being written or was written concurrently")
+    return claim
+
+
+def read_header(upload):
+    """
+    Fills the WAV fields once the header has arrived. Uploads that are not
+    PCM/float WAV are deleted.
+    """
+    path = audio_storage().path(upload.file_name)
+    try:
+        with open(path, 'rb') as f:
+            info = parse_wav_header(f, file_size=upload.size)
+    except EOFError as e:
+        if upload.received < upload.size:
+            return None  # the rest of the header is still to come
+        error = e
+    except (WavError, struct.error) as e:
+        error = e
+    else:
+        upload.duration = info.duration
+        upload.sample_rate = info.sample_rate
+        upload.channels = info.channels
+        AudioUpload.objects.filter(pk=upload.pk).update(
+            duration=info.duration, sample_rate=info.sample_rate, channels=info.channels,
+        )
+        return info
+
+    abort_upload(upload)
+    raise UploadError(f"Not a supported WAV file: {error}", status=415)
+
+
+def finalize_upload(upload_id):
+    """
+    Creates the Audio row for a complete upload and returns it. Finalizing
+    again returns the same Audio. The clip is ingested and its variants are
+    rendered after the row is committed, with the upload's lock released.
+    """
+    with transaction.atomic():
+        upload = AudioUpload.objects.select_for_update().get(pk=upload_id)
+        if upload.audio_id:
+            return upload.audio
+        if upload.received != upload.size:
+            raise UploadConflict(f"Upload is incomplete: {upload.received} of {upload.size} bytes")
+        if upload.sample_rate is None:
+            raise UploadError("Upload is not a WAV file", status=415)
+
+        upload.sha256 = digest_cache.take(upload).hexdigest()
+        audio = Audio(title=upload.title, file=upload.file_name)
+        audio._known_sha256 = upload.sha256  # ingest builds the peaks but skips re-hashing
+        audio._ingest_on_commit = True
+        audio.save()
+        upload.audio = audio
+        upload.save(update_fields=['audio', 'sha256', 'updated_at'])
+    return audio
+
+
+def abort_upload(upload):
+    digest_cache.discard(upload.pk)
+    if not upload.audio_id:
+        audio_storage().delete(upload.file_name)
+    upload.delete()
+
+
+def purge_stale_uploads(max_age=None):
+    """
+    Deletes unfinished uploads (and their partial files) not written to for
+    `max_age` seconds. Returns how many were removed.
+    """
+    max_age = settings.SURVEY_UPLOAD_EXPIRY if max_age is None else max_age
+    stale = AudioUpload.objects.filter(
+        audio__isnull=True, updated_at__lt=timezone.now() - timedelta(seconds=max_age),
+    )
+    count = 0
+    for upload in stale.iterator():
+        abort_upload(upload)
+        count += 1
+    return count
+
+
+def upload_state(upload):
+    return {
+        'id': str(upload.pk),
+        'title': upload.title,
+        'size': upload.size,
+        'offset': upload.received,
+        'complete': upload.received == upload.size,
+        'duration': upload.duration,
+        'sample_rate': upload.sample_rate,
+        'channels': upload.channels,
+        'sha256': upload.sha256 or None,
+        'audio': upload.audio_id,
+    }
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import (
@@ -6,8 +7,16 @@ from .views import (
     NoiseQuestionViewSet,
     NoiseResponseViewSet,
     AudioEvaluationViewSet,
-    AudioStreamView
-    
+    AudioStatsViewSet,
+    BootstrapView,
+    AudioStreamView,
+    AudioCacheStatsView,
+    ResearchExportView,
+    AudioUploadView,
+    AudioUploadChunkView,
+    AudioUploadFinalizeView,
+    AsyncAudioStreamView,
+    AsyncSubmissionView,
 )
 
 router = DefaultRouter()
@@ -16,8 +25,26 @@ router.register(r'audios', AudioViewSet)
 router.register(r'noise-questions', NoiseQuestionViewSet)
 router.register(r'noise-responses', NoiseResponseViewSet)
 router.register(r'evaluations', AudioEvaluationViewSet)
+router.register(r'stats/audios', AudioStatsViewSet)
+
+# The stream_url handed out for every clip; under ASGI the sync view's body would be buffered.
+StreamView = AsyncAudioStreamView if settings.SURVEY_ASYNC_STREAMING else AudioStreamView
 
 urlpatterns = [
     path('', include(router.urls)),
-    path('stream-audio/<int:audio_id>/', AudioStreamView.as_view(), name='stream-audio'),  
+    path('bootstrap/', BootstrapView.as_view(), name='bootstrap'),
+    path('stream-audio/<int:audio_id>/', StreamView.as_view(), name='stream-audio'),
+    path('stream-audio/<int:audio_id>/<slug:version>/', StreamView.as_view(), name='stream-audio-version'),
+    path('stream-audio/cache-stats/', AudioCacheStatsView.as_view(), name='stream-audio-cache-stats'),
+    path('export/research/', ResearchExportView.as_view(), name='research-export'),
+    path('uploads/', AudioUploadView.as_view(), name='audio-upload'),
+    path('uploads/<uuid:upload_id>/', AudioUploadChunkView.as_view(), name='audio-upload-chunk'),
+    path('uploads/<uuid:upload_id>/finalize/', AudioUploadFinalizeView.as_view(), name='audio-upload-finalize'),
+
+    # Async variants for ASGI deployments (see audioupload/asgi.py)
+    path('async/stream-audio/<int:audio_id>/', AsyncAudioStreamView.as_view(), name='async-stream-audio'),
+    path('async/stream-audio/<int:audio_id>/<slug:version>/', AsyncAudioStreamView.as_view(),
+         name='async-stream-audio-version'),
+    path('async/noise-responses/', AsyncSubmissionView.as_view(viewset=NoiseResponseViewSet), name='async-noise-responses'),
+    path('async/evaluations/', AsyncSubmissionView.as_view(viewset=AudioEvaluationViewSet), name='async-evaluations'),
 ]
@@ -0,0 +1,149 @@
+"""
+Lower-bitrate derivatives of the source WAVs, built with NumPy only (no ffmpeg).
+
+Variants are defined in SURVEY_AUDIO_VARIANTS and stored on disk as
+variants/<source sha256>/<variant>.wav, so a replaced source file gets new
+variants and unchanged sources are never re-encoded. They are rendered when
+a clip is ingested, or by `manage.py build_audio_variants`, never while a
+stream request waits. The original file stays the default for
+research-grade playback.
+"""
+import io
+import os
+import wave
+import tempfile
+
+import numpy as np
+from django.conf import settings
+from django.core.files.storage import default_storage
+
+from .audio import read_wav_info, load_samples, file_sha256
+
+
+class UnknownVariant(ValueError):
+    pass
+
+
+def resample(samples, source_rate, target_rate):
+    """
+    Band-limited resampling of (frames, channels) samples by truncating or
+    zero-padding the spectrum, vectorized over channels.
+    """
+    if source_rate == target_rate or not len(samples):
+        return samples
+    frames = len(samples)
+    target_frames = max(1, int(round(frames * target_rate / source_rate)))
+    spectrum = np.fft.rfft(samples, axis=0)
+    bins = target_frames // 2 + 1
+    if bins <= spectrum.shape[0]:
+        spectrum = spectrum[:bins]
+    else:
+        spectrum = np.concatenate([
+            spectrum,
+            np.zeros((bins - spectrum.shape[0], spectrum.shape[1]), dtype=spectrum.dtype),
+        ])
+    out = np.fft.irfft(spectrum, n=target_frames, axis=0) * (target_frames / frames)
+    return out.astype(np.float32)
+
+
+def render_variant(path, spec):
+    """
+    Returns the WAV bytes of `path` rendered according to a variant spec:
+    channels (1 downmixes), sample_rate, and optional preview `seconds`.
+    Output is always 16-bit PCM.
+    """
+    info = read_wav_info(path)
+    samples = load_samples(path, info)
+    rate = info.sample_rate
+
+    seconds = spec.get('seconds')
+    if seconds:
+        samples = samples[:int(seconds * rate)]
+
+    channels = spec.get('channels', info.channels)
+    if channels == 1 and samples.shape[1] > 1:
+        samples = samples.mean(axis=1, keepdims=True)
+
+    target_rate = spec.get('sample_rate', rate)
+    samples = resample(samples, rate, target_rate)
+
+    if seconds:
+        # Short fade-out so the cut does not click.
+        fade = min(len(samples), int(0.05 * target_rate))
+        if fade:
+            samples[-fade:] *= np.linspace(1.0, 0.0, fade, dtype=np.float32)[:, None]
+
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype('<i2')
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as f:
+        f.setnchannels(pcm.shape[1])
+        f.setsampwidth(2)
+        f.setframerate(target_rate)
+        f.writeframes(pcm.tobytes())
+    return buffer.getvalue()
+
+
+def variant_name(audio, variant):
+    return f"variants/{audio.sha256}/{variant}.wav"
+
+
+def variant_spec(variant):
+    spec = settings.SURVEY_AUDIO_VARIANTS.get(variant)
+    if spec is None:
+        raise UnknownVariant(variant)
+    return spec
+
+
+def get_variant(audio, variant):
+    """
+    Storage name of `variant` for `audio` if it has been rendered, else None.
+    """
+    variant_spec(variant)
+    if not audio.sha256:
+        return None
+    name = variant_name(audio, variant)
+    return name if default_storage.exists(name) else None
+
+
+def build_variant(audio, variant):
+    """
+    Renders `variant` for `audio` unless it is already stored, and returns
+    its storage name.
+    """
+    spec = variant_spec(variant)
+
+    if not audio.sha256:
+        audio.sha256 = file_sha256(audio.file.path)
+        type(audio).objects.filter(pk=audio.pk).update(sha256=audio.sha256)
+
+    name = variant_name(audio, variant)
+    path = default_storage.path(name)
+    if not os.path.exists(path):
+        data = render_variant(audio.file.path, spec)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename so a concurrent reader never sees half a file.
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    return name
+
+
+def build_variants(audio):
+    return [build_variant(audio, variant) for variant in settings.SURVEY_AUDIO_VARIANTS]
+
+
+def choose_variant(request):
+    """
+    The variant asked for with ?variant=, else one picked from client hints
+    (Save-Data, ECT), else None for the original file.
+    """
+    requested = request.GET.get('variant')
+    if requested:
+        return None if requested == 'original' else requested
+
+    save_data = request.META.get('HTTP_SAVE_DATA', '').strip().lower() == 'on'
+    slow = request.META.get('HTTP_ECT', '').strip().lower() in ('slow-2g', '2g', '3g')
+    if save_data or slow:
+        return settings.SURVEY_AUDIO_SAVE_DATA_VARIANT
+    return None
@@ -1,20 +1,215 @@
 from rest_framework import viewsets, status
-from .models import UserProfile, Audio, NoiseQuestion, NoiseResponse, AudioEvaluation
+from .models import UserProfile, Audio, NoiseQuestion, NoiseResponse, AudioEvaluation, AudioRatingAggregate, AudioUpload
+from .export import enqueue_evaluations, refresh_pending_exports
+from .stats import apply_evaluations
+from .soundscape import fill_iso_coordinates, soundscape_distribution
+from .research_export import iter_csv, write_parquet, ParquetUnavailable
+from .metrics import registry
+from . import journal
+from .routers import primary_reads, stream_reads
+from .uploads import (
+    UploadError,
+    start_upload,
+    write_chunk,
+    finalize_upload,
+    abort_upload,
+    parse_content_range,
+    upload_state,
+)
+from .catalog import get_catalog_entry, build_bootstrap, add_catalog_headers
+from .variants import choose_variant, get_variant, UnknownVariant
+from .audio import audio_version, stream_path
+from .streaming import (
+    file_info_cache,
+    mmap_cache,
+    if_range_matches,
+    parse_range_header,
+    iter_range,
+    aiter_range,
+    MultipartByteranges,
+)
 from .serializers import (
+    BulkPrimaryKeyRelatedField,
     UserProfileSerializer,
     AudioSerializer,
     NoiseQuestionSerializer,
     NoiseResponseSerializer,
-    AudioEvaluationSerializer
+    AudioEvaluationSerializer,
+    AudioRatingStatsSerializer,
 )
+from rest_framework.decorators import action
+from rest_framework.exceptions import ParseError, ValidationError
+from rest_framework.generics import get_object_or_404
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
-from django.http import StreamingHttpResponse, HttpResponse, Http404
+from django.conf import settings
+from django.http import (
+    JsonResponse, StreamingHttpResponse, FileResponse, HttpResponse, HttpResponseBadRequest, HttpResponseRedirect, Http404,
+)
 from django.views import View
-from wsgiref.util import FileWrapper
-import os
-import mimetypes
-import re
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt
+from django.contrib.admin.views.decorators import staff_member_required
+from asgiref.sync import sync_to_async
+from django.db import connection, transaction
+from django.core.files.storage import default_storage
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from urllib.parse import quote
+import json
+import logging
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+
+class BulkCreateMixin:
+    """
+    Lets a create endpoint take a JSON list as well as a single object.
+    Items are validated together, the valid ones are written with one
+    bulk_create in a single transaction and invalid ones are reported by index.
+
+    With `unique_fields` set, every write is an upsert on that natural key
+    (INSERT ... ON CONFLICT DO UPDATE of `update_fields`), so a retried
+    submission answers the same as the original and never adds rows.
+
+    With SURVEY_WRITE_BEHIND on, endpoints with a `journal_kind` append the
+    validated rows to the journal and answer 202 (see survey/journal.py).
+    """
+    unique_fields = None
+    update_fields = None
+    journal_kind = None
+
+    def create(self, request, *args, **kwargs):
+        if isinstance(request.data, list):
+            return self.bulk_create(request)
+        if self.writes_behind():
+            serializer = self.get_serializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            model = self.get_serializer_class().Meta.model
+            self.write_behind([model(**serializer.validated_data)])
+            return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+        return super().create(request, *args, **kwargs)
+
+    def writes_behind(self):
+        return bool(self.journal_kind) and journal.enabled()
+
+    def write_behind(self, objs):
+        journal.get_journal().append(self.journal_kind, [
+            {field: getattr(obj, field) for field in self.journal_fields()} for obj in objs
+        ])
+        journal.start_flusher()
+
+    def journal_fields(self):
+        # Column names (user_id, audio_id, rating...) of what the serializer accepts.
+        model = self.get_serializer_class().Meta.model
+        serializer = self.get_serializer()
+        return [
+            model._meta.get_field(name).attname
+            for name, field in serializer.fields.items() if not field.read_only
+        ]
+
+    def perform_create(self, serializer):
+        if not self.unique_fields:
+            return super().perform_create(serializer)
+        model = self.get_serializer_class().Meta.model
+        with transaction.atomic():
+            serializer.instance = self.perform_bulk_create([model(**serializer.validated_data)])[0]
+
+    def natural_key(self, obj):
+        return tuple(getattr(obj, f'{field}_id') for field in self.unique_fields)
+
+    def dedupe(self, objs):
+        # ON CONFLICT cannot touch the same row twice in one statement; the last item wins.
+        return list({self.natural_key(obj): obj for obj in objs}.values())
+
+    def upsert(self, objs):
+        return self.get_queryset().model.objects.bulk_create(
+            self.dedupe(objs),
+            update_conflicts=True,
+            unique_fields=self.unique_fields,
+            update_fields=self.update_fields,
+        )
+
+    def get_preloaded(self, items):
+        # One query per foreign key field for the whole list.
+        preloaded = {}
+        serializer = self.get_serializer()
+        for name, field in serializer.fields.items():
+            if not isinstance(field, BulkPrimaryKeyRelatedField) or field.read_only:
+                continue
+            pk_field = field.get_queryset().model._meta.pk
+            pks = set()
+            for item in items:
+                if not isinstance(item, dict) or item.get(name) is None:
+                    continue
+                try:
+                    pks.add(pk_field.to_python(item[name]))
+                except Exception:
+                    pass
+            preloaded[name] = field.get_queryset().in_bulk(pks)
+        return preloaded
+
+    def bulk_create(self, request):
+        items = request.data
+        if not items:
+            return Response({"error": "Expected a non-empty list."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > settings.SURVEY_BULK_MAX_ITEMS:
+            return Response(
+                {"error": f"At most {settings.SURVEY_BULK_MAX_ITEMS} items per request."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        context = self.get_serializer_context()
+        context["preloaded"] = self.get_preloaded(items)
+        model = self.get_serializer_class().Meta.model
+
+        objs, errors = [], []
+        for index, item in enumerate(items):
+            serializer = self.get_serializer(data=item, context=context)
+            if serializer.is_valid():
+                objs.append(model(**serializer.validated_data))
+            else:
+                errors.append({"index": index, "errors": serializer.errors})
+
+        if objs and self.writes_behind():
+            self.write_behind(objs)
+            return Response(
+                {"queued": len(objs), "errors": errors},
+                status=status.HTTP_202_ACCEPTED,
+            )
+        if objs:
+            with transaction.atomic():
+                objs = self.perform_bulk_create(objs)
+
+        return Response(
+            {"created": len(objs), "errors": errors},
+            status=status.HTTP_201_CREATED if objs else status.HTTP_400_BAD_REQUEST,
+        )
+
+    def perform_bulk_create(self, objs):
+        if self.unique_fields:
+            return self.upsert(objs)
+        return self.get_queryset().model.objects.bulk_create(objs)
+
+
+class CachedCatalogListMixin:
+    """
+    Serves `list` from the catalog cache with a content-hash ETag, answering
+    If-None-Match with 304.
+    """
+    catalog_name = None
+
+    def list(self, request, *args, **kwargs):
+        data, _, etag = get_catalog_entry(
+            self.catalog_name,
+            request,
+            lambda: self.get_serializer(self.filter_queryset(self.get_queryset()), many=True).data,
+        )
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = Response(data)
+        return add_catalog_headers(response, etag)
+
 
 class UserProfileViewSet(viewsets.ModelViewSet):
     queryset = UserProfile.objects.all()
@@ -25,95 +220,509 @@ class UserProfileViewSet(viewsets.ModelViewSet):
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         if not serializer.is_valid():
-            print("❌ Serializer errors:", serializer.errors)
+            logger.info("Profile rejected", extra={'errors': serializer.errors})
             return Response(serializer.errors, status=400)
         return super().create(request, *args, **kwargs)
     
-class AudioViewSet(viewsets.ReadOnlyModelViewSet):
+class AudioViewSet(CachedCatalogListMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Audio.objects.all()
     serializer_class = AudioSerializer
+    catalog_name = "audios"
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
         context["request"] = self.request
         return context
+
+    @action(detail=True, methods=['get'])
+    def peaks(self, request, pk=None):
+        """
+        Waveform peaks sidecar: int8 (min, max) pairs, SURVEY_PEAKS_PER_SECOND per second.
+        """
+        audio = self.get_object()
+        if not audio.peaks:
+            raise Http404("Peaks not computed yet")
+        response = FileResponse(audio.peaks.open('rb'), content_type='application/octet-stream')
+        response['X-Peaks-Per-Second'] = str(settings.SURVEY_PEAKS_PER_SECOND)
+        response['Access-Control-Allow-Origin'] = '*'
+        response['Access-Control-Expose-Headers'] = 'X-Peaks-Per-Second'
+        return response
     
-class NoiseQuestionViewSet(viewsets.ReadOnlyModelViewSet):
+class NoiseQuestionViewSet(CachedCatalogListMixin, viewsets.ReadOnlyModelViewSet):
     queryset = NoiseQuestion.objects.all()
     serializer_class = NoiseQuestionSerializer
+    catalog_name = "noise-questions"
+
 
-class NoiseResponseViewSet(viewsets.ModelViewSet):
+class BootstrapView(View):
+    """
+    Everything a participant page needs up front (audios and noise questions)
+    in one pre-serialized, cacheable JSON payload.
+    """
+
+    def get(self, request):
+        _, payload, etag = get_catalog_entry("bootstrap", request, lambda: build_bootstrap(request))
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = HttpResponse(payload, content_type="application/json")
+        response["Access-Control-Allow-Origin"] = "*"
+        return add_catalog_headers(response, etag)
+
+class NoiseResponseViewSet(BulkCreateMixin, viewsets.ModelViewSet):
     queryset = NoiseResponse.objects.all()
     serializer_class = NoiseResponseSerializer
     permission_classes = [AllowAny]
     http_method_names = ['post']
+    unique_fields = ['user', 'question']
+    update_fields = ['rating']
+    journal_kind = 'noise-responses'
 
     def create(self, request, *args, **kwargs):
+        # Lists go through BulkCreateMixin.create; anything but bad input stays a 5xx.
         try:
-            print("Incoming POST data:", request.data)
+            logger.debug("Noise response received", extra={'payload': request.data})
             response = super().create(request, *args, **kwargs)
-            print("Saved response:", response.data)
+            logger.debug("Noise response saved", extra={'payload': response.data})
             return response
-        except Exception as e:
-            print("Exception is:", e)
+        except (ValidationError, ParseError) as e:
+            logger.warning(
+                "Noise response rejected (%s)", type(e).__name__,
+                extra={'payload': request.data, 'errors': e.detail},
+            )
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-class AudioEvaluationViewSet(viewsets.ModelViewSet):
+class AudioEvaluationViewSet(BulkCreateMixin, viewsets.ModelViewSet):
     queryset = AudioEvaluation.objects.all()
     serializer_class = AudioEvaluationSerializer
     permission_classes = [AllowAny]
     http_method_names = ['post']
+    unique_fields = ['user', 'audio']
+    update_fields = AudioEvaluation.RATING_FIELDS + ['iso_pleasant', 'iso_eventful']
+    journal_kind = 'evaluations'
+
+    def perform_bulk_create(self, objs):
+        # bulk_create skips pre_save / post_save, so do their work explicitly.
+        objs = self.dedupe(objs)
+        fill_iso_coordinates(objs)
+        self.lock_users(objs)
+        previous = self.get_previous(objs)
+        objs = self.upsert(objs)
+
+        created, updated = [], []
+        for obj in objs:
+            old = previous.get(self.natural_key(obj))
+            if old is None:
+                created.append(obj)
+            else:
+                obj.submitted_at = old['submitted_at']  # not in update_fields
+                updated.append(obj)
+
+        # New evaluations are queued for export, updated ones refresh their queued
+        # row; in the aggregates, updates replace the old values.
+        enqueue_evaluations(created)
+        if updated:
+            refresh_pending_exports(updated)
+        if previous:
+            apply_evaluations(previous.values(), sign=-1)
+        apply_evaluations(objs)
+        return objs
+
+    def lock_users(self, objs):
+        """
+        Locks the submitting participants' rows until the transaction ends.
+        Concurrent retries of the same evaluation then run one after the
+        other, and the second one sees the first as `previous` instead of
+        exporting and counting it again. (SQLite has no row locks; it runs
+        one writer at a time and fails a writer whose read went stale.)
+        """
+        if not connection.features.has_select_for_update:
+            return
+        user_ids = {obj.user_id for obj in objs}
+        list(UserProfile.objects.select_for_update().filter(pk__in=user_ids).order_by('pk').values_list('pk'))
+
+    def get_previous(self, objs):
+        """
+        {(user_id, audio_id): stored values} of the rows this upsert will overwrite.
+        """
+        keys = {self.natural_key(obj) for obj in objs}
+        rows = AudioEvaluation.objects.filter(
+            user_id__in={user_id for user_id, _ in keys},
+            audio_id__in={audio_id for _, audio_id in keys},
+        ).values('user_id', 'audio_id', 'submitted_at', *AudioEvaluation.RATING_FIELDS)
+        return {
+            (row['user_id'], row['audio_id']): row
+            for row in rows if (row['user_id'], row['audio_id']) in keys
+        }
+
+
+class AudioStatsViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Per-audio mean, standard deviation and confidence interval of every rating
+    field, read from the incrementally maintained aggregates.
+    """
+    queryset = AudioRatingAggregate.objects.select_related('audio').order_by('audio_id')
+    serializer_class = AudioRatingStatsSerializer
+    lookup_field = 'audio'
+
+    @action(detail=True, methods=['get'])
+    def soundscape(self, request, audio=None):
+        """
+        Distribution of the clip's ISO 12913-3 (ISOPleasant, ISOEventful) points:
+        mean and spread from SQL sums, and a density grid built in NumPy.
+        """
+        # The clip, not its aggregate row, which may not exist yet.
+        audio = get_object_or_404(Audio, pk=audio)
+        distribution = soundscape_distribution(AudioEvaluation.objects.filter(audio=audio))
+        return Response({'audio': audio.pk, **distribution})
 
 
 class AudioStreamView(View):
-    def get(self, request, audio_id):
+    """
+    Serves an Audio file with byte-range support.
+
+    SURVEY_AUDIO_DELIVERY picks how the bytes leave the process:
+      "stream"           - chunked through Python (default)
+      "sendfile"         - FileResponse, so the WSGI server can use os.sendfile
+                           for full-file requests; ranges are still streamed
+      "x-accel-redirect" - nginx serves the file from SURVEY_AUDIO_ACCEL_PREFIX
+      "x-sendfile"       - Apache/lighttpd serve the file from its absolute path
+
+    ?variant=<name> (or a Save-Data / slow ECT client hint) serves one of the
+    SURVEY_AUDIO_VARIANTS instead of the original. Variants are rendered at
+    ingest; one that is missing is answered with the original.
+
+    /api/stream-audio/<id>/<version>/, with the clip's content hash as the
+    version, is served with SURVEY_AUDIO_IMMUTABLE_CACHE_CONTROL. The bare
+    /api/stream-audio/<id>/ and stale versions redirect to the current one.
+    """
+    cache_control = None
+
+    def get(self, request, audio_id, version=None):
         try:
             audio = Audio.objects.get(id=audio_id)
-            file_path = audio.file.path
         except Audio.DoesNotExist:
             raise Http404("Audio not found")
-        
-        file_size = os.path.getsize(file_path)
-        content_type, _ = mimetypes.guess_type(file_path)
-        if not content_type:
-            content_type = 'audio/wav' if file_path.endswith('.wav') else 'audio/mpeg'
-        
+
+        redirect = self.check_version(request, audio, version)
+        if redirect is not None:
+            return redirect
+        try:
+            file_name, file_path = self.resolve_file(request, audio)
+        except UnknownVariant as e:
+            return HttpResponseBadRequest(f"Unknown audio variant: {e}")
+        info = self.get_file_info(file_path)
+        return self.build_response(request, file_name, file_path, info)
+
+    def check_version(self, request, audio, version):
+        """
+        A redirect to the current versioned URL, or None to serve this one.
+        """
+        current = audio_version(audio)
+        if version == (current or None):
+            if current:
+                self.cache_control = settings.SURVEY_AUDIO_IMMUTABLE_CACHE_CONTROL
+            return None
+        prefix = request.path[:request.path.index(f'/{audio.id}/') + 1]
+        location = stream_path(audio, prefix)
+        if request.META.get('QUERY_STRING'):
+            location += '?' + request.META['QUERY_STRING']
+        response = HttpResponseRedirect(location)
+        response['Cache-Control'] = 'no-cache'  # the target changes with the file
+        response['Access-Control-Allow-Origin'] = '*'
+        return response
+
+    def resolve_file(self, request, audio):
+        """
+        (storage name, absolute path) of the original or the requested variant.
+        """
+        file_name, file_path = audio.file.name, audio.file.path
+        variant = choose_variant(request)
+        if variant:
+            variant_file = get_variant(audio, variant)
+            if variant_file:
+                return variant_file, default_storage.path(variant_file)
+            # Not rendered yet: play the original, but do not let it be cached as the variant.
+            logger.warning("Variant %s missing for %s, serving the original", variant, audio.file.name)
+            self.cache_control = settings.SURVEY_AUDIO_CACHE_CONTROL
+        return file_name, file_path
+
+    def get_file_info(self, file_path):
+        try:
+            return file_info_cache.get(file_path)
+        except FileNotFoundError:
+            raise Http404("Audio file missing")
+
+    def get_delivery(self):
+        return settings.SURVEY_AUDIO_DELIVERY
+
+    def range_body(self, file_path, view, start, length):
+        return iter_range(file_path, view, start, length)
+
+    def multipart_body(self, body):
+        return body
+
+    def build_response(self, request, file_name, file_path, info):
+        # If-None-Match / If-Modified-Since -> 304, If-Match / If-Unmodified-Since -> 412
+        response = get_conditional_response(request, etag=info.etag, last_modified=info.mtime)
+        if response is not None:
+            return self.add_stream_headers(response, info)
+
+        delivery = self.get_delivery()
+        if delivery in ('x-accel-redirect', 'x-sendfile'):
+            # The proxy handles Range and Content-Length itself.
+            response = HttpResponse(content_type=info.content_type)
+            if delivery == 'x-accel-redirect':
+                prefix = settings.SURVEY_AUDIO_ACCEL_PREFIX.rstrip('/')
+                response['X-Accel-Redirect'] = f"{prefix}/{quote(file_name)}"
+            else:
+                response['X-Sendfile'] = file_path
+            return self.add_stream_headers(response, info)
+
+        ranges = None
         range_header = request.META.get('HTTP_RANGE', '').strip()
-        range_match = re.search(r'bytes=(\d+)-(\d*)', range_header) if range_header else None
-        
-        if range_match:
-            start = int(range_match.group(1))
-            end = int(range_match.group(2)) if range_match.group(2) else file_size - 1
+        if range_header and if_range_matches(request, info):
+            ranges = parse_range_header(range_header, info.size)
+        is_head = request.method == 'HEAD'
+
+        view = None
+        if not is_head and ranges != [] and (ranges or delivery != 'sendfile'):
+            view = mmap_cache.get(file_path, info)
+
+        if ranges == []:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{info.size}'
+        elif ranges and len(ranges) == 1:
+            start, end = ranges[0]
             length = end - start + 1
-            
-            file_handle = open(file_path, 'rb')
-            file_handle.seek(start)
-            
             response = StreamingHttpResponse(
-                FileWrapper(file_handle, 8192),
+                () if is_head else self.range_body(file_path, view, start, length),
                 status=206,
-                content_type=content_type
+                content_type=info.content_type
             )
             response['Content-Length'] = str(length)
-            response['Content-Range'] = f'bytes {start}-{end}/{file_size}'
+            response['Content-Range'] = f'bytes {start}-{end}/{info.size}'
+        elif ranges:
+            body = MultipartByteranges(file_path, ranges, info.size, info.content_type, view)
+            response = StreamingHttpResponse(
+                () if is_head else self.multipart_body(body),
+                status=206,
+                content_type=body.content_type
+            )
+            response['Content-Length'] = str(body.length)
+        elif delivery == 'sendfile' and not is_head:
+            response = FileResponse(open(file_path, 'rb'), content_type=info.content_type)
         else:
-            file_handle = open(file_path, 'rb')
             response = StreamingHttpResponse(
-                FileWrapper(file_handle, 8192),
-                content_type=content_type
+                () if is_head else self.range_body(file_path, view, 0, info.size),
+                content_type=info.content_type
             )
-            response['Content-Length'] = str(file_size)
-        
+            response['Content-Length'] = str(info.size)
+
+        return self.add_stream_headers(response, info)
+
+    def add_stream_headers(self, response, info):
+        response['ETag'] = info.etag
+        response['Last-Modified'] = info.last_modified
+        response['Cache-Control'] = self.cache_control or settings.SURVEY_AUDIO_CACHE_CONTROL
         response['Accept-Ranges'] = 'bytes'
         response['Access-Control-Allow-Origin'] = '*'
         response['Access-Control-Expose-Headers'] = 'Content-Length, Content-Range, Accept-Ranges'
         response['X-Content-Type-Options'] = 'nosniff'
-        
+        patch_vary_headers(response, ('Save-Data', 'ECT'))
+
         return response
-    
-    def options(self, request, audio_id):
+
+    def options(self, request, audio_id, version=None):
         response = HttpResponse()
         response['Access-Control-Allow-Origin'] = '*'
         response['Access-Control-Allow-Methods'] = 'GET, HEAD, OPTIONS'
         response['Access-Control-Allow-Headers'] = 'Range, Content-Type'
-        return response
\ No newline at end of file
+        return response
+
+
+class AudioCacheStatsView(View):
+    """
+    Hit/miss counters of this worker's memory-mapped clip cache.
+    """
+
+    def get(self, request):
+        return JsonResponse(mmap_cache.stats())
+
+
+@method_decorator(staff_member_required, name='dispatch')
+class ResearchExportView(View):
+    """
+    Wide-format export of every evaluation, streamed as CSV (default) or
+    written as Parquet with ?format=parquet. Staff only.
+    """
+
+    def get(self, request):
+        file_format = request.GET.get('format', 'csv')
+        if file_format == 'csv':
+            response = StreamingHttpResponse(stream_reads(iter_csv()), content_type='text/csv')
+            response['Content-Disposition'] = 'attachment; filename="user_survey_analysis.csv"'
+            return response
+        if file_format == 'parquet':
+            # Parquet writes its footer last, so it goes through a temp file rather than the socket.
+            f = tempfile.TemporaryFile()
+            try:
+                write_parquet(f)
+            except ParquetUnavailable as e:
+                f.close()
+                return HttpResponse(str(e), status=501, content_type='text/plain')
+            f.seek(0)
+            return FileResponse(
+                f, as_attachment=True, filename='user_survey_analysis.parquet',
+                content_type='application/vnd.apache.parquet',
+            )
+        return HttpResponseBadRequest("format must be csv or parquet")
+
+
+@method_decorator(staff_member_required, name='dispatch')
+class AudioUploadView(View):
+    """
+    Starts a resumable upload: POST {"title", "filename", "size"}.
+    See survey/uploads.py for the protocol.
+    """
+
+    def post(self, request):
+        try:
+            data = json.loads(request.body or b'{}')
+            upload = start_upload(data.get('title'), data.get('filename'), data.get('size'))
+        except (ValueError, AttributeError) as e:
+            return upload_error_response(e)
+        response = JsonResponse(upload_state(upload), status=201)
+        response['Location'] = f"/api/uploads/{upload.pk}/"
+        return response
+
+
+@method_decorator(staff_member_required, name='dispatch')
+class AudioUploadChunkView(View):
+    """
+    GET reports the offset to resume from, PUT writes the next chunk
+    (Content-Range: bytes <start>-<end>/<size>) and DELETE aborts the upload.
+    """
+
+    def get_upload(self, upload_id):
+        try:
+            return AudioUpload.objects.get(pk=upload_id)
+        except AudioUpload.DoesNotExist:
+            raise Http404("Upload not found")
+
+    def get(self, request, upload_id):
+        # The offset to resume from must be current: a PUT that dropped
+        # mid-transfer never set the sticky cookie.
+        with primary_reads():
+            return JsonResponse(upload_state(self.get_upload(upload_id)))
+
+    def put(self, request, upload_id):
+        upload = self.get_upload(upload_id)
+        try:
+            start, length = parse_content_range(request.headers.get('Content-Range'), upload.size)
+            if int(request.META.get('CONTENT_LENGTH') or length) != length:
+                raise UploadError("Content-Length does not match Content-Range")
+            # request.read() streams the body; request.body would buffer it.
+            write_chunk(upload, start, length, request)
+        except UploadError as e:
+            return upload_error_response(e, upload)
+        return JsonResponse(upload_state(upload))
+
+    def delete(self, request, upload_id):
+        abort_upload(self.get_upload(upload_id))
+        return HttpResponse(status=204)
+
+
+@method_decorator(staff_member_required, name='dispatch')
+class AudioUploadFinalizeView(View):
+    """
+    Registers the Audio for a complete upload; repeating it is harmless.
+    """
+
+    def post(self, request, upload_id):
+        try:
+            audio = finalize_upload(upload_id)
+        except AudioUpload.DoesNotExist:
+            raise Http404("Upload not found")
+        except UploadError as e:
+            return upload_error_response(e)
+        return JsonResponse(AudioSerializer(audio, context={'request': request}).data, status=201)
+
+
+def upload_error_response(error, upload=None):
+    body = {'detail': str(error)}
+    if upload is not None and upload.pk is not None:  # None once an invalid upload was deleted
+        body['offset'] = upload.received
+    return JsonResponse(body, status=getattr(error, 'status', 400))
+
+
+class MetricsView(View):
+    """
+    Prometheus text exposition of this process's metrics (see survey/metrics.py).
+    Scrapes must send SURVEY_METRICS_TOKEN as a bearer token; without a
+    token configured, only staff users may read it.
+    """
+
+    def get(self, request):
+        token = settings.SURVEY_METRICS_TOKEN
+        if token:
+            if request.headers.get('Authorization') != f'Bearer {token}':
+                return HttpResponse(status=401)
+        elif not request.user.is_staff:
+            return HttpResponse(status=403)
+        return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class AsyncAudioStreamView(AudioStreamView):
+    """
+    AudioStreamView for ASGI servers (uvicorn, daphne). File reads happen in
+    worker threads and the body is an async iterator, so a slow download holds
+    a coroutine rather than a thread for its whole length.
+    """
+
+    async def get(self, request, audio_id, version=None):
+        try:
+            audio = await Audio.objects.aget(id=audio_id)
+        except Audio.DoesNotExist:
+            raise Http404("Audio not found")
+
+        redirect = self.check_version(request, audio, version)
+        if redirect is not None:
+            return redirect
+
+        try:
+            file_name, file_path = await sync_to_async(self.resolve_file)(request, audio)
+        except UnknownVariant as e:
+            return HttpResponseBadRequest(f"Unknown audio variant: {e}")
+        info = await sync_to_async(self.get_file_info, thread_sensitive=False)(file_path)
+        return await sync_to_async(self.build_response, thread_sensitive=False)(
+            request, file_name, file_path, info
+        )
+
+    async def options(self, request, audio_id, version=None):
+        return super().options(request, audio_id, version)
+
+    def get_delivery(self):
+        # FileResponse is iterated synchronously, which ASGI would buffer whole.
+        delivery = super().get_delivery()
+        return 'stream' if delivery == 'sendfile' else delivery
+
+    def range_body(self, file_path, view, start, length):
+        return aiter_range(file_path, view, start, length)
+
+    def multipart_body(self, body):
+        return body.aiter()
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncSubmissionView(View):
+    """
+    Async entry point for one of the DRF create endpoints. Parsing, validation
+    and the ORM writes run in the viewset through sync_to_async, so they keep
+    their transaction handling while the event loop stays free.
+    """
+    viewset = None
+    http_method_names = ['post', 'options']
+
+    async def post(self, request, *args, **kwargs):
+        view = self.viewset.as_view({'post': 'create'})
+        return await sync_to_async(view)(request, *args, **kwargs)